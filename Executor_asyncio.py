@@ -3,58 +3,175 @@ import asyncpg
 import csv
 import uuid
 from tqdm import tqdm
-import tempfile
-import os
+import io
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from utils.columnar import write_parquet
 from utils.async_s3utils import async_S3Utils
+from utils.s3utils import S3Utils
+from utils.buffer_pool import BufferPool
 import time
 from connectors.redshift.connect import AsyncRedshiftConnector
 from connectors.sql.connect import AsyncMysqlConnector
 
 
 async_s3utils = async_S3Utils()
-
-async def write_batch_to_csv(batch, headers):
-    fd, path = tempfile.mkstemp(suffix='.csv', prefix='batch_', text=True)
-    with open(fd, mode='w', newline='') as csv_file:
-        writer = csv.writer(csv_file)
-        if headers:  # Write headers only for the first batch
-            writer.writerow(headers)
-        for record in batch:
-            writer.writerow(record)
-    return path
+# COPY exports stream into the blocking multipart writer from worker threads
+s3utils = S3Utils()
+# Serialization buffers are reused from batch to batch
+buffer_pool = BufferPool()
+
+def write_batch_to_csv(batch, headers, out):
+    if isinstance(batch, pa.RecordBatch):
+        # Arrow writes the columns directly; headers only decide whether the header row is written
+        pa_csv.write_csv(batch, out, pa_csv.WriteOptions(include_header=bool(headers)))
+        return
+    csv_file = io.TextIOWrapper(out, encoding='utf-8', newline='', write_through=True)
+    writer = csv.writer(csv_file)
+    if headers:
+        writer.writerow(headers)
+    writer.writerows(batch)
+    csv_file.detach()
+
+def write_batch_to_parquet(batch, headers, out, row_group_size=None, compression='snappy'):
+    write_parquet(batch, headers, out, row_group_size, compression)
 
 def record_to_tuple(record): 
     return tuple(record.values()) if type(record) != tuple else record
 
-def open_read_close(file_path):
-    with open(file_path, 'r') as file:
-        return file.read()
+def serialize_batch(batch, headers, out, writer_options):
+    if writer_options.get('format', 'csv') == 'parquet':
+        write_batch_to_parquet(batch, batch.schema.names, out,
+                               writer_options.get('row_group_size'),
+                               writer_options.get('compression', 'snappy'))
+    else:
+        if not isinstance(batch, pa.RecordBatch):
+            batch = [record_to_tuple(record) for record in batch]
+        write_batch_to_csv(batch, headers, out)
+
+
+async def upload_part(s3_key, buf):
+    _, _, uploaded = await async_s3utils.upload_buffer(s3_key, buf)
+    if not uploaded:
+        # upload_file reports failures instead of raising; a lost part must fail the run
+        raise RuntimeError(f"Upload of {s3_key} failed")
+
+
+async def staged_pipeline(connections, query, s3_key_prefix, progress_bar, columnar=False, writer_options=None,
+                          serialize_workers=2, upload_workers=4, queue_size=4):
+    """
+    Fetch, serialize and upload as concurrent stages joined by bounded queues.
+
+    Every connection runs its own fetch loop over a shared batch counter,
+    serialization runs in worker threads and uploads overlap with both, so
+    throughput approaches the slowest stage instead of the sum of all three.
+    A full queue blocks the stage feeding it, which bounds memory to roughly
+    ``2 * queue_size`` batches.
+    """
+    writer_options = writer_options or {}
+    output_format = writer_options.get('format', 'csv')
+    # Parquet keeps the source column types, so it always takes the columnar fetch
+    columnar = columnar or output_format == 'parquet'
+    fetched = asyncio.Queue(maxsize=queue_size)
+    serialized = asyncio.Queue(maxsize=queue_size)
+    state = {'next_batch': 0, 'exhausted': False}
+
+    async def fetch_stage(connection):
+        while not state['exhausted']:
+            batch_number = state['next_batch']
+            state['next_batch'] += 1
+            if columnar:
+                batch = await connection.fetch_batch_arrow(query, batch_number)
+                headers = batch.schema.names
+            else:
+                batch, headers = await connection.fetch_batch(query, batch_number)
+            if not batch:
+                # Every later batch is empty too
+                state['exhausted'] = True
+                break
+            await fetched.put((batch_number, batch, headers))
+
+    async def serialize_stage():
+        while (item := await fetched.get()) is not None:
+            batch_number, batch, headers = item
+            buf = buffer_pool.acquire(writer_options.get('spill_threshold'))
+            try:
+                await asyncio.to_thread(serialize_batch, batch, headers, buf, writer_options)
+                await serialized.put((f"{s3_key_prefix}_part_{batch_number}.{output_format}", buf))
+            except BaseException:
+                # The upload stage only releases buffers it receives
+                buffer_pool.release(buf)
+                raise
+
+    async def upload_stage():
+        while (item := await serialized.get()) is not None:
+            s3_key, buf = item
+            try:
+                await upload_part(s3_key, buf)
+            finally:
+                buffer_pool.release(buf)
+            progress_bar.update(1)
+
+    async def run_stage(workers, downstream=None, downstream_workers=0):
+        await asyncio.gather(*workers)
+        # One sentinel per downstream worker once this stage has drained
+        for _ in range(downstream_workers):
+            await downstream.put(None)
+
+    tasks = [
+        asyncio.create_task(run_stage([fetch_stage(connection) for connection in connections],
+                                      fetched, serialize_workers)),
+        asyncio.create_task(run_stage([serialize_stage() for _ in range(serialize_workers)],
+                                      serialized, upload_workers)),
+        asyncio.create_task(run_stage([upload_stage() for _ in range(upload_workers)])),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+
 
-async def batch_pipeline(connection, query, s3_key_prefix, progress_bar):
+async def stream_pipeline(connection, query, s3_key_prefix, progress_bar):
+    """Run the query once on a server-side cursor and upload it chunk by chunk."""
     batch_number = 0
 
-    while True:
-        batch, headers = await connection.fetch_batch(query, batch_number)
-        if not batch:
-            break
-
-        # Convert asyncpg.Record objects to tuples (assuming they aren't already)
+    async for batch, headers in connection.stream_records(query):
         batch_tuples = [record_to_tuple(record) for record in batch]
-
-        # Asynchronously write batch to CSV
-        csv_path = await write_batch_to_csv(batch_tuples, headers)
-
         s3_key = f"{s3_key_prefix}_part_{batch_number}.csv"
-        data = await asyncio.to_thread(open_read_close, csv_path)
-        upload_task = asyncio.create_task(async_s3utils.upload_file(s3_key, data))
-
-        await upload_task
-        os.remove(csv_path)
+        with buffer_pool.buffer() as buf:
+            await asyncio.to_thread(write_batch_to_csv, batch_tuples, headers, buf)
+            await upload_part(s3_key, buf)
         progress_bar.update(1)
 
         batch_number += 1
 
 
+async def copy_pipeline(connection, query, s3_key_prefix, copy_format='csv'):
+    """
+    Export the query with COPY TO STDOUT, streaming it into a concurrent multipart upload.
+
+    Every chunk asyncpg receives goes to the writer as it arrives, so parts are
+    uploaded while the database is still producing data and nothing is staged on disk.
+    """
+    extension = 'csv' if copy_format == 'csv' else 'bin'
+    writer = await asyncio.to_thread(s3utils.open_multipart_writer, f"{s3_key_prefix}_part_0.{extension}")
+
+    async def write_chunk(data):
+        # write blocks while the writer's in-flight parts are full, so keep it off the event loop
+        await asyncio.to_thread(writer.write, data)
+
+    try:
+        await connection.copy_export(query, write_chunk, copy_format)
+    except BaseException:
+        await asyncio.to_thread(writer.abort)
+        raise
+    summary = await asyncio.to_thread(writer.close)
+    print(f"Uploaded {summary['bytes']} bytes in {len(summary['parts'])} parts in {summary['seconds']:.2f}s")
+    return summary
+
+
 async def main():
     # Set the connection params for asyncpg
     conn_params = {
@@ -75,12 +192,29 @@ async def main():
 
     db = "redshift"
     db_query = "SELECT * FROM transactions"
+    # Single server-side cursor instead of LIMIT/OFFSET batches
+    stream = False
+    # 'csv' or 'binary' to export with COPY TO STDOUT (Postgres-compatible sources only)
+    copy_format = None
+    # Fetch batches as Arrow RecordBatches typed from the result description
+    columnar = False
+    # Output format: {'format': 'csv'} or {'format': 'parquet', 'row_group_size': 100000, 'compression': 'zstd'}
+    writer_options = {'format': 'csv'}
+    # Concurrency of the fetch (one connection each), serialize and upload stages
+    stages = {'fetch': 1, 'serialize': 2, 'upload': 4, 'queue_size': 4}
+    if copy_format and db.lower() not in ['postgresql', 'redshift']:
+        raise ValueError(f"COPY export needs a Postgres-compatible source, not {db}; use stream or batches instead")
     if db.lower() == 'mysql':
-        connector = AsyncMysqlConnector(**conn_params)
+        connector_class = AsyncMysqlConnector
     elif db.lower() in ['postgresql','redshift']:
-        connector = AsyncRedshiftConnector(**conn_params)
+        connector_class = AsyncRedshiftConnector
+    connectors = [connector_class(**conn_params) for _ in range(stages['fetch'])]
+    connector = connectors[0]
     # Open MySQL connection
-    await connector.open_connection()
+    for fetch_connector in connectors:
+        await fetch_connector.open_connection()
+    # One pooled S3 client shared by every upload
+    await async_s3utils.open()
 
     # S3 bucket details
     s3_key_prefix = f'data_testing/{uuid.uuid1()}'
@@ -89,10 +223,19 @@ async def main():
         # We use tqdm with unknown total, using the 'unit_scale' to show the iterations
         with tqdm(desc='Processing Batches', unit='batch', unit_scale=True) as progress_bar:
             # No total is passed to tqdm
-            await batch_pipeline(connector,db_query, s3_key_prefix, progress_bar)
+            if copy_format:
+                await copy_pipeline(connector, db_query, s3_key_prefix, copy_format)
+                progress_bar.update(1)
+            elif stream:
+                await stream_pipeline(connector, db_query, s3_key_prefix, progress_bar)
+            else:
+                await staged_pipeline(connectors, db_query, s3_key_prefix, progress_bar, columnar, writer_options,
+                                      stages['serialize'], stages['upload'], stages['queue_size'])
     finally:    
         print("Total Time : " + str(time.time()-st_time))
-        await connector.close_connection()
+        for fetch_connector in connectors:
+            await fetch_connector.close_connection()
+        await async_s3utils.close()
 asyncio.run(main())
 
 
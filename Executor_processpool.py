@@ -1,6 +1,4 @@
-from itertools import repeat
 from uuid import uuid1 
-import tempfile
 import os
 from utils.async_s3utils import async_S3Utils
 from utils.s3utils import S3Utils
@@ -8,13 +6,23 @@ import time
 from connectors.redshift.connect import AsyncRedshiftConnector,RedshiftConnector
 from connectors.sql.connect import AsyncMysqlConnector,MysqlConnector
 from concurrent.futures import ProcessPoolExecutor
+from utils.partitioning import plan_partitions, split_partition
+from utils.worker_connection import init_worker, get_worker_connection
+from utils.columnar import write_parquet, to_arrow_table
+from utils.profiling import profile_frame
+from utils.manifest import build_manifest, write_manifest
+from utils.checksum import checksum_spec, part_checksums
+from utils.checkpoint import Checkpoint
+from utils.scheduler import run_units, UnitsFailedError
+from utils.snapshot import SnapshotCoordinator
 from tqdm import tqdm
 import json
 from decimal import Decimal
 from datetime import date, datetime
-import traceback
 import pandas as pd
-import pathlib
+import pyarrow as pa
+import io
+from utils.buffer_pool import BufferPool, buffer_md5
 
 class CustomJsonEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -28,23 +36,33 @@ class CustomJsonEncoder(json.JSONEncoder):
 async_s3utils = async_S3Utils()
 s3utils = S3Utils()
 
+# Serialization buffers are reused across the batches a worker handles
+buffer_pool = BufferPool()
 
-def write_batch_to_json_pandas(batch_tuples, headers, batch_number):
+
+def write_batch_to_json_pandas(batch_tuples, headers, out):
     st_time = time.time()
-    file_name = f"batch_{batch_number}_{uuid1()}.json"
 
     # Ensure that headers are not None or empty
 
-    # Create Pandas DataFrame
-    df = pd.DataFrame(batch_tuples, columns=headers)
+    # Create Pandas DataFrame; a RecordBatch already carries its column names and types
+    if isinstance(batch_tuples, pa.RecordBatch):
+        df = batch_tuples.to_pandas()
+    else:
+        df = pd.DataFrame(batch_tuples, columns=headers)
     
-    # Convert the DataFrame to JSON and write to a file
-    file_path = pathlib.Path(tempfile.gettempdir()) / file_name
-    df.to_json(file_path, orient='records', lines=True)
+    # Convert the DataFrame to JSON and write it into the binary buffer
+    text_out = io.TextIOWrapper(out, encoding='utf-8', write_through=True)
+    df.to_json(text_out, orient='records', lines=True)
+    text_out.detach()
     
     duration = time.time() - st_time
     # print(f"Time Taken: {duration:.4f} seconds")
-    return str(file_path)
+    return df
+
+
+def write_batch_to_parquet(batch, headers, out, row_group_size=None, compression='snappy'):
+    write_parquet(batch, headers, out, row_group_size, compression)
 
 
 # This function will convert asyncpg.Record objects into tuples (which are picklable)
@@ -73,20 +91,46 @@ def connector_selector(db,db_params):
 #     return count,batch_size
 
 
-def fetch_records_count(db,db_params, query):
-    connector = connector_selector(db,db_params)
-    connector.open_connection()
-    count = connector.fetch_count(query)
-    batch_size = connector.batch_size
-    connector.close_connection()
+# The planning helpers open their own connection unless given an open one,
+# e.g. the snapshot coordinator's so the plan reads the same view as the workers
+
+def fetch_records_count(db,db_params, query, connector=None):
+    planning_connector = connector or connector_selector(db,db_params)
+    if connector is None:
+        planning_connector.open_connection()
+    count = planning_connector.fetch_count(query)
+    batch_size = planning_connector.batch_size
+    if connector is None:
+        planning_connector.close_connection()
     return count,batch_size
 
-def run_fetch_batch(db, db_params, query, batch_number):
-    connector = connector_selector(db, db_params)
-    connector.open_connection()
-    batch, headers = connector.fetch_batch(query, batch_number)
-    print(headers)
-    connector.close_connection()
+def fetch_keyset_boundaries(db, db_params, query, key_column, connector=None):
+    planning_connector = connector or connector_selector(db, db_params)
+    if connector is None:
+        planning_connector.open_connection()
+    boundaries = planning_connector.fetch_keyset_boundaries(query, key_column)
+    if connector is None:
+        planning_connector.close_connection()
+    return boundaries
+
+def fetch_partition_plan(db, db_params, query, split_column, partitions, use_quantiles=False, connector=None):
+    planning_connector = connector or connector_selector(db, db_params)
+    if connector is None:
+        planning_connector.open_connection()
+    plan = plan_partitions(planning_connector, query, split_column, partitions, use_quantiles)
+    if connector is None:
+        planning_connector.close_connection()
+    return plan
+
+def run_fetch_batch(db, db_params, query, batch_number, key_column=None, last_key=None, columnar=False):
+    # Reuse this worker's connection instead of a new handshake per batch
+    worker_connection = get_worker_connection(connector_selector, db, db_params)
+    if columnar:
+        batch = worker_connection.run('fetch_batch_arrow', query, batch_number,
+                                      key_column=key_column, last_key=last_key)
+        return batch, batch.schema.names
+    batch, headers = worker_connection.run('fetch_batch', query, batch_number,
+                                           key_column=key_column, last_key=last_key)
 
     # Check if headers is None or empty, setting default headers if needed
     if not headers:
@@ -177,28 +221,219 @@ def run_fetch_batch(db, db_params, query, batch_number):
     
 #     return 1
 
-def batch_pipeline(db, db_params, query, s3_key_prefix, batch_number):
-    batch, headers = run_fetch_batch(db, db_params, query, batch_number)
+def upload_batch(batch, headers, s3_key_prefix, batch_number, writer_options=None):
+    """
+    Serialize one batch and upload it as ``{s3_key_prefix}_part_{batch_number}.{format}``.
+
+    ``writer_options`` selects the output: ``{'format': 'json'}`` (default) or
+    ``{'format': 'parquet', 'row_group_size': ..., 'compression': 'snappy' | 'zstd'}``.
+    Batches are serialized in memory; set ``spill_threshold`` (bytes) to stage
+    batches larger than that on local disk instead. A normalized ``checksum``
+    option (see ``utils.checksum.checksum_spec``) adds the part's bucket checksums.
+
+    Returns the part's manifest entry: its key, row count, byte size, MD5 and
+    the column profile computed from the frame that was serialized.
+    """
+    writer_options = writer_options or {}
+    output_format = writer_options.get('format', 'json')
+    s3_key = f"{s3_key_prefix}_part_{batch_number}.{output_format}"
+
+    with buffer_pool.buffer(writer_options.get('spill_threshold')) as buf:
+        if output_format == 'parquet':
+            write_batch_to_parquet(batch, headers, buf,
+                                   writer_options.get('row_group_size'),
+                                   writer_options.get('compression', 'snappy'))
+            df = to_arrow_table(batch, headers).to_pandas()
+        else:
+            if isinstance(batch, pa.RecordBatch):
+                batch_tuples = batch
+            else:
+                batch_tuples = [record_to_tuple(record) for record in batch]
+            df = write_batch_to_json_pandas(batch_tuples, headers, buf)
+        part_bytes = buf.seek(0, io.SEEK_END)
+        part_md5 = buffer_md5(buf)
+
+        # Upload the buffer to S3 without copying it
+        _, _, uploaded = s3utils.upload_buffer(s3_key, buf)
+    if not uploaded:
+        # upload_file reports failures instead of raising; raise so the unit is retried, not journaled as done
+        raise RuntimeError(f"Upload of {s3_key} failed")
+    # print(f"Batch {batch_number} processing and upload completed")
+    part = {'key': s3_key, 'rows': len(df), 'bytes': part_bytes, 'md5': part_md5, 'stats': profile_frame(df)}
+    if writer_options.get('checksum'):
+        part['checksums'] = part_checksums(df, writer_options['checksum'])
+    return part
+
+def batch_pipeline(db, db_params, query, s3_key_prefix, batch_number, key_column=None, last_key=None,
+                   columnar=False, writer_options=None):
+    batch, headers = run_fetch_batch(db, db_params, query, batch_number, key_column, last_key, columnar)
     if not batch:
         # print(f"No more records to fetch for batch {batch_number}.")
-        return 0
+        return None
 
-    batch_tuples = [record_to_tuple(record) for record in batch]
-    json_path = write_batch_to_json_pandas(batch_tuples, headers, batch_number)
+    return upload_batch(batch, headers, s3_key_prefix, batch_number, writer_options)
 
-    # Define the S3 key and upload the JSON file
-    s3_key = f"{s3_key_prefix}_part_{batch_number}.json"
-    with open(json_path, 'rb') as f:
-        data = f.read()
+def stream_pipeline(db, db_params, query, s3_key_prefix, progress_bar, chunk_size=None, writer_options=None,
+                    columnar=False):
+    """
+    Extract a query over a single connection with a server-side cursor.
 
-    # Upload the file to S3
-    s3utils.upload_file(s3_key, data)
-    
-    # Clean up local temporary JSON file
-    os.remove(json_path)
-    # print(f"Batch {batch_number} processing and upload completed")
-    
-    return 1
+    Each chunk is written and uploaded as soon as it arrives, so the query
+    runs once and only one chunk is held in memory at a time. With ``columnar``
+    chunks are typed from the cursor description, so every part has the same schema.
+    """
+    connector = connector_selector(db, db_params)
+    connector.open_connection()
+    parts = []
+    try:
+        for batch_number, (batch, headers) in enumerate(connector.stream_records(query, chunk_size, columnar)):
+            parts.append(upload_batch(batch, headers, s3_key_prefix, batch_number, writer_options))
+            progress_bar.update(1)
+    finally:
+        connector.close_connection()
+    return parts
+
+def copy_pipeline(db, db_params, query, s3_key_prefix, copy_format='csv'):
+    """
+    Export a query with COPY (query) TO STDOUT, skipping row objects entirely.
+
+    COPY output is written straight into a concurrent multipart upload, so
+    parts go to S3 while the database is still producing data.
+    """
+    connector = connector_selector(db, db_params)
+    connector.open_connection()
+    extension = 'csv' if copy_format == 'csv' else 'bin'
+    s3_key = f"{s3_key_prefix}_part_0.{extension}"
+    try:
+        with s3utils.open_multipart_writer(s3_key) as writer:
+            connector.copy_export(query, writer, copy_format)
+        summary = writer.summary()
+        print(f"Uploaded {summary['bytes']} bytes in {len(summary['parts'])} parts "
+              f"in {summary['seconds']:.2f}s")
+    finally:
+        connector.close_connection()
+    # COPY output never passes through a DataFrame, so there is no row count or profile
+    return [{'key': s3_key, 'rows': None, 'bytes': summary['bytes'], 'md5': summary['md5'], 'stats': None}]
+
+def partition_pipeline(db, db_params, query, s3_key_prefix, split_column, partition, max_partition_rows=None,
+                       writer_options=None, columnar=False):
+    """
+    Extract one range partition and upload it as its own part.
+
+    Returns ``(children, part)``: the child partitions when the range holds more
+    than ``max_partition_rows`` rows, so the caller can schedule them instead,
+    otherwise the uploaded part's manifest entry (None for an empty range).
+    """
+    # Parquet parts are typed from the cursor description rather than inferred per part
+    fetch_method = 'fetch_range_arrow' if columnar else 'fetch_range'
+    worker_connection = get_worker_connection(connector_selector, db, db_params)
+    if max_partition_rows:
+        # Probe the size on the split column alone before pulling any full rows
+        rows = worker_connection.run('count_range', query, split_column, partition, max_partition_rows + 1)
+        if rows > max_partition_rows:
+            children = split_partition(partition)
+            if children:
+                return children, None
+            # The range cannot be narrowed any further, so take it whole
+    batch, headers = worker_connection.run(fetch_method, query, split_column, partition)
+
+    if len(batch):
+        return [], upload_batch(batch, headers, s3_key_prefix, partition['partition_id'], writer_options)
+    return [], None
+
+def partition_unit(partition):
+    return f"partition_{partition['partition_id']}", partition
+
+def batch_unit(batch_number, last_key=None):
+    return f"batch_{batch_number}", (batch_number, last_key)
+
+def run_partitions(executor, db, db_params, query, s3_key_prefix, split_column, plan,
+                   max_partition_rows, progress_bar, writer_options=None,
+                   checkpoint=None, run_id=None, completed=None, retries=3, columnar=False):
+    """
+    Extract ``plan`` partitions, replacing skewed ones by their sub-ranges as they are found.
+
+    With a ``checkpoint`` every uploaded part is journaled under ``run_id``; partitions
+    (or sub-ranges) already in ``completed`` are not extracted again. Failed partitions
+    are retried with backoff while the others keep running.
+
+    :return: The manifest entries of the parts uploaded by this call.
+    """
+    completed = completed or {}
+    parts = []
+
+    def submit(executor, partition):
+        return executor.submit(partition_pipeline, db, db_params, query, s3_key_prefix,
+                               split_column, partition, max_partition_rows, writer_options, columnar)
+
+    def on_result(unit_id, partition, result):
+        children, part = result
+        if children:
+            # A skewed range is replaced by its sub-ranges, minus those a previous attempt finished
+            child_units = [partition_unit(child) for child in children if partition_unit(child)[0] not in completed]
+            progress_bar.total += len(child_units) - 1
+            progress_bar.refresh()
+            return child_units
+        if checkpoint:
+            checkpoint.record_done(run_id, unit_id, part)
+        if part:
+            parts.append(part)
+        progress_bar.update(1)
+        return []
+
+    units = [partition_unit(partition) for partition in plan]
+    run_units(executor, submit, [unit for unit in units if unit[0] not in completed], on_result,
+              on_failure=journal_failure(checkpoint, run_id), retries=retries)
+    return parts
+
+def run_batches(executor, db, db_params, query, s3_key_prefix, units, progress_bar, key_column=None,
+                columnar=False, writer_options=None, checkpoint=None, run_id=None, retries=3):
+    """
+    Extract batch units (from ``batch_unit``), journaling each uploaded part in ``checkpoint``.
+
+    :return: The manifest entries of the parts uploaded by this call.
+    """
+    parts = []
+
+    def submit(executor, payload):
+        batch_number, last_key = payload
+        return executor.submit(batch_pipeline, db, db_params, query, s3_key_prefix, batch_number,
+                               key_column, last_key, columnar, writer_options)
+
+    def on_result(unit_id, payload, part):
+        if checkpoint:
+            checkpoint.record_done(run_id, unit_id, part)
+        if part:
+            parts.append(part)
+        progress_bar.update(1)
+        return []
+
+    run_units(executor, submit, units, on_result, on_failure=journal_failure(checkpoint, run_id),
+              retries=retries)
+    return parts
+
+def plan_units(db, db_params, query, split_column, key_column, partitions, connector=None):
+    """
+    Plan the units of a run: range partitions on ``split_column``, else batches.
+
+    :return: ``(mode, plan)``, journaled so a resumed run extracts exactly the same units and keys.
+    """
+    if split_column:
+        return 'partitions', fetch_partition_plan(db, db_params, query, split_column, partitions,
+                                                  connector=connector)
+    if key_column:
+        last_keys = fetch_keyset_boundaries(db, db_params, query, key_column, connector)
+    else:
+        rows_count, batch_size = fetch_records_count(db, db_params, query, connector)
+        last_keys = [None] * -(-rows_count // batch_size)
+    return 'batches', [batch_unit(batch_number, last_key) for batch_number, last_key in enumerate(last_keys)]
+
+def journal_failure(checkpoint, run_id):
+    if checkpoint is None:
+        return None
+    def on_failure(unit_id, error, final):
+        checkpoint.record_failure(run_id, unit_id, error, final)
+    return on_failure
 
 # def batch_pipeline(db,db_params, query, s3_key_prefix, batch_number):
 #     batch, headers = run_fetch_batch(db,db_params, query, batch_number)
@@ -247,41 +482,127 @@ def main():
 
     db = "mysql" if db_params == mysqlparmas else "redshift"
     db_query = "SELECT * FROM transactions"
-    uuid = str(uuid1())
-    print(uuid)
-    s3_key_prefix = f'data_testing/{uuid}/{uuid}'
-    
-    rows_count, batch_size = fetch_records_count(db,db_params, db_query)
-    batch_numbers = range(-(-rows_count // batch_size))
+    # Ordered unique column to page on (keyset pagination); None falls back to LIMIT/OFFSET
+    key_column = None
+    # Numeric/timestamp column to range-partition on; takes precedence over key_column
+    split_column = None
+    max_partition_rows = 500000
+    # Single connection, server-side cursor extraction; bounded by one chunk of memory
+    stream = False
+    # 'csv' or 'binary' to export with COPY TO STDOUT (Postgres-compatible sources only)
+    copy_format = None
+    # Output format: {'format': 'json'} or {'format': 'parquet', 'row_group_size': 100000, 'compression': 'zstd'};
+    # add 'spill_threshold': <bytes> to stage oversized batches on disk
+    writer_options = {'format': 'json'}
+    # Fetch batches as Arrow RecordBatches typed from the cursor description; Parquet needs the source types
+    columnar = writer_options['format'] == 'parquet'
+    # Record bucket checksums in manifest.json for utils.checksum.verify_manifest, e.g.
+    # {'key_column': 'id', 'columns': ['id', 'tx_datetime'], 'width': 1000}
+    checksum = None
+    if checksum:
+        writer_options['checksum'] = checksum_spec(checksum, connector_selector(db, db_params).checksum_hash)
+    # Completed parts are journaled here; set resume_run to a crashed run's uuid to finish it
+    # under the same prefix, extracting only what is missing
+    checkpoint_path = 'export_checkpoint.sqlite'
+    resume_run = None
+    # Attempts per batch/partition after the first, with exponential backoff
+    retries = 3
+    # Read every batch from one point-in-time view: pg_export_snapshot for Postgres-compatible
+    # sources, consistent snapshots started under a global read lock for MySQL
+    consistent_snapshot = False
+    max_workers = os.cpu_count() - 1 or 1
 
-    # Create a progress bar to track the process
-    progress_bar = tqdm(total=len(batch_numbers), desc='Processing Batches', unit='batch', unit_scale=True)
+    if copy_format and db.lower() not in ['postgresql', 'redshift']:
+        raise ValueError(f"COPY export needs a Postgres-compatible source, not {db}; use stream or batches instead")
+
+    if copy_format or stream:
+        # Single-connection modes produce their parts in one pass and are not checkpointed
+        uuid = str(uuid1())
+        print(uuid)
+        s3_key_prefix = f'data_testing/{uuid}/{uuid}'
+        if copy_format:
+            parts = copy_pipeline(db, db_params, db_query, s3_key_prefix, copy_format)
+        else:
+            with tqdm(desc='Processing Chunks', unit='chunk', unit_scale=True) as progress_bar:
+                parts = stream_pipeline(db, db_params, db_query, s3_key_prefix, progress_bar,
+                                        writer_options=writer_options, columnar=columnar)
+        write_manifest(s3utils, build_manifest(parts, s3_key_prefix, db_query, split_column or key_column,
+                                           writer_options.get('checksum')))
+        return
+
+    if consistent_snapshot and resume_run:
+        # Units finished by the crashed run read an older view than a new snapshot would
+        raise ValueError("A consistent-snapshot run cannot be resumed; start a new run")
+    if consistent_snapshot:
+        # A retried unit would run in a new transaction outside the shared snapshot
+        retries = 0
+
+    checkpoint = Checkpoint(checkpoint_path)
+    if resume_run:
+        run = checkpoint.get_run(resume_run)
+        if run is None:
+            raise ValueError(f"No checkpointed run {resume_run} in {checkpoint_path}")
+        uuid, s3_key_prefix, mode, plan = resume_run, run['prefix'], run['mode'], run['plan']
+        completed = checkpoint.completed(uuid)
+        print(f"Resuming {uuid}: {len(completed)} parts already uploaded")
+    else:
+        uuid = str(uuid1())
+        print(uuid)
+        s3_key_prefix = f'data_testing/{uuid}/{uuid}'
+        completed = {}
+        if not consistent_snapshot:
+            mode, plan = plan_units(db, db_params, db_query, split_column, key_column, max_workers * 4)
+            checkpoint.start_run(uuid, s3_key_prefix, db_query, mode, plan)
+
+    snapshot = None
+    pool_args = {'initializer': init_worker, 'initargs': (connector_selector, db, db_params)}
+    if consistent_snapshot:
+        # The coordinator holds the snapshot open until every worker is done with it
+        snapshot = SnapshotCoordinator(max_workers, connector_selector, db, db_params).open()
+        pool_args = snapshot.pool_args()
 
     # Start processing and timing
     st_time = time.time()
-    max_workers = os.cpu_count() - 1 or 1
-    
     try:
-
         # Use ProcessPoolExecutor to process each batch in parallel
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            for batch_processed in executor.map(
-                batch_pipeline,
-                repeat(db),
-                repeat(db_params),
-                repeat(db_query),
-                repeat(s3_key_prefix),
-                batch_numbers
-            ):
-                progress_bar.update(batch_processed)
-
-        # Clean up progress bar
+        with ProcessPoolExecutor(max_workers=max_workers, **pool_args) as executor:
+            if snapshot:
+                snapshot.synchronize(executor)
+                # Planned inside the snapshot, so units cover exactly the rows the workers see
+                mode, plan = plan_units(db, db_params, db_query, split_column, key_column, max_workers * 4,
+                                        snapshot.connector)
+                checkpoint.start_run(uuid, s3_key_prefix, db_query, mode, plan)
+            if mode == 'partitions':
+                progress_bar = tqdm(total=len(plan), desc='Processing Partitions', unit='partition',
+                                    unit_scale=True)
+                parts = run_partitions(executor, db, db_params, db_query, s3_key_prefix, split_column, plan,
+                                       max_partition_rows, progress_bar, writer_options,
+                                       checkpoint, uuid, completed, retries, columnar)
+            else:
+                units = [unit for unit in plan if unit[0] not in completed]
+                progress_bar = tqdm(total=len(plan), initial=len(plan) - len(units), desc='Processing Batches',
+                                    unit='batch', unit_scale=True)
+                parts = run_batches(executor, db, db_params, db_query, s3_key_prefix, units, progress_bar,
+                                    key_column, columnar, writer_options, checkpoint, uuid, retries)
         progress_bar.close()
-        
-        #print(f"Total Time: {time.time() - st_time}")
-        
-    except Exception as e:
-        traceback.print_exc() 
-        
+    except UnitsFailedError:
+        checkpoint.finish_run(uuid, 'failed')
+        if snapshot:
+            print(f"Run {uuid} is incomplete; snapshot runs cannot be resumed, start a new run")
+        else:
+            print(f"Run {uuid} is incomplete; set resume_run = '{uuid}' to extract only the missing parts")
+        raise
+    finally:
+        if snapshot:
+            snapshot.close()
+
+    # Parts uploaded by earlier attempts of a resumed run are merged into manifest.json too
+    parts = [part for part in completed.values() if part] + parts
+    write_manifest(s3utils, build_manifest(parts, s3_key_prefix, db_query, split_column or key_column,
+                                           writer_options.get('checksum')))
+    checkpoint.finish_run(uuid)
+    checkpoint.close()
+    #print(f"Total Time: {time.time() - st_time}")
+
 if __name__ == "__main__":
     main()
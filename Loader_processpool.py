@@ -1,40 +1,44 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import cudf
 from utils.s3utils import S3Utils
-import io
+from utils.prefetch import prefetch_parts
+from utils.backends import get_backend
+from utils.manifest import find_manifest, manifest_parts, list_data_parts
 import os
 import time
+# cudf when installed, otherwise pyarrow readers into pandas; override with LOADER_BACKEND=cpu|cudf
+backend = get_backend(os.environ.get("LOADER_BACKEND", "auto"))
 # Instantiate S3Utils
 st_time = time.time()
 s3utils = S3Utils()
 folder_url = 'data_testing/7bc4e498-e698-11ee-9eb5-025f58bc16f6'
 
-list_urls = s3utils.list_files(folder_url)
+# The manifest lists exactly the parts of a finished export; older exports without one are listed
+manifest = find_manifest(s3utils, folder_url)
+parts = manifest_parts(manifest) if manifest else list_data_parts(s3utils, folder_url)
 
-def download_and_load_json(url):
-    content = s3utils.download_file_get_content(url)
-    if content:
-        return cudf.read_json(io.BytesIO(content), lines=True)
-    return None
+def download_part(part):
+    return s3utils.download_object(part['key'], size=part.get('size'))
 
-def load_jsons_to_df_with_cudf(urls, max_workers=4):
-    # Use ThreadPoolExecutor to download files in parallel
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        gdf_futures = {executor.submit(download_and_load_json, url): url for url in urls}
-    
+def load_jsons_to_df_with_cudf(parts, max_workers=4, prefetch_depth=8, memory_budget=None, concat_every=8):
+    # Download the next parts in the background while the current one is parsed
+    chunks = []
     gdf_list = []
-    for future in as_completed(gdf_futures):
-        gdf = future.result()
-        if gdf is not None:
-            gdf_list.append(gdf)
-    
-    # Concatenate all DataFrames into a single one only if gdf_list is not empty
-    full_gdf = cudf.concat(gdf_list, ignore_index=True) if gdf_list else cudf.DataFrame()
-    return full_gdf
+    for part, content in prefetch_parts(parts, download_part, prefetch_depth, memory_budget, max_workers):
+        if not content:
+            continue
+        gdf_list.append(backend.read_part(content, part['key']))
+        del content
+        # Concatenate groups as we go so single frames do not pile up; chunks are joined once at the end
+        if len(gdf_list) >= concat_every:
+            chunks.append(backend.concat(gdf_list))
+            gdf_list = []
 
+    frames = chunks + gdf_list
+    # Concatenate all DataFrames into a single one only if there is anything to concatenate
+    return backend.concat(frames) if frames else backend.empty()
 
-# Load the JSON files into a single cuDF DataFrame
+
+# Load the JSON files into a single DataFrame
 max_workers = os.cpu_count() - 1 or 1
-gdf = load_jsons_to_df_with_cudf(list_urls, max_workers)
+gdf = load_jsons_to_df_with_cudf(parts, max_workers, prefetch_depth=2 * max_workers)
 print(gdf.head())  # Print the first 5 rows of the DataFrame
 print(f"Time taken : {time.time() - st_time}")
@@ -1,6 +1,10 @@
 
 import asyncpg
 import time
+from contextlib import contextmanager
+from uuid import uuid4
+from connectors.redshift.utils import arrow_fields_from_oids
+from utils.columnar import records_to_record_batch
 
 class AsyncRedshiftConnector:
     def __init__(self, host, database, user, password, port=5439):
@@ -55,11 +59,52 @@ class AsyncRedshiftConnector:
             # Execute the batch query
             records = await self.connection.fetch(batch_query)
             if records:
-                # Extract headers only if we have records, and only for the first batch
-                headers = records[0].keys() if batch_number == 0 else None
+                # Every part carries its own header row, so each one can be read on its own
+                headers = records[0].keys()
                 return records, headers
             return [], None
 
+    async def fetch_arrow(self, query, *args):
+        """Run a query and return its rows as a pyarrow.RecordBatch typed from the result's type OIDs."""
+        async with self.connection.transaction():
+            statement = await self.connection.prepare(query)
+            records = await statement.fetch(*args)
+            fields = arrow_fields_from_oids([(attr.name, attr.type.oid) for attr in statement.get_attributes()])
+        return records_to_record_batch(records, fields)
+
+    async def fetch_batch_arrow(self, query, batch_number):
+        offset = batch_number * self.batch_size
+        batch_query = await self.add_limit_offset(query, self.batch_size, offset)
+        return await self.fetch_arrow(batch_query)
+
+    async def stream_records(self, query, chunk_size=None):
+        """
+        Run a query once on a server-side cursor and yield it in chunks.
+
+        :param query: The query to stream.
+        :param chunk_size: Rows per chunk, defaults to the batch size.
+        :return: An async generator of ``(records, headers)`` tuples.
+        """
+        chunk_size = chunk_size or self.batch_size
+        async with self.connection.transaction():
+            cursor = await self.connection.cursor(query)
+            while True:
+                records = await cursor.fetch(chunk_size)
+                if not records:
+                    break
+                yield records, list(records[0].keys())
+
+    async def copy_export(self, query, output, copy_format='csv'):
+        """
+        Stream ``COPY (query) TO STDOUT`` into ``output`` without building Python rows.
+
+        :param query: The query to export.
+        :param output: A path, a writable file-like object or a coroutine function taking bytes.
+        :param copy_format: ``csv`` (with a header row) or ``binary``.
+        """
+        return await self.connection.copy_from_query(
+            query, output=output, format=copy_format, header=copy_format == 'csv')
+
     async def record_to_tuple(record):
         return tuple(record.values())
 
@@ -80,6 +125,12 @@ class RedshiftConnector:
         self.port = port
         self.connection = None
         self.batch_size = 100000
+        # Row hash used by add_checksum, see utils.checksum
+        self.checksum_hash = 'md5'
+        # Set while this session reads from a shared snapshot, see utils.snapshot
+        self.in_snapshot = False
+        # 'redshift' or 'postgresql', read from version() on first use
+        self.dialect = None
         
     def add_limit_offset(self, query, batch_size, offset):
         return f"{query} LIMIT {batch_size} OFFSET {offset}"
@@ -97,20 +148,224 @@ class RedshiftConnector:
         except Exception as e:
             print(f"Error while connecting to Redshift: {e}")
 
+    @contextmanager
+    def transaction(self):
+        """
+        ``with connection`` commits on exit, which would end a snapshot transaction
+        after the first query; in snapshot mode the transaction is left open instead.
+        """
+        if self.in_snapshot:
+            yield self.connection
+        else:
+            with self.connection as conn:
+                yield conn
+
+    def export_snapshot(self):
+        """
+        Begin a REPEATABLE READ transaction and export its snapshot for other sessions.
+
+        :return: The snapshot id for ``use_snapshot``; valid until ``end_snapshot``.
+        :raises ValueError: On Redshift, which has no ``pg_export_snapshot``.
+        """
+        if self.is_redshift():
+            raise ValueError("Redshift cannot export snapshots; consistent_snapshot needs a PostgreSQL source")
+        self.connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        self.in_snapshot = True
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT pg_export_snapshot()")
+            return cursor.fetchone()[0]
+
+    def use_snapshot(self, snapshot_id):
+        """Begin a REPEATABLE READ transaction reading the snapshot exported by another session."""
+        self.connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        self.in_snapshot = True
+        with self.connection.cursor() as cursor:
+            cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+
+    def end_snapshot(self):
+        self.connection.rollback()
+        self.in_snapshot = False
+
     def fetch_count(self, base_query):
         count_query = f"SELECT COUNT(*) FROM ({base_query}) as count_subquery"
-        with self.connection as conn:
+        with self.transaction() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(count_query)
                 count = cursor.fetchone()[0]
             return count
 
-    def fetch_batch(self, query, batch_number):
+    def add_keyset(self, query, key_column, batch_size, last_key=None):
+        """
+        Wrap a query so it seeks past the last seen key instead of skipping rows.
+
+        :param query: The base query to page through.
+        :param key_column: An ordered, unique column of the base query.
+        :param batch_size: Number of rows per page.
+        :param last_key: Last key of the previous page, None for the first page.
+        :return: The keyset query and its parameters.
+        """
+        if last_key is None:
+            return f"SELECT * FROM ({query}) AS keyset_subquery ORDER BY {key_column} LIMIT {batch_size}", None
+        return (f"SELECT * FROM ({query}) AS keyset_subquery WHERE {key_column} > %s "
+                f"ORDER BY {key_column} LIMIT {batch_size}"), (last_key,)
+
+    def fetch_keyset_boundaries(self, query, key_column):
+        """
+        Walk the key column once and collect the key each batch has to seek past.
+
+        :param query: The base query to page through.
+        :param key_column: An ordered, unique column of the base query.
+        :return: One ``last_key`` per batch, starting with None for the first batch.
+        """
+        boundaries = [None]
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                while True:
+                    last_key = boundaries[-1]
+                    where = f" WHERE {key_column} > %s" if last_key is not None else ""
+                    params = (last_key,) if last_key is not None else None
+                    cursor.execute(f"SELECT {key_column} FROM ({query}) AS keyset_subquery{where} "
+                                   f"ORDER BY {key_column} LIMIT 1 OFFSET {self.batch_size - 1}", params)
+                    row = cursor.fetchone()
+                    if row is None:
+                        break
+                    boundaries.append(row[0])
+                # The final boundary seeks past the last row, so it would only yield an empty batch
+                if len(boundaries) > 1:
+                    cursor.execute(f"SELECT 1 FROM ({query}) AS keyset_subquery WHERE {key_column} > %s LIMIT 1",
+                                   (boundaries[-1],))
+                    if cursor.fetchone() is None:
+                        boundaries.pop()
+        return boundaries
+
+    def add_range(self, query, column, partition, limit=None, select='*'):
+        """
+        Restrict a query to one range partition of ``column``.
+
+        :param query: The base query to extract.
+        :param column: The split column.
+        :param partition: A partition dict from ``utils.partitioning``.
+        :param limit: Optional row cap, used to detect partitions that need sub-splitting.
+        :param select: The columns to return, e.g. only the split column for ``count_range``.
+        :return: The range query and its parameters.
+        """
+        if partition['is_null']:
+            where, params = f"{column} IS NULL", None
+        else:
+            upper_op = '<=' if partition['upper_inclusive'] else '<'
+            where, params = f"{column} >= %s AND {column} {upper_op} %s", (partition['lower'], partition['upper'])
+        range_query = f"SELECT {select} FROM ({query}) AS range_subquery WHERE {where}"
+        if limit is not None:
+            range_query = f"{range_query} LIMIT {limit}"
+        return range_query, params
+
+    def fetch_min_max(self, query, column):
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT MIN({column}), MAX({column}) FROM ({query}) AS range_subquery")
+                lower, upper = cursor.fetchone()
+        return lower, upper
+
+    def fetch_quantile_boundaries(self, query, column, partitions):
+        """
+        Read the upper bound of each of ``partitions`` equally sized tiles of ``column``.
+
+        :return: The sorted tile maxima; the last one is the column maximum.
+        """
+        quantile_query = (f"SELECT MAX({column}) FROM ("
+                          f"SELECT {column}, NTILE({partitions}) OVER (ORDER BY {column}) AS tile "
+                          f"FROM ({query}) AS range_subquery WHERE {column} IS NOT NULL"
+                          f") AS tiles GROUP BY tile ORDER BY tile")
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(quantile_query)
+                return [row[0] for row in cursor.fetchall()]
+
+    def is_redshift(self):
+        """Redshift speaks the Postgres protocol but differs in functions and types, e.g. no ``bit``."""
+        if self.dialect is None:
+            with self.transaction() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT version()")
+                    version = cursor.fetchone()[0]
+            self.dialect = 'redshift' if 'redshift' in version.lower() else 'postgresql'
+        return self.dialect == 'redshift'
+
+    def add_checksum(self, query, key_column, columns, lower, width, key_range=None):
+        """
+        Aggregate row hashes of ``query`` per bucket of ``width`` keys, counted from ``lower``.
+
+        Each row hashes to the first 32 bits of ``MD5`` of its ``columns`` cast to text and
+        joined with ``|`` (NULL as ``<null>``); see ``utils.checksum`` for the matching
+        export-side hash.
+
+        :param key_column: An integer key column; rows with a NULL key are not covered.
+        :param key_range: Optional ``(start, end)`` half-open key range to restrict to.
+        :return: The checksum query and its parameters.
+        """
+        row_text = " || '|' || ".join(
+            f"COALESCE(CAST({column} AS VARCHAR(65535)), '<null>')" for column in columns)
+        where, params = f"{key_column} IS NOT NULL", [lower, width]
+        if key_range is not None:
+            where += f" AND {key_column} >= %s AND {key_column} < %s"
+            params.extend(key_range)
+        if self.is_redshift():
+            row_hash = f"STRTOL(LEFT(MD5({row_text}), 8), 16)"
+        else:
+            # STRTOL is Redshift-only; a 32-bit string casts to bigint without a sign
+            row_hash = f"('x' || SUBSTR(MD5({row_text}), 1, 8))::bit(32)::bigint"
+        checksum_query = (f"SELECT ({key_column} - %s) / %s AS bucket, COUNT(*), "
+                          f"SUM({row_hash}) "
+                          f"FROM ({query}) AS checksum_subquery WHERE {where} GROUP BY 1")
+        return checksum_query, tuple(params)
+
+    def fetch_bucket_checksums(self, query, key_column, columns, lower, width, key_range=None):
+        """:return: ``{bucket: (rows, checksum)}`` computed by the database; only a few KB come back."""
+        checksum_query, params = self.add_checksum(query, key_column, columns, lower, width, key_range)
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(checksum_query, params)
+                return {int(bucket): (int(rows), int(checksum)) for bucket, rows, checksum in cursor.fetchall()}
+
+    def count_range(self, query, column, partition, limit=None):
+        """
+        Count the rows of one range partition, reading only the split column.
+
+        :param limit: Stop counting after this many rows; enough to tell whether a range needs splitting.
+        """
+        probe_query, params = self.add_range(query, column, partition, limit, select=column)
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM ({probe_query}) AS probe_subquery", params)
+                return cursor.fetchone()[0]
+
+    def fetch_range(self, query, column, partition, limit=None):
+        range_query, params = self.add_range(query, column, partition, limit)
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(range_query, params)
+                records = cursor.fetchall()
+                headers = [desc[0] for desc in cursor.description]
+        return records, headers
+
+    def fetch_range_arrow(self, query, column, partition, limit=None):
+        """``fetch_range`` as a RecordBatch typed from the cursor description, for Parquet parts."""
+        range_query, params = self.add_range(query, column, partition, limit)
+        batch = self.fetch_arrow(range_query, params)
+        return batch, batch.schema.names
+
+    def build_batch_query(self, query, batch_number, key_column=None, last_key=None):
+        """Return the query and parameters for one batch, keyset or LIMIT/OFFSET."""
+        if key_column:
+            return self.add_keyset(query, key_column, self.batch_size, last_key)
         offset = batch_number * self.batch_size
-        batch_query = self.add_limit_offset(query, self.batch_size, offset)
-        with self.connection as conn:
+        return self.add_limit_offset(query, self.batch_size, offset), None
+
+    def fetch_batch(self, query, batch_number, key_column=None, last_key=None):
+        batch_query, params = self.build_batch_query(query, batch_number, key_column, last_key)
+        with self.transaction() as conn:
             with conn.cursor() as cursor:
-                cursor.execute(batch_query)
+                cursor.execute(batch_query, params)
                 records = cursor.fetchall()
 
             if records:
@@ -118,6 +373,72 @@ class RedshiftConnector:
                 return records, headers
             return [], None
 
+    def fetch_arrow(self, query, params=None):
+        """
+        Run a query and return its rows as a pyarrow.RecordBatch.
+
+        Column types come from the type OIDs in cursor.description, so no
+        per-row tuple conversion or pandas dtype inference is needed downstream.
+        """
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                records = cursor.fetchall()
+                fields = arrow_fields_from_oids([(desc[0], desc[1], desc[4], desc[5])
+                                                 for desc in cursor.description])
+        return records_to_record_batch(records, fields)
+
+    def fetch_batch_arrow(self, query, batch_number, key_column=None, last_key=None):
+        batch_query, params = self.build_batch_query(query, batch_number, key_column, last_key)
+        return self.fetch_arrow(batch_query, params)
+
+    def stream_records(self, query, chunk_size=None, columnar=False):
+        """
+        Run a query once on a named (server-side) cursor and yield it in chunks.
+
+        Rows are fetched ``chunk_size`` at a time, so memory is bounded by a
+        single chunk rather than the whole result.
+
+        :param query: The query to stream.
+        :param chunk_size: Rows per chunk, defaults to the batch size.
+        :param columnar: Yield RecordBatches typed from the cursor description instead of rows.
+        :return: A generator of ``(records, headers)`` tuples.
+        """
+        chunk_size = chunk_size or self.batch_size
+        with self.transaction() as conn:
+            with conn.cursor(name=f"stream_{uuid4().hex}") as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(query)
+                while True:
+                    records = cursor.fetchmany(chunk_size)
+                    if not records:
+                        break
+                    # A named cursor only has a description once rows have been fetched
+                    headers = [desc[0] for desc in cursor.description]
+                    if columnar:
+                        fields = arrow_fields_from_oids([(desc[0], desc[1], desc[4], desc[5])
+                                                         for desc in cursor.description])
+                        records = records_to_record_batch(records, fields)
+                    yield records, headers
+
+    def copy_export(self, query, fileobj, copy_format='csv', params=None):
+        """
+        Stream ``COPY (query) TO STDOUT`` into ``fileobj`` without building Python rows.
+
+        COPY TO STDOUT is a PostgreSQL feature; Redshift clusters need UNLOAD instead.
+
+        :param query: The query to export.
+        :param fileobj: Any object with a ``write(bytes)`` method.
+        :param copy_format: ``csv`` (with a header row) or ``binary``.
+        :param params: Optional query parameters, bound client-side since COPY takes none.
+        """
+        options = "FORMAT csv, HEADER" if copy_format == 'csv' else "FORMAT binary"
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                if params is not None:
+                    query = cursor.mogrify(query, params).decode()
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH ({options})", fileobj)
+
     def close_connection(self):
         if self.connection:
             self.connection.close()
@@ -0,0 +1,41 @@
+import pyarrow as pa
+
+# Postgres/Redshift type OIDs, as reported by psycopg2 and asyncpg
+POSTGRES_ARROW_TYPES = {
+    16: pa.bool_(),             # bool
+    20: pa.int64(),             # int8
+    21: pa.int16(),             # int2
+    23: pa.int32(),             # int4
+    25: pa.string(),            # text
+    700: pa.float32(),          # float4
+    701: pa.float64(),          # float8
+    1042: pa.string(),          # bpchar
+    1043: pa.string(),          # varchar
+    1082: pa.date32(),          # date
+    1083: pa.time64('us'),      # time
+    1114: pa.timestamp('us'),   # timestamp
+    1184: pa.timestamp('us', tz='UTC'),  # timestamptz
+    1700: None,                 # numeric, see numeric_type
+}
+
+NUMERIC_OID = 1700
+
+
+def numeric_type(precision=None, scale=None):
+    """
+    Arrow type of a numeric column. A declared ``numeric(p, s)`` keeps its precision
+    and scale; an unconstrained one gets a wide fixed type, because types inferred
+    from the values would differ between parts.
+    """
+    if precision is None or scale is None:
+        return pa.decimal256(76, 38)
+    return pa.decimal128(precision, scale) if precision <= 38 else pa.decimal256(precision, scale)
+
+
+def arrow_fields_from_oids(columns):
+    """Map ``(name, type_oid)`` or ``(name, type_oid, precision, scale)`` to ``(name, arrow_type)`` pairs."""
+    fields = []
+    for name, oid, *numeric in columns:
+        arrow_type = numeric_type(*numeric) if oid == NUMERIC_OID else POSTGRES_ARROW_TYPES.get(oid)
+        fields.append((name, arrow_type))
+    return fields
@@ -1,6 +1,8 @@
 import time
 import aiomysql     
 import mysql.connector
+from connectors.sql.utils import arrow_fields_from_description
+from utils.columnar import records_to_record_batch
 
 
 class AsyncMysqlConnector:
@@ -54,11 +56,23 @@ class AsyncMysqlConnector:
             await cursor.execute(batch_query)
             records = await cursor.fetchall()
             if records:
-                # Extract headers only if we have records, and only for the first batch
-                headers = [description[0] for description in cursor.description] if batch_number == 0 else None
+                # Every part carries its own header row, so each one can be read on its own
+                headers = [description[0] for description in cursor.description]
                 return records, headers
             return [], None
      
+    async def fetch_arrow(self, query, params=None):
+        """Run a query and return its rows as a pyarrow.RecordBatch typed from cursor.description."""
+        async with self.connection.cursor() as cursor:
+            await cursor.execute(query, params)
+            records = await cursor.fetchall()
+            return records_to_record_batch(records, arrow_fields_from_description(cursor.description))
+
+    async def fetch_batch_arrow(self, query, batch_number):
+        offset = batch_number * self.batch_size
+        batch_query = await self.add_limit_offset(query, self.batch_size, offset)
+        return await self.fetch_arrow(batch_query)
+
     async def fetch_specific_records(self, query):
         async with self.connection.cursor(aiomysql.DictCursor) as cursor:
             st_time = time.time()
@@ -71,6 +85,24 @@ class AsyncMysqlConnector:
             print(f"Number of rows returned: {len(records)}")
             return records
 
+    async def stream_records(self, query, chunk_size=None):
+        """
+        Run a query once on an unbuffered server-side cursor and yield it in chunks.
+
+        :param query: The query to stream.
+        :param chunk_size: Rows per chunk, defaults to the batch size.
+        :return: An async generator of ``(records, headers)`` tuples.
+        """
+        chunk_size = chunk_size or self.batch_size
+        async with self.connection.cursor(aiomysql.SSCursor) as cursor:
+            await cursor.execute(query)
+            headers = [description[0] for description in cursor.description]
+            while True:
+                records = await cursor.fetchmany(chunk_size)
+                if not records:
+                    break
+                yield records, headers
+
     async def close_connection(self):
         if self.connection:
             self.connection.close()
@@ -87,15 +119,21 @@ class MysqlConnector:
         self.connection = None
         self.cursor = None
         self.batch_size = 10000
+        # Row hash used by add_checksum, see utils.checksum
+        self.checksum_hash = 'crc32'
         
     def open_connection(self):
         try:
+            # Pool workers keep this connection for every batch they handle; with autocommit each
+            # query gets a fresh read view instead of one transaction held open for the whole run.
+            # Snapshot mode still opens its own explicit transaction, see start_snapshot.
             self.connection = mysql.connector.connect(
                 host=self.host,
                 port=self.port,
                 database=self.database,
                 user=self.user,
-                password=self.password
+                password=self.password,
+                autocommit=True
             )
             if self.connection.is_connected():
                 db_info = self.connection.get_server_info()
@@ -104,6 +142,22 @@ class MysqlConnector:
         except Exception as e:
             print(f"Error while connecting to MySQL: {e}")
 
+    def lock_for_snapshot(self):
+        """Block writes on every table so sessions can start identical snapshots; needs the RELOAD privilege."""
+        self.cursor.execute("FLUSH TABLES WITH READ LOCK")
+
+    def start_snapshot(self):
+        """Begin a read-only REPEATABLE READ transaction with a consistent InnoDB snapshot."""
+        self.cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        self.cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+
+    def unlock_tables(self):
+        # Releases the global read lock; an open consistent snapshot is kept
+        self.cursor.execute("UNLOCK TABLES")
+
+    def end_snapshot(self):
+        self.connection.rollback()
+
     def fetch_all_records(self, table_name):
         return self.fetch_specific_records(f"SELECT * FROM {table_name}")
 
@@ -116,15 +170,171 @@ class MysqlConnector:
     def add_limit_offset(self, query, batch_size, offset):
         return f"{query} LIMIT {batch_size} OFFSET {offset}"
 
-    def fetch_batch(self, query, batch_number):
+    def add_keyset(self, query, key_column, batch_size, last_key=None):
+        """
+        Wrap a query so it seeks past the last seen key instead of skipping rows.
+
+        :param query: The base query to page through.
+        :param key_column: An ordered, unique column of the base query.
+        :param batch_size: Number of rows per page.
+        :param last_key: Last key of the previous page, None for the first page.
+        :return: The keyset query and its parameters.
+        """
+        if last_key is None:
+            return f"SELECT * FROM ({query}) AS keyset_subquery ORDER BY {key_column} LIMIT {batch_size}", None
+        return (f"SELECT * FROM ({query}) AS keyset_subquery WHERE {key_column} > %s "
+                f"ORDER BY {key_column} LIMIT {batch_size}"), (last_key,)
+
+    def fetch_keyset_boundaries(self, query, key_column):
+        """
+        Walk the key index once and collect the key each batch has to seek past.
+
+        Only the key column is read, so this is an index-only scan instead of a
+        full COUNT(*) over the base query.
+
+        :param query: The base query to page through.
+        :param key_column: An ordered, unique column of the base query.
+        :return: One ``last_key`` per batch, starting with None for the first batch.
+        """
+        boundaries = [None]
+        while True:
+            last_key = boundaries[-1]
+            where = f" WHERE {key_column} > %s" if last_key is not None else ""
+            params = (last_key,) if last_key is not None else None
+            boundary_query = (f"SELECT {key_column} FROM ({query}) AS keyset_subquery{where} "
+                              f"ORDER BY {key_column} LIMIT 1 OFFSET {self.batch_size - 1}")
+            self.cursor.execute(boundary_query, params)
+            row = self.cursor.fetchone()
+            if row is None:
+                break
+            boundaries.append(row[0])
+        # The final boundary seeks past the last row, so it would only yield an empty batch
+        if len(boundaries) > 1:
+            self.cursor.execute(f"SELECT 1 FROM ({query}) AS keyset_subquery WHERE {key_column} > %s LIMIT 1",
+                                (boundaries[-1],))
+            if self.cursor.fetchone() is None:
+                boundaries.pop()
+        return boundaries
+
+    def add_range(self, query, column, partition, limit=None, select='*'):
+        """
+        Restrict a query to one range partition of ``column``.
+
+        :param query: The base query to extract.
+        :param column: The split column.
+        :param partition: A partition dict from ``utils.partitioning``.
+        :param limit: Optional row cap, used to detect partitions that need sub-splitting.
+        :param select: The columns to return, e.g. only the split column for ``count_range``.
+        :return: The range query and its parameters.
+        """
+        if partition['is_null']:
+            where, params = f"{column} IS NULL", None
+        else:
+            upper_op = '<=' if partition['upper_inclusive'] else '<'
+            where, params = f"{column} >= %s AND {column} {upper_op} %s", (partition['lower'], partition['upper'])
+        range_query = f"SELECT {select} FROM ({query}) AS range_subquery WHERE {where}"
+        if limit is not None:
+            range_query = f"{range_query} LIMIT {limit}"
+        return range_query, params
+
+    def fetch_min_max(self, query, column):
+        self.cursor.execute(f"SELECT MIN({column}), MAX({column}) FROM ({query}) AS range_subquery")
+        lower, upper = self.cursor.fetchone()
+        return lower, upper
+
+    def fetch_quantile_boundaries(self, query, column, partitions):
+        """
+        Read the upper bound of each of ``partitions`` equally sized tiles of ``column``.
+
+        :return: The sorted tile maxima; the last one is the column maximum.
+        """
+        quantile_query = (f"SELECT MAX({column}) FROM ("
+                          f"SELECT {column}, NTILE({partitions}) OVER (ORDER BY {column}) AS tile "
+                          f"FROM ({query}) AS range_subquery WHERE {column} IS NOT NULL"
+                          f") AS tiles GROUP BY tile ORDER BY tile")
+        self.cursor.execute(quantile_query)
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def add_checksum(self, query, key_column, columns, lower, width, key_range=None):
+        """
+        Aggregate row hashes of ``query`` per bucket of ``width`` keys, counted from ``lower``.
+
+        Each row hashes to ``CRC32`` of its ``columns`` cast to text and joined with ``|``
+        (NULL as ``<null>``); see ``utils.checksum`` for the matching export-side hash.
+
+        :param key_column: An integer key column; rows with a NULL key are not covered.
+        :param key_range: Optional ``(start, end)`` half-open key range to restrict to.
+        :return: The checksum query and its parameters.
+        """
+        row_text = ", ".join(f"COALESCE(CAST({column} AS CHAR), '<null>')" for column in columns)
+        where, params = f"{key_column} IS NOT NULL", [lower, width]
+        if key_range is not None:
+            where += f" AND {key_column} >= %s AND {key_column} < %s"
+            params.extend(key_range)
+        checksum_query = (f"SELECT ({key_column} - %s) DIV %s AS bucket, COUNT(*), "
+                          f"SUM(CRC32(CONCAT_WS('|', {row_text}))) "
+                          f"FROM ({query}) AS checksum_subquery WHERE {where} GROUP BY bucket")
+        return checksum_query, tuple(params)
+
+    def fetch_bucket_checksums(self, query, key_column, columns, lower, width, key_range=None):
+        """:return: ``{bucket: (rows, checksum)}`` computed by the database; only a few KB come back."""
+        checksum_query, params = self.add_checksum(query, key_column, columns, lower, width, key_range)
+        self.cursor.execute(checksum_query, params)
+        return {int(bucket): (int(rows), int(checksum)) for bucket, rows, checksum in self.cursor.fetchall()}
+
+    def count_range(self, query, column, partition, limit=None):
+        """
+        Count the rows of one range partition, reading only the split column.
+
+        :param limit: Stop counting after this many rows; enough to tell whether a range needs splitting.
+        """
+        probe_query, params = self.add_range(query, column, partition, limit, select=column)
+        self.cursor.execute(f"SELECT COUNT(*) FROM ({probe_query}) AS probe_subquery", params)
+        return self.cursor.fetchone()[0]
+
+    def fetch_range(self, query, column, partition, limit=None):
+        range_query, params = self.add_range(query, column, partition, limit)
+        self.cursor.execute(range_query, params)
+        records = self.cursor.fetchall()
+        headers = [description[0] for description in self.cursor.description]
+        return records, headers
+
+    def fetch_range_arrow(self, query, column, partition, limit=None):
+        """``fetch_range`` as a RecordBatch typed from the cursor description, for Parquet parts."""
+        range_query, params = self.add_range(query, column, partition, limit)
+        batch = self.fetch_arrow(range_query, params)
+        return batch, batch.schema.names
+
+    def build_batch_query(self, query, batch_number, key_column=None, last_key=None):
+        """Return the query and parameters for one batch, keyset or LIMIT/OFFSET."""
+        if key_column:
+            return self.add_keyset(query, key_column, self.batch_size, last_key)
         offset = batch_number * self.batch_size
-        batch_query = self.add_limit_offset(query, self.batch_size, offset)
-        self.cursor.execute(batch_query)
+        return self.add_limit_offset(query, self.batch_size, offset), None
+
+    def fetch_batch(self, query, batch_number, key_column=None, last_key=None):
+        batch_query, params = self.build_batch_query(query, batch_number, key_column, last_key)
+        self.cursor.execute(batch_query, params)
         records = self.cursor.fetchall()
 
-        headers = [description[0] for description in self.cursor.description] if batch_number == 0 else None
+        headers = [description[0] for description in self.cursor.description]
         return records, headers
 
+    def fetch_arrow(self, query, params=None):
+        """
+        Run a query and return its rows as a pyarrow.RecordBatch.
+
+        Column types come from cursor.description, so no per-row tuple
+        conversion or pandas dtype inference is needed downstream.
+        """
+        self.cursor.execute(query, params)
+        records = self.cursor.fetchall()
+        return records_to_record_batch(records, arrow_fields_from_description(self.cursor.description))
+
+    def fetch_batch_arrow(self, query, batch_number, key_column=None, last_key=None):
+        batch_query, params = self.build_batch_query(query, batch_number, key_column, last_key)
+        return self.fetch_arrow(batch_query, params)
+
     def fetch_specific_records(self, query):
         st_time = time.time()
         self.cursor.execute(query)
@@ -135,6 +345,35 @@ class MysqlConnector:
         print(f"Number of rows returned: {len(records)}")
         return records
 
+    def stream_records(self, query, chunk_size=None, columnar=False):
+        """
+        Run a query once on an unbuffered cursor and yield it in chunks.
+
+        Rows are read off the wire as they are consumed, so memory is bounded
+        by a single chunk rather than the whole result.
+
+        :param query: The query to stream.
+        :param chunk_size: Rows per chunk, defaults to the batch size.
+        :param columnar: Yield RecordBatches typed from the cursor description instead of rows.
+        :return: A generator of ``(records, headers)`` tuples.
+        """
+        chunk_size = chunk_size or self.batch_size
+        cursor = self.connection.cursor(buffered=False)
+        try:
+            cursor.execute(query)
+            headers = [description[0] for description in cursor.description]
+            fields = arrow_fields_from_description(cursor.description)
+            while True:
+                records = cursor.fetchmany(chunk_size)
+                if not records:
+                    break
+                yield (records_to_record_batch(records, fields) if columnar else records), headers
+        finally:
+            # Drain rows left behind by a consumer that stopped early, or the connection stays blocked
+            if self.connection.unread_result:
+                self.connection.consume_results()
+            cursor.close()
+
     def close_connection(self):
         if self.connection and self.connection.is_connected():
             self.cursor.close()
@@ -0,0 +1,55 @@
+import pyarrow as pa
+
+# mysql.connector does not report a column's precision and scale, and types inferred
+# from the values differ between parts; the widest DECIMAL holds every value exactly
+DECIMAL_TYPE = pa.decimal256(65, 30)
+
+# MySQL protocol field type codes, as reported in cursor.description
+MYSQL_ARROW_TYPES = {
+    0: DECIMAL_TYPE,            # DECIMAL
+    1: pa.int64(),              # TINY
+    2: pa.int64(),              # SHORT
+    3: pa.int64(),              # LONG
+    4: pa.float32(),            # FLOAT
+    5: pa.float64(),            # DOUBLE
+    6: pa.null(),               # NULL
+    7: pa.timestamp('us'),      # TIMESTAMP
+    8: pa.int64(),              # LONGLONG
+    9: pa.int64(),              # INT24
+    10: pa.date32(),            # DATE
+    11: pa.duration('us'),      # TIME
+    12: pa.timestamp('us'),     # DATETIME
+    13: pa.int64(),             # YEAR
+    14: pa.date32(),            # NEWDATE
+    15: pa.string(),            # VARCHAR
+    16: pa.uint64(),            # BIT, returned as an int of up to 64 bits
+    245: pa.string(),           # JSON
+    246: DECIMAL_TYPE,          # NEWDECIMAL
+    247: pa.string(),           # ENUM
+    248: pa.string(),           # SET
+    249: pa.binary(),           # TINY_BLOB
+    250: pa.binary(),           # MEDIUM_BLOB
+    251: pa.binary(),           # LONG_BLOB
+    252: pa.string(),           # TEXT, or BLOB when the binary flag is set
+    253: pa.string(),           # VAR_STRING
+    254: pa.string(),           # STRING
+    255: pa.binary(),           # GEOMETRY
+}
+
+UNSIGNED_FLAG = 32
+BINARY_FLAG = 128
+
+
+def arrow_fields_from_description(description):
+    """Map a MySQL cursor description to ``(name, arrow_type)`` pairs."""
+    fields = []
+    for column in description:
+        arrow_type = MYSQL_ARROW_TYPES.get(column[1])
+        # mysql.connector appends the column flags; BIGINT UNSIGNED does not fit in int64
+        flags = column[7] if len(column) > 7 and column[7] else 0
+        if column[1] == 8 and flags & UNSIGNED_FLAG:
+            arrow_type = pa.uint64()
+        elif column[1] == 252 and flags & BINARY_FLAG:
+            arrow_type = pa.binary()
+        fields.append((column[0], arrow_type))
+    return fields
@@ -1,35 +1,88 @@
 import os
 import time
-from itertools import repeat
 import pandas as pd
-import pathlib
-import tempfile
+import pyarrow as pa
+import io
 from uuid import uuid1
 from utils.s3utils import S3Utils
 from connectors.redshift.connect import RedshiftConnector
 from connectors.sql.connect import MysqlConnector
 from concurrent.futures import ProcessPoolExecutor
+from utils.partitioning import plan_partitions, split_partition
+from utils.worker_connection import init_worker, get_worker_connection
+from utils.columnar import write_parquet, to_arrow_table
+from utils.profiling import profile_frame
+from utils.manifest import build_manifest, append_manifest, read_manifest, manifest_key, write_manifest
+from utils.checkpoint import Checkpoint
+from utils.scheduler import run_units, UnitsFailedError
+from utils.snapshot import SnapshotCoordinator
+from utils.watermark import watermark_query_id, add_watermark, window_lower, increment_prefix
+from utils.profiling import json_value
+from utils.checksum import checksum_spec, part_checksums
+from utils.buffer_pool import BufferPool, buffer_md5
 from tqdm import tqdm
-import traceback
 
 s3utils = S3Utils()
+# Serialization buffers are reused across the batches a worker handles
+buffer_pool = BufferPool()
 
 class DataFetchingPipeline:
-    def __init__(self, db, db_params, db_query, s3_key_prefix):
+    def __init__(self, db, db_params, db_query, s3_key_prefix, key_column=None,
+                 split_column=None, partitions=None, max_partition_rows=None, use_quantiles=False,
+                 columnar=False, writer_options=None, checkpoint_path='export_checkpoint.sqlite',
+                 resume_run=None, retries=3, watermark_column=None, overlap=None, consistent_snapshot=False):
         self.db = db
         self.db_params = db_params
         self.db_query = db_query
         self.s3_key_prefix = s3_key_prefix
+        # Ordered unique column for keyset pagination; None falls back to LIMIT/OFFSET
+        self.key_column = key_column
+        # Numeric/timestamp column for range-partitioned extraction; takes precedence over key_column
+        self.split_column = split_column
+        self.partitions = partitions
+        self.max_partition_rows = max_partition_rows
+        self.use_quantiles = use_quantiles
+        # Output format: {'format': 'json'} or {'format': 'parquet', 'row_group_size': ..., 'compression': ...}
+        self.writer_options = writer_options or {'format': 'json'}
+        # {'key_column', 'columns', 'width'} records bucket checksums in manifest.json, see utils.checksum
+        if self.writer_options.get('checksum'):
+            self.writer_options = dict(self.writer_options, checksum=checksum_spec(
+                self.writer_options['checksum'], self.connector_selector(db).checksum_hash))
+        self.output_format = self.writer_options.get('format', 'json')
+        # Fetch batches as Arrow RecordBatches typed from the cursor description; Parquet needs the source types
+        self.columnar = columnar or self.output_format == 'parquet'
         self.uuid = str(uuid1())
+        # Completed parts are journaled locally; resume_run finishes a crashed run under its own prefix
+        self.checkpoint_path = checkpoint_path
+        self.resume_run = resume_run
+        # Attempts per batch/partition after the first, with exponential backoff. A retried unit
+        # would run in a new transaction outside the shared snapshot, so snapshot runs never retry
+        self.retries = 0 if consistent_snapshot else retries
+        # Incremental mode: extract only rows past the watermark stored for this query
+        # (overlap re-reads late writes) and append them to the export started by the first run
+        self.watermark_column = watermark_column
+        self.overlap = overlap
+        # Previous watermark while an overlap window is re-read; parts count their rows at or below it
+        self.overlap_until = None
+        # Read every unit from one point-in-time view shared by all workers, see utils.snapshot
+        self.consistent_snapshot = consistent_snapshot
 
-    def write_batch_to_json_pandas(self, batch_tuples, headers, batch_number):
+    def write_batch_to_json_pandas(self, batch_tuples, headers, out):
         st_time = time.time()
-        file_name = f"batch_{batch_number}_{uuid1()}.json"
-        df = pd.DataFrame(batch_tuples, columns=headers)
-        file_path = pathlib.Path(tempfile.gettempdir()) / file_name
-        df.to_json(file_path, orient='records', lines=True)
+        if isinstance(batch_tuples, pa.RecordBatch):
+            df = batch_tuples.to_pandas()
+        else:
+            df = pd.DataFrame(batch_tuples, columns=headers)
+        text_out = io.TextIOWrapper(out, encoding='utf-8', write_through=True)
+        df.to_json(text_out, orient='records', lines=True)
+        text_out.detach()
         duration = time.time() - st_time
-        return str(file_path)
+        return df
+
+    def write_batch_to_parquet(self, batch, headers, out):
+        write_parquet(batch, headers, out,
+                      self.writer_options.get('row_group_size'),
+                      self.writer_options.get('compression', 'snappy'))
 
     def record_to_tuple(self, record):
         return tuple(record.values()) if type(record) != tuple else record
@@ -41,61 +94,348 @@ class DataFetchingPipeline:
             connector = RedshiftConnector(**self.db_params)
         return connector
 
-    def fetch_records_count(self):
-        connector = self.connector_selector(self.db)
-        connector.open_connection()
-        count = connector.fetch_count(self.db_query)
-        batch_size = connector.batch_size
-        connector.close_connection()
+    # The planning helpers open their own connection unless given an open one,
+    # e.g. the snapshot coordinator's so the plan reads the same view as the workers
+
+    def fetch_records_count(self, connector=None):
+        planning_connector = connector or self.connector_selector(self.db)
+        if connector is None:
+            planning_connector.open_connection()
+        count = planning_connector.fetch_count(self.db_query)
+        batch_size = planning_connector.batch_size
+        if connector is None:
+            planning_connector.close_connection()
         return count, batch_size
 
-    def run_fetch_batch(self, batch_number):
-        connector = self.connector_selector(self.db)
-        connector.open_connection()
-        batch, headers = connector.fetch_batch(self.db_query, batch_number)
-       
-        connector.close_connection()
+    def fetch_keyset_boundaries(self, connector=None):
+        planning_connector = connector or self.connector_selector(self.db)
+        if connector is None:
+            planning_connector.open_connection()
+        boundaries = planning_connector.fetch_keyset_boundaries(self.db_query, self.key_column)
+        if connector is None:
+            planning_connector.close_connection()
+        return boundaries
+
+    def fetch_watermark_upper(self, connector=None):
+        planning_connector = connector or self.connector_selector(self.db)
+        if connector is None:
+            planning_connector.open_connection()
+        _, upper = planning_connector.fetch_min_max(self.db_query, self.watermark_column)
+        if connector is None:
+            planning_connector.close_connection()
+        return upper
+
+    def fetch_partition_plan(self, partitions, connector=None):
+        planning_connector = connector or self.connector_selector(self.db)
+        if connector is None:
+            planning_connector.open_connection()
+        plan = plan_partitions(planning_connector, self.db_query, self.split_column, partitions, self.use_quantiles)
+        if connector is None:
+            planning_connector.close_connection()
+        return plan
+
+    def run_fetch_batch(self, batch_number, last_key=None):
+        # Reuse this worker's connection instead of a new handshake per batch
+        worker_connection = get_worker_connection(self.connector_selector, self.db)
+        if self.columnar:
+            batch = worker_connection.run('fetch_batch_arrow', self.db_query, batch_number,
+                                          key_column=self.key_column, last_key=last_key)
+            return batch, batch.schema.names
+        batch, headers = worker_connection.run('fetch_batch', self.db_query, batch_number,
+                                               key_column=self.key_column, last_key=last_key)
 
         return batch, headers
 
-    def batch_pipeline(self, batch_number):
-        batch, headers = self.run_fetch_batch(batch_number)
+    def upload_batch(self, batch, headers, batch_number):
+        """Serialize and upload one part; returns its manifest entry with the column profile."""
+        s3_key = f"{self.s3_key_prefix}_part_{batch_number}.{self.output_format}"
+        # Serialize in memory; 'spill_threshold' (bytes) stages oversized batches on disk instead
+        with buffer_pool.buffer(self.writer_options.get('spill_threshold')) as buf:
+            if self.output_format == 'parquet':
+                self.write_batch_to_parquet(batch, headers, buf)
+                df = to_arrow_table(batch, headers).to_pandas()
+            else:
+                if isinstance(batch, pa.RecordBatch):
+                    batch_tuples = batch
+                else:
+                    batch_tuples = [self.record_to_tuple(record) for record in batch]
+                df = self.write_batch_to_json_pandas(batch_tuples, headers, buf)
+            part_bytes = buf.seek(0, io.SEEK_END)
+            part_md5 = buffer_md5(buf)
+
+            _, _, uploaded = s3utils.upload_buffer(s3_key, buf)
+        if not uploaded:
+            # upload_file reports failures instead of raising; raise so the unit is retried, not journaled as done
+            raise RuntimeError(f"Upload of {s3_key} failed")
+        part = {'key': s3_key, 'rows': len(df), 'bytes': part_bytes, 'md5': part_md5, 'stats': profile_frame(df)}
+        if self.writer_options.get('checksum'):
+            part['checksums'] = part_checksums(df, self.writer_options['checksum'])
+        if self.overlap_until is not None:
+            part['overlap_rows'] = int((df[self.watermark_column] <= self.overlap_until).sum())
+        return part
+
+    def write_manifest(self, parts, increment=None):
+        """
+        Merge the part entries into ``manifest.json`` next to the parts.
+
+        An incremental run appends its parts to the manifest of the export it extends and
+        records its window under ``increments``: a source count over
+        ``(overlap_lower, upper]`` matches the window's ``rows``, of which ``overlap_rows``
+        fall at or below the previous watermark and may repeat rows exported before.
+        """
+        if increment is None:
+            return write_manifest(s3utils, build_manifest(parts, self.s3_key_prefix, self.db_query,
+                                                          self.split_column or self.key_column,
+                                                          self.writer_options.get('checksum')))
+        if increment['appends']:
+            manifest = append_manifest(read_manifest(s3utils, manifest_key(increment['prefix'])), parts)
+        else:
+            manifest = build_manifest(parts, increment['prefix'], increment['query'],
+                                      self.split_column or self.key_column, self.writer_options.get('checksum'))
+        manifest['watermark'] = {'column': self.watermark_column, 'value': json_value(increment['upper'])}
+        manifest.setdefault('increments', []).append({
+            'run_id': self.uuid,
+            'lower': json_value(increment['lower']),
+            'overlap_lower': json_value(increment['overlap_lower']),
+            'upper': json_value(increment['upper']),
+            'rows': sum(part.get('rows') or 0 for part in parts if part),
+            'overlap_rows': sum(part.get('overlap_rows') or 0 for part in parts if part),
+        })
+        manifest['overlap_rows'] = sum(window['overlap_rows'] for window in manifest['increments'])
+        return write_manifest(s3utils, manifest)
+
+    def batch_pipeline(self, batch_number, last_key=None):
+        batch, headers = self.run_fetch_batch(batch_number, last_key)
         if not batch:
-            return 0
-
-        batch_tuples = [self.record_to_tuple(record) for record in batch]
-        json_path = self.write_batch_to_json_pandas(batch_tuples, headers, batch_number)
-        s3_key = f"{self.s3_key_prefix}_part_{batch_number}.json"
-        
-        with open(json_path, 'rb') as f:
-            data = f.read()
-        
-        s3utils.upload_file(s3_key, data)
-        os.remove(json_path)
-        return 1
+            return None
+
+        return self.upload_batch(batch, headers, batch_number)
+
+    def partition_pipeline(self, partition):
+        """
+        Extract one range partition and upload it as its own part.
+
+        Returns ``(children, part)``: the child partitions when the range holds more
+        than ``max_partition_rows`` rows, so they can be scheduled instead, otherwise
+        the uploaded part's manifest entry (None for an empty range).
+        """
+        # Parquet parts are typed from the cursor description rather than inferred per part
+        fetch_method = 'fetch_range_arrow' if self.columnar else 'fetch_range'
+        worker_connection = get_worker_connection(self.connector_selector, self.db)
+        if self.max_partition_rows:
+            # Probe the size on the split column alone before pulling any full rows
+            rows = worker_connection.run('count_range', self.db_query, self.split_column, partition,
+                                         self.max_partition_rows + 1)
+            if rows > self.max_partition_rows:
+                children = split_partition(partition)
+                if children:
+                    return children, None
+                # The range cannot be narrowed any further, so take it whole
+        batch, headers = worker_connection.run(fetch_method, self.db_query, self.split_column, partition)
+
+        if len(batch):
+            return [], self.upload_batch(batch, headers, partition['partition_id'])
+        return [], None
+
+    def partition_unit(self, partition):
+        return f"partition_{partition['partition_id']}", partition
+
+    def journal_failure(self, checkpoint):
+        def on_failure(unit_id, error, final):
+            checkpoint.record_failure(self.uuid, unit_id, error, final)
+        return on_failure
+
+    def run_partitions(self, executor, plan, progress_bar, checkpoint, completed=None):
+        """
+        Extract ``plan`` partitions, replacing skewed ones by their sub-ranges as they are found.
+        Partitions already in ``completed`` are skipped; failed ones are retried with backoff.
+        """
+        completed = completed or {}
+        parts = []
+
+        def on_result(unit_id, partition, result):
+            children, part = result
+            if children:
+                # A skewed range is replaced by its sub-ranges, minus those a previous attempt finished
+                child_units = [self.partition_unit(child) for child in children
+                               if self.partition_unit(child)[0] not in completed]
+                progress_bar.total += len(child_units) - 1
+                progress_bar.refresh()
+                return child_units
+            checkpoint.record_done(self.uuid, unit_id, part)
+            if part:
+                parts.append(part)
+            progress_bar.update(1)
+            return []
+
+        units = [self.partition_unit(partition) for partition in plan]
+        run_units(executor, lambda executor, partition: executor.submit(self.partition_pipeline, partition),
+                  [unit for unit in units if unit[0] not in completed], on_result,
+                  on_failure=self.journal_failure(checkpoint), retries=self.retries)
+        return parts
+
+    def run_batches(self, executor, units, progress_bar, checkpoint):
+        parts = []
+
+        def on_result(unit_id, payload, part):
+            checkpoint.record_done(self.uuid, unit_id, part)
+            if part:
+                parts.append(part)
+            progress_bar.update(1)
+            return []
+
+        run_units(executor, lambda executor, payload: executor.submit(self.batch_pipeline, *payload),
+                  units, on_result, on_failure=self.journal_failure(checkpoint), retries=self.retries)
+        return parts
+
+    def open_increment(self, checkpoint, connector=None):
+        """
+        Narrow the query to the rows past the stored watermark of this query.
+
+        The window's upper bound is read up front, so rows written during the run are
+        left for the next one. The first run exports everything up to it under
+        ``s3_key_prefix``; the n-th later run adds parts to that export under
+        ``<prefix>_inc_<n>``, which readers order after the parts before it.
+
+        :param connector: Open connector to read the upper bound on, e.g. the snapshot coordinator's.
+
+        :return: The increment, or None when there are no new rows.
+        """
+        query_id = watermark_query_id(self.db, self.db_query, self.watermark_column)
+        state = checkpoint.get_watermark(query_id)
+        watermark = state['watermark'] if state else None
+        increment = {
+            'query_id': query_id,
+            'query': self.db_query,
+            'prefix': state['prefix'] if state else self.s3_key_prefix,
+            'appends': watermark is not None,
+            'lower': watermark,
+            'overlap_lower': window_lower(watermark, self.overlap),
+        }
+        if self.overlap and watermark is not None:
+            self.overlap_until = watermark
+        if self.resume_run:
+            # The resumed run brings back its own narrowed query and prefix
+            if not state or state['pending_run_id'] != self.resume_run:
+                raise ValueError(f"Run {self.resume_run} is not a pending increment of this query")
+            return dict(increment, upper=state['pending_watermark'])
+
+        upper = self.fetch_watermark_upper(connector)
+        if upper is None or (watermark is not None and upper <= watermark):
+            print(f"No rows past watermark {watermark} on {self.watermark_column}")
+            return None
+        self.db_query = add_watermark(self.db_query, self.watermark_column, increment['overlap_lower'], upper)
+        # Later parts land next to the existing ones, so the export stays one folder; the sequence
+        # comes from the windows the manifest already records, as run ids do not sort by time
+        if increment['appends']:
+            windows = read_manifest(s3utils, manifest_key(increment['prefix'])).get('increments', [])
+            sequence = max(len(windows), 1)
+            self.s3_key_prefix = increment_prefix(increment['prefix'], sequence)
+        else:
+            self.s3_key_prefix = increment['prefix']
+        checkpoint.begin_increment(query_id, self.watermark_column, increment['prefix'], self.uuid, upper)
+        print(f"Extracting {self.watermark_column} in ({watermark}, {upper}]")
+        return dict(increment, upper=upper)
+
+    def open_run(self, checkpoint, connector=None):
+        """
+        Start a journaled run, or reopen ``resume_run`` under its original key prefix.
+
+        :param connector: Open connector to plan on, e.g. the snapshot coordinator's.
+
+        :return: ``(mode, plan, completed)`` where ``completed`` maps finished units to their parts.
+        """
+        if self.resume_run:
+            run = checkpoint.get_run(self.resume_run)
+            if run is None:
+                raise ValueError(f"No checkpointed run {self.resume_run} in {self.checkpoint_path}")
+            self.uuid, self.s3_key_prefix, self.db_query = self.resume_run, run['prefix'], run['query']
+            completed = checkpoint.completed(self.uuid)
+            print(f"Resuming {self.uuid}: {len(completed)} parts already uploaded")
+            return run['mode'], run['plan'], completed
+
+        # The plan is journaled so a resumed run extracts exactly the same units and keys
+        max_workers = os.cpu_count() - 1 or 1
+        if self.split_column:
+            mode = 'partitions'
+            plan = self.fetch_partition_plan(self.partitions or max_workers * 4, connector)
+        else:
+            mode = 'batches'
+            if self.key_column:
+                last_keys = self.fetch_keyset_boundaries(connector)
+            else:
+                rows_count, batch_size = self.fetch_records_count(connector)
+                last_keys = [None] * -(-rows_count // batch_size)
+            plan = [(f"batch_{batch_number}", (batch_number, last_key))
+                    for batch_number, last_key in enumerate(last_keys)]
+        checkpoint.start_run(self.uuid, self.s3_key_prefix, self.db_query, mode, plan)
+        return mode, plan, {}
 
     def start_migration(self):
-        
-        st_time = time.time()
-        rows_count, batch_size = self.fetch_records_count()
-        batch_numbers = range(-(-rows_count // batch_size))
+        if self.consistent_snapshot and self.resume_run:
+            # Units finished by the crashed run read an older view than a new snapshot would
+            raise ValueError("A consistent-snapshot run cannot be resumed; start a new run")
 
-        progress_bar = tqdm(total=len(batch_numbers), desc='Processing Batches', unit='batch', unit_scale=True)
+        st_time = time.time()
+        checkpoint = Checkpoint(self.checkpoint_path)
+        increment = None
+        if self.watermark_column and not self.consistent_snapshot:
+            increment = self.open_increment(checkpoint)
+            if increment is None:
+                checkpoint.close()
+                return
         max_workers = os.cpu_count() - 1 or 1
 
+        snapshot = None
+        pool_args = {'initializer': init_worker, 'initargs': (self.connector_selector, self.db)}
+        if self.consistent_snapshot:
+            # The coordinator holds the snapshot open until every worker is done with it
+            snapshot = SnapshotCoordinator(max_workers, self.connector_selector, self.db).open()
+            pool_args = snapshot.pool_args()
+        else:
+            mode, plan, completed = self.open_run(checkpoint)
+
         try:
             # Use ProcessPoolExecutor to process each batch in parallel
-            with ProcessPoolExecutor(max_workers=max_workers) as executor:
-                for batch_processed in executor.map(
-                    self.batch_pipeline,
-                    batch_numbers
-                ):
-                    progress_bar.update(batch_processed)
-
-            print(f"Total Time: {time.time() - st_time}")
-            
-        except:
-            traceback.print_exc()
+            with ProcessPoolExecutor(max_workers=max_workers, **pool_args) as executor:
+                if snapshot:
+                    snapshot.synchronize(executor)
+                    # Bounded and planned inside the snapshot, so units cover exactly the rows the workers see
+                    if self.watermark_column:
+                        increment = self.open_increment(checkpoint, snapshot.connector)
+                        if increment is None:
+                            checkpoint.close()
+                            return
+                    mode, plan, completed = self.open_run(checkpoint, snapshot.connector)
+                if mode == 'partitions':
+                    progress_bar = tqdm(total=len(plan), desc='Processing Partitions', unit='partition',
+                                        unit_scale=True)
+                    parts = self.run_partitions(executor, plan, progress_bar, checkpoint, completed)
+                else:
+                    units = [unit for unit in plan if unit[0] not in completed]
+                    progress_bar = tqdm(total=len(plan), initial=len(plan) - len(units),
+                                        desc='Processing Batches', unit='batch', unit_scale=True)
+                    parts = self.run_batches(executor, units, progress_bar, checkpoint)
+            progress_bar.close()
+        except UnitsFailedError:
+            checkpoint.finish_run(self.uuid, 'failed')
+            if snapshot:
+                print(f"Run {self.uuid} is incomplete; snapshot runs cannot be resumed, start a new run")
+            else:
+                print(f"Run {self.uuid} is incomplete; resume it with resume_run='{self.uuid}'")
+            raise
+        finally:
+            if snapshot:
+                snapshot.close()
+
+        # Parts uploaded by earlier attempts of a resumed run are merged into the manifest too
+        self.write_manifest([part for part in completed.values() if part] + parts, increment)
+        if increment:
+            # Only a fully uploaded window moves the watermark; a failed run is resumed or redone
+            checkpoint.commit_increment(increment['query_id'], self.uuid)
+        checkpoint.finish_run(self.uuid)
+        checkpoint.close()
+        print(f"Total Time: {time.time() - st_time}")
 
 if __name__ == "__main__":
     redshiftparams = {
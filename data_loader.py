@@ -1,6 +1,4 @@
-import cudf
 from utils.s3utils import S3Utils
-import io
 import os
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -64,13 +62,18 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 #         print(len(gdf))
 #         print(f"Time taken: {time.time() - st_time}")
         
-import cudf
 from utils.s3utils import S3Utils
-import io
+from utils.prefetch import prefetch_parts
+from utils.backends import get_backend
+from utils.spill import SpilledFrames
+from utils.filters import stats_may_match
+from utils.transform_plan import TransformPlan
+from utils.manifest import find_manifest, manifest_parts, list_data_parts
+import hashlib
 import os
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
+import pyarrow as pa
 
 # Set up the basic logger
 logging.basicConfig(level=logging.INFO)
@@ -78,77 +81,264 @@ logger = logging.getLogger()
 
 class JsonToGDFLoader:
     """
-    Class to load JSON data from S3 into cuDF dataframes, perform transformations,
+    Class to load JSON data from S3 into dataframes, perform transformations,
     and concatenate into a single dataframe.
+
+    Frames are cuDF DataFrames with the ``cudf`` backend and pandas DataFrames,
+    parsed by Arrow's multithreaded readers, with the ``cpu`` backend.
     """
 
-    def __init__(self, folder_url):
+    def __init__(self, folder_url, backend='auto', use_manifest=True):
         """
-        Initialize the loader with the folder URL.
+        Initialize the loader with the folder URL and a backend: ``cpu``, ``cudf``,
+        or ``auto`` to use cuDF only when it is installed.
+
+        With ``use_manifest`` the export is opened from the ``manifest.json`` written
+        by the extraction: parts come from the manifest instead of a listing, and each
+        part's checksum is verified as it streams. Exports without a manifest are listed.
         """
         self.folder_url = folder_url
         self.s3utils = S3Utils()
+        self.backend = get_backend(backend)
+        self.use_manifest = use_manifest
+        self.manifest = None
+
+    def open_manifest(self):
+        """
+        Read the export's manifest once; None when there is none or manifests are disabled.
+        A manifest that exists but cannot be read or parsed raises rather than
+        silently turning off the part checks.
+        """
+        if self.use_manifest and self.manifest is None:
+            self.manifest = find_manifest(self.s3utils, self.folder_url)
+            if self.manifest is None:
+                logger.warning(f"No manifest for {self.folder_url}, falling back to listing")
+                self.use_manifest = False
+        return self.manifest
+
+    def list_parts(self):
+        """
+        The parts to load: the manifest's parts when there is one, so stale or partial
+        objects left in the folder by a crashed run are never read, otherwise a listing.
+        """
+        manifest = self.open_manifest()
+        if manifest is None:
+            return list_data_parts(self.s3utils, self.folder_url)
+        return manifest_parts(manifest)
+
+    def key_filters(self, key_range, filters=None):
+        """
+        Turn an inclusive ``(lower, upper)`` range on the manifest's key column into filters,
+        so parts whose key range lies outside it are pruned before download.
+        """
+        if key_range is None:
+            return filters
+        manifest = self.open_manifest()
+        if manifest is None or not manifest.get('key_column'):
+            raise ValueError("key_range needs a manifest written with a key or split column")
+        key_column = manifest['key_column']
+        lower, upper = key_range
+        key_filters = [(key_column, '>=', lower), (key_column, '<=', upper)]
+        return list(filters or []) + key_filters
+
+    def read_part(self, content, name, columns=None, filters=None):
+        """
+        Parse one part into a DataFrame, picking the reader from the part's extension.
+        Parquet and CSV only read the requested columns; JSON drops the rest after parsing.
+        ``filters`` are pyarrow-style ``(column, op, value)`` tuples, see ``utils.filters``.
+        """
+        return self.backend.read_part(content, name, columns, filters)
 
-    def download_and_load_json(self, url):
+    def download_part(self, part):
         """
-        Download a single JSON file content and load into a cuDF DataFrame.
+        Download a single part's raw bytes by key.
+        ``part`` is an object dict from ``S3Utils.list_objects`` or a manifest part.
+
+        A part listed in a manifest must exist and match its recorded size and MD5;
+        anything else raises instead of silently loading a partial export.
         """
         try:
-            content = self.s3utils.download_file_get_content(url)
-            if content:
-                return cudf.read_json(io.BytesIO(content), lines=True)
+            # The listed size saves a HEAD request before splitting into ranges
+            content = self.s3utils.download_object(part['key'], size=part.get('size'))
         except Exception as e:
-            logger.error(f"Failed to download or load json from {url}, error: {e}")
-        return None
+            logger.error(f"Failed to download part {part['key']}, error: {e}")
+            if self.manifest is not None:
+                raise
+            return None
+        if self.manifest is not None:
+            self.verify_part(part, content)
+        return content
 
-    def load_jsons_to_df_with_cudf(self, urls, max_workers=4):
+    def verify_part(self, part, content):
+        if part.get('bytes') is not None and len(content) != part['bytes']:
+            raise ValueError(f"Part {part['key']} has {len(content)} bytes, the manifest records {part['bytes']}")
+        if part.get('md5') and hashlib.md5(content).hexdigest() != part['md5']:
+            raise ValueError(f"Part {part['key']} does not match the MD5 in the manifest")
+
+    def download_and_load_part(self, part, columns=None):
         """
-        Parallelize downloads and concatenates individual DataFrames into one.
+        Download a single part (JSON Lines, CSV or Parquet) by key and load into a DataFrame.
         """
-        futures_to_url = {}
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            for url in urls:
-                futures_to_url[executor.submit(self.download_and_load_json, url)] = url
+        content = self.download_part(part)
+        if content:
+            try:
+                return self.read_part(content, part['key'], columns)
+            except Exception as e:
+                logger.error(f"Failed to load part {part['key']}, error: {e}")
+        return None
 
+    def load_jsons_to_df_with_cudf(self, parts, max_workers=4, columns=None,
+                                   prefetch_depth=None, memory_budget=None, concat_every=8, filters=None):
+        """
+        Download the next parts while earlier ones are parsed, and concatenate into one DataFrame.
+
+        At most ``prefetch_depth`` parts (default ``2 * max_workers``) and ``memory_budget``
+        bytes of raw content are held ahead of the parser. Every ``concat_every`` parts are
+        concatenated into one chunk, and the chunks once at the end, in natural part order,
+        so row order is stable across runs and no row is copied more than twice.
+        """
+        chunks = []
         gdf_list = []
-        for future in as_completed(futures_to_url):
-            gdf = future.result()
-            if gdf is not None:
-                gdf_list.append(gdf)
+        for _, gdf in self.iter_part_frames(parts, max_workers, columns, prefetch_depth, memory_budget,
+                                            filters):
+            gdf_list.append(gdf)
+            if len(gdf_list) >= concat_every:
+                chunks.append(self.concat_frames(gdf_list))
+                gdf_list = []
+
+        full_gdf = self.concat_frames(chunks + gdf_list)
+        return full_gdf if full_gdf is not None else self.backend.empty()
+
+    def iter_part_frames(self, parts, max_workers=4, columns=None, prefetch_depth=None, memory_budget=None,
+                         filters=None):
+        """
+        Yield ``(part, frame)`` for each part in natural part order, downloading ahead
+        of the parser like ``load_jsons_to_df_with_cudf``. Parts that fail are logged and skipped,
+        and parts whose ``stats`` show they cannot match ``filters`` are never downloaded.
+        """
+        parts = self.prune_parts(parts, filters)
+        prefetch_depth = prefetch_depth or 2 * max_workers
+        for part, content in prefetch_parts(parts, self.download_part, prefetch_depth,
+                                            memory_budget, max_workers):
+            if not content:
+                continue
+            try:
+                gdf = self.read_part(content, part['key'], columns, filters)
+            except Exception as e:
+                logger.error(f"Failed to load part {part['key']}, error: {e}")
+                if self.manifest is not None:
+                    raise
+                continue
+            del content
+            yield part, gdf
 
-        full_gdf = cudf.concat(gdf_list, ignore_index=True) if gdf_list else cudf.DataFrame()
-        return full_gdf
+    def prune_parts(self, parts, filters=None):
+        """
+        Drop parts whose per-column ``stats`` (``{column: {'min', 'max'}}``, e.g. from a
+        manifest) show that no row can match ``filters``. Parts without stats are kept.
+        """
+        if not filters:
+            return parts
+        kept = [part for part in parts if stats_may_match(part.get('stats'), filters)]
+        if len(kept) < len(parts):
+            logger.info(f"Skipping {len(parts) - len(kept)} of {len(parts)} parts that cannot match the filters")
+        return kept
 
-    def load(self):
+    def concat_frames(self, frames):
         """
-        Load JSON files contained within the folder URL into a single cuDF DataFrame.
+        Concatenate ``frames`` in order; None when there are none.
+        """
+        if not frames:
+            return None
+        return self.backend.concat(frames) if len(frames) > 1 else frames[0]
+
+    def load(self, columns=None, prefetch_depth=None, memory_budget=None, filters=None, key_range=None):
         """
-        list_urls = self.s3utils.list_files(self.folder_url)
+        Load the parts contained within the folder URL into a single DataFrame,
+        optionally reading only ``columns`` and the rows matching ``filters``, e.g.
+        ``[('tx_date', '>=', '2024-03-01'), ('tx_status', 'in', ['FAILED'])]``,
+        or within an inclusive ``key_range`` on the manifest's key column.
+        """
+        filters = self.key_filters(key_range, filters)
+        parts = self.list_parts()
         max_workers = os.cpu_count() - 1 or 1
-        return self.load_jsons_to_df_with_cudf(list_urls, max_workers)
+        return self.load_jsons_to_df_with_cudf(parts, max_workers, columns,
+                                               prefetch_depth=prefetch_depth,
+                                               memory_budget=memory_budget,
+                                               filters=filters)
     
-    def transform_gdf(self, gdf, transformations):
+    def iter_frames(self, columns=None, transformations=None, prefetch_depth=None, memory_budget=None,
+                    filters=None, key_range=None):
         """
-        Apply transformations to a cuDF DataFrame based on a list of transformation rules.
+        Yield one DataFrame per part, with ``transformations`` already applied, so exports
+        larger than memory can be processed part by part. Only the parts being prefetched
+        and the frame being consumed are held at any time.
         """
-        for transform in transformations:
-            from_column = transform.get('from_column_name')
-            to_column = transform.get('to_column_name')
-            type_update = transform.get('type_update')  # Get the type if it exists
-            transformation_function = transform.get('transformation_function')
+        filters = self.key_filters(key_range, filters)
+        parts = self.list_parts()
+        max_workers = os.cpu_count() - 1 or 1
+        # Compile once and reuse the plan for every part
+        plan = transformations
+        if transformations and not isinstance(transformations, TransformPlan):
+            plan = TransformPlan(transformations)
+        for _, gdf in self.iter_part_frames(parts, max_workers, columns, prefetch_depth, memory_budget,
+                                            filters):
+            yield plan.apply(gdf) if plan else gdf
 
-            # if transformation_function and from_column in gdf.columns:
-            #     gdf[to_column] = gdf[from_column].applymap(transformation_function)
+    def iter_batches(self, batch_rows, columns=None, transformations=None, prefetch_depth=None,
+                     memory_budget=None, filters=None, key_range=None):
+        """
+        Like ``iter_frames`` but re-chunked into frames of exactly ``batch_rows`` rows
+        (the last one may be shorter), regardless of how rows are spread across parts.
+        """
+        pending = []
+        pending_rows = 0
+        for gdf in self.iter_frames(columns, transformations, prefetch_depth, memory_budget, filters, key_range):
+            offset = 0
+            while offset < len(gdf):
+                take = min(batch_rows - pending_rows, len(gdf) - offset)
+                pending.append(gdf.iloc[offset:offset + take])
+                pending_rows += take
+                offset += take
+                if pending_rows == batch_rows:
+                    yield self.backend.concat(pending)
+                    pending = []
+                    pending_rows = 0
+        if pending:
+            yield self.backend.concat(pending)
 
-            # Rename the column if necessary
-            if from_column in gdf.columns and from_column != to_column:
-                gdf = gdf.rename(columns={from_column: to_column})
-                
-            # Update column type if type_update is provided
-            if type_update and to_column in gdf.columns:
-                gdf[to_column] = gdf[to_column].astype(type_update)
-        
-        return gdf
+    def spill_frames(self, frames, spill_dir=None):
+        """
+        Write ``frames`` (e.g. from ``iter_frames``) to local Arrow IPC files and return a
+        ``SpilledFrames`` that reads them back by index, for reductions that need random
+        access to data that does not fit in memory. Call ``cleanup`` on it when done.
+        """
+        spilled = SpilledFrames(self.backend, spill_dir)
+        try:
+            for gdf in frames:
+                spilled.append(gdf)
+        except Exception:
+            spilled.cleanup()
+            raise
+        return spilled
+
+    def load_arrow(self, batches):
+        """
+        Load pyarrow RecordBatches (e.g. from a connector's fetch_batch_arrow) into a DataFrame.
+        """
+        batches = list(batches)
+        if not batches:
+            return self.backend.empty()
+        return self.backend.from_arrow(pa.Table.from_batches(batches))
+
+    def transform_gdf(self, gdf, transformations):
+        """
+        Apply transformations to a DataFrame based on a list of transformation rules,
+        or an already compiled ``TransformPlan``. The rules are compiled into one batched
+        rename, vectorized expressions and a single cast pass; see ``utils.transform_plan``.
+        """
+        plan = transformations if isinstance(transformations, TransformPlan) else TransformPlan(transformations)
+        return plan.apply(gdf)
 
     def print_head_and_time_taken(self):
         """
@@ -159,35 +349,36 @@ class JsonToGDFLoader:
         logger.info(gdf.head())
         logger.info(f"Time taken: {time.time() - st_time}")
 
-# Initialize your loader and transformations here, and transform the loaded DataFrame
-# ...
-
-
-# Usage
-folder_url = 'data_testing/7bc4e498-e698-11ee-9eb5-025f58bc16f6'
-loader = JsonToGDFLoader(folder_url)
-gdf = loader.load()
-
-
-# Define your transformations list as follows:
-transformations = [
-    {
-        'from_column_name': 'original_column1',
-        'to_column_name': 'new_column1',
-        'type_update': 'int64',
-        'transformation_function': lambda x: x * 2
-    },
-    {
-        'from_column_name': 'original_column2',
-        'to_column_name': 'new_column2',
-        'type_update': None,
-        'transformation_function': lambda x: x.strip() if isinstance(x, str) else x
-    }
-    # Add as many dictionaries as needed for transformations
-]
-
-folder_url = 'data_testing/7bc4e498-e698-11ee-9eb5-025f58bc16f6'
-loader = JsonToGDFLoader(folder_url)
-loader.print_head_and_time_taken()
-# gdf = loader.load()
-# tgdf = loader.transform_gdf(gdf,transformations)
+if __name__ == "__main__":
+    # Initialize your loader and transformations here, and transform the loaded DataFrame
+    # ...
+
+
+    # Usage
+    folder_url = 'data_testing/7bc4e498-e698-11ee-9eb5-025f58bc16f6'
+    loader = JsonToGDFLoader(folder_url)
+    gdf = loader.load()
+
+
+    # Define your transformations list as follows:
+    transformations = [
+        {
+            'from_column_name': 'original_column1',
+            'to_column_name': 'new_column1',
+            'type_update': 'int64',
+            'expression': {'op': 'multiply', 'value': 2}
+        },
+        {
+            'from_column_name': 'original_column2',
+            'to_column_name': 'new_column2',
+            'type_update': None,
+            'expression': {'op': 'strip'}
+        }
+        # Add as many dictionaries as needed for transformations
+    ]
+
+    folder_url = 'data_testing/7bc4e498-e698-11ee-9eb5-025f58bc16f6'
+    loader = JsonToGDFLoader(folder_url)
+    loader.print_head_and_time_taken()
+    # gdf = loader.load()
+    # tgdf = loader.transform_gdf(gdf,transformations)
@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.checkpoint import Checkpoint
+from utils.scheduler import UnitsFailedError, run_units
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.sqlite'))
+    yield checkpoint
+    checkpoint.close()
+
+
+def test_resumed_run_sees_its_plan_and_finished_units(tmp_path):
+    path = str(tmp_path / 'checkpoint.sqlite')
+    plan = [('batch_0', (0, None)), ('batch_1', (1, 500))]
+    checkpoint = Checkpoint(path)
+    checkpoint.start_run('run', 'data_testing/run/run', 'SELECT 1', 'batches', plan)
+    checkpoint.record_done('run', 'batch_0', {'key': 'data_testing/run/run_part_0.json', 'rows': 10})
+    checkpoint.record_failure('run', 'batch_1', RuntimeError('timeout'), final=True)
+    checkpoint.finish_run('run', 'failed')
+    checkpoint.close()
+
+    # A new process reopens the journal after the crash
+    checkpoint = Checkpoint(path)
+    run = checkpoint.get_run('run')
+    assert (run['prefix'], run['mode'], run['plan'], run['status']) == \
+        ('data_testing/run/run', 'batches', plan, 'failed')
+    assert checkpoint.completed('run') == {'batch_0': {'key': 'data_testing/run/run_part_0.json', 'rows': 10}}
+
+    # A failed unit that later succeeds counts as done
+    checkpoint.record_done('run', 'batch_1', None)
+    assert set(checkpoint.completed('run')) == {'batch_0', 'batch_1'}
+    assert checkpoint.get_run('missing') is None
+    checkpoint.close()
+
+
+def test_watermark_moves_only_when_the_window_commits(checkpoint):
+    assert checkpoint.get_watermark('query') is None
+
+    checkpoint.begin_increment('query', 'updated_at', 'data_testing/run/run', 'first', 100)
+    state = checkpoint.get_watermark('query')
+    assert (state['watermark'], state['pending_run_id'], state['pending_watermark']) == (None, 'first', 100)
+
+    checkpoint.commit_increment('query', 'first')
+    checkpoint.begin_increment('query', 'updated_at', 'ignored/prefix', 'second', 250)
+    # Another run cannot commit a window it does not own
+    checkpoint.commit_increment('query', 'first')
+    state = checkpoint.get_watermark('query')
+    assert (state['watermark'], state['prefix'], state['pending_run_id']) == (100, 'data_testing/run/run', 'second')
+
+    checkpoint.commit_increment('query', 'second')
+    state = checkpoint.get_watermark('query')
+    assert (state['watermark'], state['pending_run_id'], state['pending_watermark']) == (250, None, None)
+
+
+class FlakyUnits:
+    """Fails each unit a set number of times before it succeeds."""
+
+    def __init__(self, failures):
+        self.failures = dict(failures)
+        self.calls = []
+
+    def __call__(self, payload):
+        self.calls.append(payload)
+        if self.failures.get(payload, 0) > 0:
+            self.failures[payload] -= 1
+            raise RuntimeError(f"{payload} failed")
+        return payload * 10
+
+
+def test_run_units_retries_failures_and_schedules_children():
+    work = FlakyUnits({1: 2})
+    results, attempts = {}, []
+
+    def on_result(unit_id, payload, result):
+        results[unit_id] = result
+        # Unit 2 splits into a child, like an oversized partition
+        return [('child', 5)] if payload == 2 else []
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        run_units(executor, lambda pool, payload: pool.submit(work, payload), [('a', 1), ('b', 2)], on_result,
+                  on_failure=lambda unit_id, error, final: attempts.append((unit_id, final)), retries=3, backoff=0)
+
+    assert results == {'a': 10, 'b': 20, 'child': 50}
+    assert attempts == [('a', False), ('a', False)]
+
+
+def test_run_units_raises_once_every_unit_has_run():
+    work = FlakyUnits({1: 10})
+    results, attempts = {}, []
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with pytest.raises(UnitsFailedError) as failed:
+            run_units(executor, lambda pool, payload: pool.submit(work, payload), [('bad', 1), ('good', 2)],
+                      lambda unit_id, payload, result: results.update({unit_id: result}),
+                      on_failure=lambda unit_id, error, final: attempts.append(final), retries=2, backoff=0)
+
+    assert list(failed.value.failures) == ['bad']
+    assert results == {'good': 20}
+    assert attempts == [False, False, True]
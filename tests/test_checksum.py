@@ -0,0 +1,122 @@
+import hashlib
+import zlib
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+from utils.checksum import (NULL_TEXT, SEPARATOR, bucket_checksums, checksum_spec, find_differing_ranges,
+                            merge_part_checksums, part_checksums, row_hashes, verify_manifest)
+from utils.manifest import append_manifest, build_manifest
+
+
+def reference_hash(values, row_hash):
+    text = SEPARATOR.join(NULL_TEXT if pd.isna(value) else str(value) for value in values).encode('utf-8')
+    if row_hash == 'crc32':
+        return zlib.crc32(text)
+    return int(hashlib.md5(text).hexdigest()[:8], 16)
+
+
+@pytest.fixture
+def frame():
+    # Lengths around the 55/56/64-byte MD5 padding boundaries and multi-byte UTF-8
+    names = ['', 'a', 'ünïcødé ✓', '日本語テキスト', 'x' * 54, 'x' * 55, 'y' * 62, 'z' * 63, 'w' * 119, None]
+    return pd.DataFrame({
+        'id': range(1, len(names) + 1),
+        'name': names,
+        'amount': [Decimal('12.50'), Decimal('-0.001'), None, Decimal('1E+3'), Decimal('0'),
+                   Decimal('99999999.99'), None, Decimal('3.14159'), Decimal('-7'), Decimal('1.10')],
+    })
+
+
+@pytest.mark.parametrize('row_hash', ['crc32', 'md5'])
+def test_row_hashes_match_zlib_and_hashlib(frame, row_hash):
+    columns = ['id', 'name', 'amount']
+    expected = [reference_hash(row, row_hash) for row in frame[columns].itertuples(index=False)]
+    assert row_hashes(frame, columns, row_hash).tolist() == expected
+
+
+@pytest.mark.parametrize('row_hash', ['crc32', 'md5'])
+def test_row_hashes_render_json_floats_as_integers(row_hash):
+    frame = pd.DataFrame({'id': [1.0, None, 3.0]})
+    expected = [reference_hash(['1'], row_hash), reference_hash([None], row_hash), reference_hash(['3'], row_hash)]
+    assert row_hashes(frame, ['id'], row_hash).tolist() == expected
+
+
+class FrameConnector:
+    """Stands in for a connector's checksum pushdown, aggregating an in-memory source table."""
+
+    checksum_hash = 'crc32'
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.queries = 0
+
+    def fetch_min_max(self, query, column):
+        return self.frame[column].min(), self.frame[column].max()
+
+    def fetch_bucket_checksums(self, query, key_column, columns, lower, width, key_range=None):
+        self.queries += 1
+        frame = self.frame
+        if key_range is not None:
+            frame = frame[(frame[key_column] >= key_range[0]) & (frame[key_column] < key_range[1])]
+        return bucket_checksums(frame, key_column, columns, lower, width, self.checksum_hash)
+
+
+@pytest.fixture
+def source():
+    return pd.DataFrame({'id': range(10000), 'value': [f'v{idx}' for idx in range(10000)]})
+
+
+def test_unchanged_table_costs_one_query(source):
+    connector = FrameConnector(source)
+    checksums = bucket_checksums(source, 'id', ['id', 'value'], 0, 10)
+    assert find_differing_ranges(connector, 'q', 'id', ['id', 'value'], checksums, 0, 10) == []
+    assert connector.queries == 1
+
+
+def test_only_differing_buckets_are_subdivided(source):
+    checksums = bucket_checksums(source, 'id', ['id', 'value'], 0, 10)
+    changed = source.copy()
+    changed.loc[1234, 'value'] = 'changed'
+    changed = pd.concat([changed.drop(index=5000), pd.DataFrame({'id': [10005], 'value': ['new']})])
+    connector = FrameConnector(changed)
+
+    ranges = find_differing_ranges(connector, 'q', 'id', ['id', 'value'], checksums, 0, 10)
+    assert ranges == [(1230, 1240), (5000, 5010), (10000, 10010)]
+    # Each level only queries the ranges that differed at the level above
+    assert connector.queries < 20
+
+
+def test_verify_manifest_reads_checksums_recorded_at_extraction(source):
+    spec = checksum_spec({'key_column': 'id', 'columns': ['id', 'value'], 'width': 10})
+    parts = [{'key': f'data_testing/run/run_part_{idx}.json', 'rows': 5000, 'stats': None,
+              'checksums': part_checksums(source.iloc[idx * 5000:(idx + 1) * 5000], spec)}
+             for idx in range(2)]
+    manifest = build_manifest(parts, 'data_testing/run/run', 'SELECT * FROM t', 'id', spec)
+    assert all('checksums' not in part for part in manifest['parts'])
+
+    changed = source.copy()
+    changed.loc[42, 'value'] = 'changed'
+    assert verify_manifest(FrameConnector(source), manifest) == []
+    assert verify_manifest(FrameConnector(changed), manifest) == [(40, 50)]
+
+    # Appended parts add to the recorded buckets
+    extra = pd.DataFrame({'id': [10000], 'value': ['v10000']})
+    appended = append_manifest(manifest, [{'key': 'data_testing/run/run_part_2.json', 'rows': 1, 'stats': None,
+                                           'checksums': part_checksums(extra, spec)}])
+    assert verify_manifest(FrameConnector(pd.concat([source, extra], ignore_index=True)), appended) == []
+
+
+def test_parts_without_checksums_drop_the_manifest_checksums():
+    spec = checksum_spec({'key_column': 'id', 'columns': ['id'], 'width': 10})
+    assert merge_part_checksums(spec, [{'key': 'part_0.csv', 'rows': None}]) is None
+    with pytest.raises(ValueError):
+        verify_manifest(FrameConnector(pd.DataFrame({'id': []})), {'prefix': 'run', 'checksums': None})
+
+
+def test_verify_manifest_rejects_another_row_hash(source):
+    spec = checksum_spec({'key_column': 'id', 'columns': ['id'], 'width': 10}, row_hash='md5')
+    manifest = build_manifest([], 'data_testing/run/run', 'q', 'id', spec)
+    with pytest.raises(ValueError):
+        verify_manifest(FrameConnector(source), manifest)
@@ -0,0 +1,27 @@
+from decimal import Decimal
+
+import pyarrow as pa
+
+from connectors.sql.utils import BINARY_FLAG, UNSIGNED_FLAG, arrow_fields_from_description
+from utils.columnar import records_to_record_batch
+
+
+def mysql_column(name, type_code, flags=0):
+    # mysql.connector's cursor.description entries, with the column flags appended
+    return (name, type_code, None, None, None, None, True, flags)
+
+
+def test_mysql_rows_build_a_typed_record_batch():
+    description = [
+        mysql_column('flags', 16),
+        mysql_column('big', 8, UNSIGNED_FLAG),
+        mysql_column('amount', 246),
+        mysql_column('note', 252),
+        mysql_column('payload', 252, BINARY_FLAG),
+    ]
+    records = [(5, 2 ** 64 - 1, Decimal('12.50'), 'text', b'\x00\x01'), (None, 0, None, None, None)]
+    batch = records_to_record_batch(records, arrow_fields_from_description(description))
+
+    assert batch.schema.types == [pa.uint64(), pa.uint64(), pa.decimal256(65, 30), pa.string(), pa.binary()]
+    assert batch.column(0).to_pylist() == [5, None]
+    assert batch.column(1).to_pylist() == [2 ** 64 - 1, 0]
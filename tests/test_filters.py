@@ -0,0 +1,53 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from utils.backends import PyArrowBackend
+from utils.filters import apply_filters, read_columns, stats_may_match
+
+STATS = {'tx_amount': {'min': 10, 'max': 50}, 'tx_date': {'min': '2024-01-01', 'max': '2024-01-31'}}
+
+
+@pytest.mark.parametrize('filters, may_match', [
+    ([('tx_amount', '>', 50)], False),
+    ([('tx_amount', '>=', 50)], True),
+    ([('tx_amount', '<', 10)], False),
+    ([('tx_amount', '=', 30), ('tx_date', '>=', '2024-02-01')], False),
+    ([[('tx_amount', '=', 5)], [('tx_date', '<=', '2024-01-01')]], True),
+    ([('tx_amount', 'in', [1, 2, 60])], False),
+    ([('tx_amount', '!=', 30)], True),
+    # Missing and incomparable stats never prune
+    ([('tx_status', '=', 'FAILED')], True),
+    ([('tx_date', '>', 5)], True),
+])
+def test_stats_prune_parts_that_cannot_match(filters, may_match):
+    assert stats_may_match(STATS, filters) is may_match
+
+
+def test_filters_keep_matching_rows_and_drop_filter_only_columns():
+    frame = pd.DataFrame({'id': [1, 2, 3, 4], 'status': ['ok', 'failed', 'ok', 'failed'], 'amount': [5, 15, 25, 35]})
+    filters = [[('status', '=', 'failed'), ('amount', '>', 20)], [('id', 'in', [1])]]
+    assert read_columns(['id'], filters) == ['id', 'status', 'amount']
+    assert apply_filters(frame, filters, ['id'])['id'].tolist() == [1, 4]
+
+
+def test_parquet_parts_prune_row_groups_and_columns():
+    table = pa.table({'id': list(range(100)), 'amount': [idx * 2 for idx in range(100)], 'note': ['x'] * 100})
+    buf = io.BytesIO()
+    pq.write_table(table, buf, row_group_size=10)
+
+    result = PyArrowBackend().read_table(buf.getvalue(), 'part_0.parquet', ['id'], [('amount', '>=', 190)])
+    assert result.column_names == ['id']
+    assert result['id'].to_pylist() == [95, 96, 97, 98, 99]
+
+
+@pytest.mark.parametrize('name, content', [
+    ('part_1.csv', b'id,amount\n1,5\n2,50\n'),
+    ('part_1.json', b'{"id": 1, "amount": 5}\n{"id": 2, "amount": 50}\n'),
+])
+def test_text_parts_apply_the_same_filters(name, content):
+    frame = PyArrowBackend().read_part(content, name, ['id'], [('amount', '>', 10)])
+    assert frame.to_dict('list') == {'id': [2]}
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from utils.manifest import find_manifest, list_data_parts
+from utils.s3utils import BUCKET_CONFIGS, S3Utils
+
+
+@pytest.fixture
+def s3utils(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET_CONFIGS.BUCKET_NAME)
+        yield S3Utils()
+
+
+def put(s3utils, key, body):
+    s3utils.bucket_resource.put_object(Bucket=BUCKET_CONFIGS.BUCKET_NAME, Key=key, Body=body)
+
+
+def test_find_manifest_is_none_only_when_missing(s3utils):
+    assert find_manifest(s3utils, 'data_testing/run') is None
+
+    put(s3utils, 'data_testing/run/manifest.json', json.dumps({'parts': []}).encode())
+    assert find_manifest(s3utils, 'data_testing/run') == {'parts': []}
+
+    put(s3utils, 'data_testing/run/manifest.json', b'{"parts": [')
+    with pytest.raises(ValueError):
+        find_manifest(s3utils, 'data_testing/run')
+
+
+def test_listing_leaves_out_the_manifest(s3utils):
+    put(s3utils, 'data_testing/run/run_part_0.json', b'{}\n')
+    put(s3utils, 'data_testing/run/manifest.json', b'{}')
+    assert [obj['key'] for obj in list_data_parts(s3utils, 'data_testing/run')] == ['data_testing/run/run_part_0.json']
@@ -0,0 +1,23 @@
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+
+from utils.profiling import merge_profiles, profile_frame, profile_from_json, profile_to_json
+
+
+def test_decimal_columns_sum_exactly():
+    rows = pd.DataFrame({'tx_amount': [Decimal('0.10'), None, Decimal('0.20')]})
+    columnar = pa.table({'tx_amount': pa.array([Decimal('1000000000000.01')], pa.decimal128(20, 2))}).to_pandas()
+
+    assert profile_frame(rows)['tx_amount']['sum'] == '0.30'
+    assert profile_frame(columnar)['tx_amount']['sum'] == '1000000000000.01'
+
+    # Sums read back from a manifest merge without going through float
+    total = profile_from_json(profile_to_json(profile_frame(rows)))
+    assert merge_profiles(total, profile_frame(columnar))['tx_amount']['sum'] == '1000000000000.31'
+
+
+def test_numeric_sums_stay_numbers():
+    profile = merge_profiles(profile_frame(pd.DataFrame({'a': [1, 2]})), profile_frame(pd.DataFrame({'a': [3]})))
+    assert profile['a']['sum'] == 6
@@ -0,0 +1,36 @@
+import pandas as pd
+
+import utils.reconcile
+from utils.reconcile import reconcile
+
+
+def frames(rows):
+    source = pd.DataFrame({'id': range(rows), 'amount': range(rows), 'status': ['ok'] * rows})
+    # The export lost row 1, gained row `rows`, and changed the status of row 2 and the amount of row 3;
+    # amounts came back as floats, as JSON exports with NULLs do
+    target = source[source['id'] != 1].copy()
+    target.loc[target['id'] == 2, 'status'] = 'failed'
+    target.loc[target['id'] == 3, 'amount'] = 30
+    target = pd.concat([target, pd.DataFrame({'id': [rows], 'amount': [0], 'status': ['ok']})], ignore_index=True)
+    target['amount'] = target['amount'].astype(float)
+    return source, target
+
+
+def check(result, rows):
+    assert result['missing']['id'].tolist() == [1]
+    assert result['extra']['id'].tolist() == [rows]
+    changed = result['changed'].sort_values('id')
+    assert changed['id'].tolist() == [2, 3]
+    assert changed['columns'].tolist() == [['status'], ['amount']]
+    assert result['counts'] == {'source_rows': rows, 'target_rows': rows, 'missing': 1, 'extra': 1, 'changed': 2}
+
+
+def test_reconcile_reports_missing_extra_and_changed_columns():
+    source, target = frames(10)
+    check(reconcile(source, target, ['id'], workers=1), 10)
+
+
+def test_partitioned_reconcile_matches_single_process(monkeypatch):
+    monkeypatch.setattr(utils.reconcile, 'PARALLEL_MIN_ROWS', 10)
+    source, target = frames(100)
+    check(reconcile(source, target, ['id'], workers=3), 100)
@@ -0,0 +1,51 @@
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from utils.s3utils import BUCKET_CONFIGS, MIN_PART_SIZE, MultipartUploadWriter
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET_CONFIGS.BUCKET_NAME)
+        yield client
+
+
+def open_uploads(client):
+    return client.list_multipart_uploads(Bucket=BUCKET_CONFIGS.BUCKET_NAME).get('Uploads', [])
+
+
+def test_multipart_writer_uploads_all_parts(s3_client):
+    data = b'x' * MIN_PART_SIZE + b'tail'
+    with MultipartUploadWriter(s3_client, 'parts/object.json', part_size=MIN_PART_SIZE) as writer:
+        writer.write(data[:100])
+        writer.write(data[100:])
+
+    body = s3_client.get_object(Bucket=BUCKET_CONFIGS.BUCKET_NAME, Key='parts/object.json')['Body'].read()
+    assert body == data
+    assert len(writer.summary()['parts']) == 2
+    assert open_uploads(s3_client) == []
+
+
+def test_multipart_writer_aborts_when_a_part_fails(s3_client):
+    upload_part = s3_client.upload_part
+
+    def failing_upload_part(**kwargs):
+        if kwargs['PartNumber'] == 2:
+            raise ConnectionError('part upload failed')
+        return upload_part(**kwargs)
+
+    s3_client.upload_part = failing_upload_part
+    with pytest.raises(ConnectionError):
+        with MultipartUploadWriter(s3_client, 'parts/broken.json', part_size=MIN_PART_SIZE) as writer:
+            writer.write(b'x' * MIN_PART_SIZE + b'tail')
+
+    # The failure surfaced in close() on the success path of the with block, and still aborted the upload
+    assert open_uploads(s3_client) == []
+    assert writer.executor._shutdown
@@ -0,0 +1,50 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.snapshot import SnapshotCoordinator
+
+
+class LoggingConnector:
+    """A MySQL-like connector that appends every session event to a shared log file."""
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.connection = None
+
+    def log(self, event):
+        with open(self.log_path, 'a') as log:
+            log.write(f"{event} {os.getpid()}\n")
+
+    def open_connection(self):
+        self.connection = object()
+        self.log('connect')
+
+    def lock_for_snapshot(self):
+        self.log('lock')
+
+    def start_snapshot(self):
+        self.log('start')
+
+    def unlock_tables(self):
+        self.log('unlock')
+
+    def end_snapshot(self):
+        pass
+
+    def close_connection(self):
+        self.connection = None
+
+
+def test_workers_connect_before_the_global_read_lock(tmp_path):
+    log_path = str(tmp_path / 'events.log')
+    workers = 3
+    with SnapshotCoordinator(workers, LoggingConnector, log_path, timeout=30) as snapshot:
+        with ProcessPoolExecutor(max_workers=workers, **snapshot.pool_args()) as executor:
+            snapshot.synchronize(executor)
+
+    events = [line.split()[0] for line in open(log_path)]
+    lock, unlock = events.index('lock'), events.index('unlock')
+    # The coordinator and every worker connect before the lock; all snapshots start while it is held
+    assert events.count('connect') == workers + 1
+    assert all(event == 'connect' for event in events[:lock])
+    assert events[lock + 1:unlock] == ['start'] * (workers + 1)
@@ -0,0 +1,52 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pytest
+
+from utils.transform_plan import TransformPlan
+
+
+def add_suffix(value):
+    return f'{value}-x'
+
+
+def test_plan_renames_then_applies_expressions_then_casts():
+    plan = TransformPlan([
+        {'from_column_name': 'amt', 'to_column_name': 'amount',
+         'expression': [{'op': 'multiply', 'value': 100}, {'op': 'add', 'value': 1}], 'type_update': 'int64'},
+        {'from_column_name': 'flag', 'expression': {'op': 'map', 'mapping': {'Y': True}, 'default': False}},
+        {'from_column_name': 'name', 'to_column_name': 'label', 'expression': {'op': 'strip'},
+         'transformation_function': str.upper},
+        {'from_column_name': 'missing', 'expression': {'op': 'lower'}},
+    ])
+    frame = pd.DataFrame({'amt': [1.5, 2.25], 'flag': ['Y', 'N'], 'name': [' a ', 'b ']})
+    result = plan.apply(frame)
+
+    assert list(result.columns) == ['amount', 'flag', 'label']
+    assert result['amount'].tolist() == [151, 226] and result['amount'].dtype == 'int64'
+    assert result['flag'].tolist() == [True, False]
+    # An expression takes precedence over a per-value function
+    assert result['label'].tolist() == ['a', 'b']
+    # A plan holds no frame state, so it applies to every part alike
+    assert plan.apply(frame.iloc[:1])['amount'].tolist() == [151]
+
+
+def test_functions_run_in_chunks_on_an_executor():
+    plan = TransformPlan([{'from_column_name': 'name', 'transformation_function': add_suffix}], chunk_rows=2)
+    frame = pd.DataFrame({'name': [f'n{idx}' for idx in range(5)]})
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        plan.executor = executor
+        assert plan.apply(frame)['name'].tolist() == [f'n{idx}-x' for idx in range(5)]
+    # The caller's frame is left as it was
+    assert frame['name'].tolist() == [f'n{idx}' for idx in range(5)]
+
+    # Lambdas cannot be pickled, so they run in process
+    plan = TransformPlan([{'from_column_name': 'name', 'transformation_function': lambda value: value * 2}],
+                         chunk_rows=2)
+    plan.executor = executor
+    assert plan.apply(frame)['name'].tolist()[:2] == ['n0n0', 'n1n1']
+
+
+def test_unknown_expression_is_rejected():
+    with pytest.raises(ValueError):
+        TransformPlan([{'from_column_name': 'a', 'expression': {'op': 'eval', 'code': '1'}}])
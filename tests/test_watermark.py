@@ -0,0 +1,60 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from utils.manifest import append_manifest, build_manifest
+from utils.prefetch import part_sort_key
+from utils.watermark import add_watermark, increment_prefix, sql_literal, watermark_query_id, window_lower
+
+
+def part(key):
+    return {'key': key, 'rows': 1, 'bytes': 1, 'stats': None}
+
+
+def test_increment_parts_sort_after_the_parts_they_follow():
+    prefix = 'data_testing/run/run'
+    keys = [f'{increment_prefix(prefix, 10)}_part_0', f'{prefix}_part_10', f'{increment_prefix(prefix, 2)}_part_1',
+            f'{prefix}_part_2', f'{increment_prefix(prefix, 2)}_part_0']
+    assert sorted(keys, key=part_sort_key) == [
+        f'{prefix}_part_2', f'{prefix}_part_10', f'{prefix}_inc_000002_part_0', f'{prefix}_inc_000002_part_1',
+        f'{prefix}_inc_000010_part_0']
+
+
+def test_appended_manifest_lists_increments_last():
+    prefix = 'data_testing/run/run'
+    manifest = build_manifest([part(f'{prefix}_part_0'), part(f'{prefix}_part_1')], prefix)
+    manifest = append_manifest(manifest, [part(f'{increment_prefix(prefix, 1)}_part_0')])
+    assert [entry['key'] for entry in manifest['parts']] == [
+        f'{prefix}_part_0', f'{prefix}_part_1', f'{prefix}_inc_000001_part_0']
+
+
+def test_watermark_window_bounds():
+    query = 'SELECT * FROM transactions'
+    assert add_watermark(query, 'id') == query
+    assert add_watermark(query, 'id', upper=100) == \
+        'SELECT * FROM (SELECT * FROM transactions) AS watermark_subquery WHERE id <= 100'
+    assert add_watermark(query, 'updated_at', datetime(2024, 3, 1, 12, 30), datetime(2024, 3, 2)) == (
+        "SELECT * FROM (SELECT * FROM transactions) AS watermark_subquery "
+        "WHERE updated_at > '2024-03-01 12:30:00' AND updated_at <= '2024-03-02 00:00:00'")
+
+
+def test_sql_literal_only_renders_watermark_types():
+    assert [sql_literal(value) for value in (5, Decimal('1.50'), 2.5, date(2024, 1, 31))] == \
+        ['5', '1.50', '2.5', "'2024-01-31'"]
+    for value in (True, 'drop table', None):
+        with pytest.raises(TypeError):
+            sql_literal(value)
+
+
+def test_overlap_moves_the_lower_bound_back():
+    watermark = datetime(2024, 3, 1)
+    assert window_lower(None, timedelta(hours=1)) is None
+    assert window_lower(watermark) == watermark
+    assert window_lower(watermark, timedelta(hours=1)) == datetime(2024, 2, 29, 23)
+    assert window_lower(1000, 50) == 950
+
+
+def test_query_id_ignores_surrounding_whitespace_and_db_case():
+    assert watermark_query_id('MySQL', ' SELECT 1\n', 'id') == watermark_query_id('mysql', 'SELECT 1', 'id')
+    assert watermark_query_id('mysql', 'SELECT 1', 'id') != watermark_query_id('mysql', 'SELECT 1', 'updated_at')
@@ -1,8 +1,12 @@
 import os
+import asyncio
+from contextlib import AsyncExitStack
 from dotenv import load_dotenv
 import aioboto3
+from aiobotocore.config import AioConfig
 import traceback
 import aiohttp
+from utils.buffer_pool import MemoryViewReader, buffer_body
 
 load_dotenv()
 
@@ -18,33 +22,68 @@ class BUCKET_CONFIGS:
 ENV = os.environ.get("ENV", "LOCAL")
 
 class async_S3Utils:
-    def __init__(self):
-        """Interface to Store and Download reports from bucket"""
-        self.__get_bucket_resource__(BUCKET_CONFIGS.BUCKET_REGION,
-                                     BUCKET_CONFIGS.ROLE_SESSION)
+    def __init__(self, max_pool_connections=50):
+        """Interface to Store and Download reports from bucket
+
+        The client is created on ``open()`` (or on first use, or by entering
+        ``async with``) and must be released with ``close()``. A single
+        session and connection pool is shared by every request, so one event
+        loop can keep up to ``max_pool_connections`` requests in flight.
+        """
+        self.max_pool_connections = max_pool_connections
+        self.session = None
+        self.bucket_resource = None
+        self.exit_stack = None
+        # Concurrent first uses must not each create their own client
+        self.open_lock = asyncio.Lock()
+
+    async def open(self):
+        async with self.open_lock:
+            if self.bucket_resource is None:
+                await self.__get_bucket_resource__(BUCKET_CONFIGS.BUCKET_REGION,
+                                                   BUCKET_CONFIGS.ROLE_SESSION)
+        return self
+
+    async def close(self):
+        if self.exit_stack is not None:
+            await self.exit_stack.aclose()
+        self.exit_stack = None
+        self.bucket_resource = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
 
     async def __get_bucket_resource__(self, bucket_location: str,
                                       bucket_role_session: str):
         """Initialize the bucket resource
-        [Unchanged Docstring]
+
+        Args:
+            bucket_location (str): Location of the bucket
+            bucket_role_session (str): Session Name of the bucket
         """
+        await self.close()
         if ENV in ["STG", "CLIENT"]:
             print("PROD")
-            self.sts_client = aioboto3.client('sts')
-            self.assumed_role = await self.sts_client.assume_role(
-                RoleArn=BUCKET_CONFIGS.ROLE_ARN,
-                RoleSessionName=bucket_role_session)
-            # Note that assume_role(...) is not an operation in boto3's STS client
+            async with aioboto3.Session().client('sts') as sts_client:
+                self.assumed_role = await sts_client.assume_role(
+                    RoleArn=BUCKET_CONFIGS.ROLE_ARN,
+                    RoleSessionName=bucket_role_session)
 
             self.creds = self.assumed_role.get("Credentials")
-            self.bucket_resource = aioboto3.client(
-                "s3",
+            self.session = aioboto3.Session(
                 aws_access_key_id=self.creds.get("AccessKeyId"),
                 aws_secret_access_key=self.creds.get("SecretAccessKey"),
                 aws_session_token=self.creds.get("SessionToken"),
                 region_name=bucket_location)
         else:
-            self.bucket_resource = aioboto3.client("s3")
+            self.session = aioboto3.Session()
+
+        self.exit_stack = AsyncExitStack()
+        self.bucket_resource = await self.exit_stack.enter_async_context(
+            self.session.client("s3", config=AioConfig(max_pool_connections=self.max_pool_connections)))
 
     async def download_file(self, url: str):
         async with aiohttp.ClientSession() as session:
@@ -56,28 +95,86 @@ class async_S3Utils:
                 else:
                     response.raise_for_status()
 
-    async def upload_file(self, key_name: str, data):
+    async def download_object(self, key_name: str):
+        """Download an object's content directly through the pooled client."""
+        await self.open()
+        response = await self.bucket_resource.get_object(
+            Bucket=BUCKET_CONFIGS.BUCKET_NAME,
+            Key=key_name)
+        async with response['Body'] as stream:
+            return await stream.read()
+
+    async def upload_file(self, key_name: str, data, retry=True):
+        client = None
         try:
+            await self.open()
+            client = self.bucket_resource
             key = f'{key_name}'
             purl = await self.__generate_presigned_url__(key)
+            body = MemoryViewReader(data) if isinstance(data, memoryview) else data
             await self.bucket_resource.put_object(
-                Body=data,
+                Body=body,
                 Bucket=BUCKET_CONFIGS.BUCKET_NAME,
                 Key=key_name)
             # url = f'https://s3-{BUCKET_CONFIGS.BUCKET_REGION}.amazonaws.com/{BUCKET_CONFIGS.BUCKET_NAME}/{key}'
             return purl, key, True
-        
+
         except Exception as e:
-            print(f'CLIENT ERROR WHEN DOWNLOADING FILE: {e}')
+            print(f'CLIENT ERROR WHEN UPLOADING FILE: {e}')
+            if not retry:
+                print(f'TRACEBACK: {traceback.format_exc()}')
+                return False, False, None
             try:
-                self.__get_bucket_resource__(BUCKET_CONFIGS.BUCKET_REGION,
-                                             BUCKET_CONFIGS.ROLE_SESSION)
-                return self.upload_file(key, data)
+                # Concurrent uploads failing together should rebuild the shared client only once
+                async with self.open_lock:
+                    if self.bucket_resource is client:
+                        await self.__get_bucket_resource__(BUCKET_CONFIGS.BUCKET_REGION,
+                                                           BUCKET_CONFIGS.ROLE_SESSION)
+                if hasattr(data, 'seek'):
+                    data.seek(0)
+                return await self.upload_file(key_name, data, retry=False)
             except Exception as e:
                 print(f'EXCEPTION WHILE UPLOADING THE FILE: {str(e)}')
                 print(f'TRACEBACK: {traceback.format_exc()}')
                 return False, False, None
 
+    async def upload_buffer(self, key_name: str, buf):
+        """Upload a buffer filled by utils.buffer_pool.BufferPool without copying it."""
+        body = buffer_body(buf)
+        try:
+            return await self.upload_file(key_name, body)
+        finally:
+            if isinstance(body, memoryview):
+                body.release()
+
+    async def upload_many(self, items, concurrency=16):
+        """Upload ``(key, data)`` pairs with at most ``concurrency`` requests in flight.
+
+        Returns the upload_file results in the order of ``items``.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def upload(key_name, data):
+            async with semaphore:
+                return await self.upload_file(key_name, data)
+
+        await self.open()
+        return await asyncio.gather(*(upload(key_name, data) for key_name, data in items))
+
+    async def download_many(self, keys, concurrency=16):
+        """Download objects with at most ``concurrency`` requests in flight.
+
+        Returns the contents in the order of ``keys``.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def download(key_name):
+            async with semaphore:
+                return await self.download_object(key_name)
+
+        await self.open()
+        return await asyncio.gather(*(download(key_name) for key_name in keys))
+
     async def __generate_presigned_url__(self, object_name, expiration=3600):
         try:
             response = await self.bucket_resource.generate_presigned_url(
@@ -93,4 +190,4 @@ class async_S3Utils:
         except Exception as e:
             print(f'EXCEPTION WHILE UPLOADING THE FILE: {str(e)}')
             print(f'TRACEBACK: {traceback.format_exc()}')
-            return False
\ No newline at end of file
+            return False
@@ -0,0 +1,111 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+
+from utils.filters import apply_filters, read_columns
+
+try:
+    import cudf
+except ImportError:
+    # CPU-only nodes have no GPU stack; the pyarrow backend covers them
+    cudf = None
+
+
+class PyArrowBackend:
+    """
+    CPU engine: parses parts with Arrow's multithreaded readers and hands
+    back pandas DataFrames, so parsing uses every core instead of holding
+    the GIL like ``pandas.read_json``.
+    """
+
+    name = 'cpu'
+
+    def read_table(self, content, name, columns=None, filters=None):
+        """
+        Parse one part into a ``pyarrow.Table``, picking the reader from the part's extension.
+
+        Parquet pushes ``columns`` and ``filters`` into the reader, which skips row groups
+        whose statistics rule the filters out; CSV only converts the needed columns and
+        JSON drops the rest right after parsing. Rows are filtered before any pandas
+        conversion.
+        """
+        source = pa.BufferReader(content)
+        needed = read_columns(columns, filters)
+        if name.endswith('.parquet'):
+            table = pq.read_table(source, columns=needed, filters=filters or None, use_threads=True)
+        elif name.endswith('.csv'):
+            table = pa_csv.read_csv(
+                source,
+                read_options=pa_csv.ReadOptions(use_threads=True),
+                convert_options=pa_csv.ConvertOptions(include_columns=needed))
+        else:
+            table = pa_json.read_json(source, read_options=pa_json.ReadOptions(use_threads=True))
+            if needed:
+                table = table.select(needed)
+        if filters and not name.endswith('.parquet'):
+            table = table.filter(pq.filters_to_expression(filters))
+        return table.select(columns) if columns else table
+
+    def read_part(self, content, name, columns=None, filters=None):
+        return self.from_arrow(self.read_table(content, name, columns, filters))
+
+    def from_arrow(self, table):
+        return table.to_pandas(use_threads=True)
+
+    def to_arrow(self, frame):
+        return pa.Table.from_pandas(frame, preserve_index=False)
+
+    def concat(self, frames):
+        return pd.concat(frames, ignore_index=True)
+
+    def empty(self):
+        return pd.DataFrame()
+
+
+class CudfBackend:
+    """GPU engine: parses parts straight into cuDF DataFrames."""
+
+    name = 'cudf'
+
+    def read_part(self, content, name, columns=None, filters=None):
+        needed = read_columns(columns, filters)
+        if name.endswith('.parquet'):
+            # Row groups are pruned by the reader; rows are filtered below
+            gdf = cudf.read_parquet(io.BytesIO(content), columns=needed, filters=filters or None)
+        elif name.endswith('.csv'):
+            gdf = cudf.read_csv(io.BytesIO(content), usecols=needed)
+        else:
+            gdf = cudf.read_json(io.BytesIO(content), lines=True)
+        return apply_filters(gdf, filters, columns)
+
+    def from_arrow(self, table):
+        return cudf.DataFrame.from_arrow(table)
+
+    def to_arrow(self, frame):
+        return frame.to_arrow(preserve_index=False)
+
+    def concat(self, frames):
+        return cudf.concat(frames, ignore_index=True)
+
+    def empty(self):
+        return cudf.DataFrame()
+
+
+def get_backend(backend='auto'):
+    """
+    Resolve a backend by name: ``cpu``, ``cudf``, or ``auto`` for cuDF
+    when it is importable and the pyarrow engine otherwise.
+    """
+    if backend == 'auto':
+        backend = 'cudf' if cudf is not None else 'cpu'
+    if backend == 'cudf':
+        if cudf is None:
+            raise ImportError("The cudf backend was requested but cudf is not installed")
+        return CudfBackend()
+    if backend == 'cpu':
+        return PyArrowBackend()
+    raise ValueError(f"Unknown loader backend: {backend}")
@@ -0,0 +1,113 @@
+import hashlib
+import io
+import tempfile
+from contextlib import contextmanager
+
+
+class MemoryViewReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over a memoryview.
+
+    boto3 only accepts bytes or file-like bodies; this lets a serialized
+    buffer be uploaded without copying it into a new bytes object first.
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.position + size, len(self.view))
+        chunk = self.view[self.position:end].tobytes()
+        self.position = end
+        return chunk
+
+    def readinto(self, buffer):
+        chunk = self.view[self.position:self.position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = len(self.view) + offset
+        self.position = max(0, min(self.position, len(self.view)))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def __len__(self):
+        return len(self.view)
+
+
+class BufferPool:
+    """
+    Reusable in-memory buffers for serializing batches before upload.
+
+    With a ``spill_threshold`` the buffer is a SpooledTemporaryFile instead,
+    which stays in memory until it grows past the threshold and then spills
+    to disk; use it for batches too large to hold in RAM.
+    """
+
+    def __init__(self, size=4):
+        self.size = size
+        self.buffers = []
+
+    def acquire(self, spill_threshold=None, spill_dir=None):
+        """Take a buffer; hand it back with ``release`` once its contents are uploaded."""
+        if spill_threshold:
+            return tempfile.SpooledTemporaryFile(max_size=spill_threshold, dir=spill_dir)
+        return self.buffers.pop() if self.buffers else io.BytesIO()
+
+    def release(self, buf):
+        if not isinstance(buf, io.BytesIO):
+            buf.close()
+            return
+        # Any memoryview over the buffer must be released before it can be resized
+        buf.seek(0)
+        buf.truncate()
+        if len(self.buffers) < self.size:
+            self.buffers.append(buf)
+
+    @contextmanager
+    def buffer(self, spill_threshold=None, spill_dir=None):
+        buf = self.acquire(spill_threshold, spill_dir)
+        try:
+            yield buf
+        finally:
+            self.release(buf)
+
+
+def buffer_md5(buf, chunk_size=1024 * 1024):
+    """Hex MD5 of a filled buffer's contents, without copying in-memory buffers."""
+    digest = hashlib.md5()
+    if isinstance(buf, io.BytesIO):
+        with buf.getbuffer() as view:
+            digest.update(view)
+        return digest.hexdigest()
+    buf.seek(0)
+    for chunk in iter(lambda: buf.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def buffer_body(buf):
+    """
+    Return an upload body for a filled buffer: a memoryview for in-memory
+    buffers, or the rewound file itself once it has spilled to disk.
+    """
+    if isinstance(buf, io.BytesIO):
+        return buf.getbuffer()
+    buf.seek(0)
+    return buf
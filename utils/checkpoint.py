@@ -0,0 +1,153 @@
+import pickle
+import sqlite3
+import time
+
+
+class Checkpoint:
+    """
+    Durable local journal of an export run, kept in SQLite.
+
+    A run stores its key prefix, query and the planned work units up front;
+    each unit is recorded with its manifest entry as soon as its upload
+    completes. A crashed run can then be resumed under the same prefix,
+    scheduling only the units that never completed. Output keys are derived
+    from the prefix and unit, so a unit that is redone overwrites its own
+    part instead of adding a duplicate.
+
+    The same store keeps the high watermark of incrementally extracted queries.
+
+    Only the coordinating process writes to the journal; pool workers never
+    open it.
+    """
+
+    def __init__(self, path='export_checkpoint.sqlite'):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                prefix TEXT NOT NULL,
+                query TEXT,
+                mode TEXT,
+                plan BLOB,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS units (
+                run_id TEXT NOT NULL,
+                unit_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                entry BLOB,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (run_id, unit_id)
+            );
+            CREATE TABLE IF NOT EXISTS watermarks (
+                query_id TEXT PRIMARY KEY,
+                watermark_column TEXT NOT NULL,
+                prefix TEXT NOT NULL,
+                watermark BLOB,
+                pending_run_id TEXT,
+                pending_watermark BLOB,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self.connection.commit()
+
+    def start_run(self, run_id, prefix, query, mode, plan):
+        """Register a new run with its planned units, a list of ``(unit_id, payload)``."""
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO runs (run_id, prefix, query, mode, plan, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'running', ?, ?)",
+                (run_id, prefix, query, mode, pickle.dumps(plan), now, now))
+
+    def get_run(self, run_id):
+        """:return: The run as a dict (``plan`` unpickled), or None if it was never started."""
+        row = self.connection.execute(
+            "SELECT run_id, prefix, query, mode, plan, status FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'run_id': row[0],
+            'prefix': row[1],
+            'query': row[2],
+            'mode': row[3],
+            'plan': pickle.loads(row[4]) if row[4] else [],
+            'status': row[5],
+        }
+
+    def completed(self, run_id):
+        """:return: ``{unit_id: entry}`` of every unit of the run that finished."""
+        rows = self.connection.execute(
+            "SELECT unit_id, entry FROM units WHERE run_id = ? AND status = 'done'", (run_id,)).fetchall()
+        return {unit_id: pickle.loads(entry) if entry else None for unit_id, entry in rows}
+
+    def record_done(self, run_id, unit_id, entry):
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO units (run_id, unit_id, status, attempts, entry, updated_at) "
+                "VALUES (?, ?, 'done', 1, ?, ?) "
+                "ON CONFLICT (run_id, unit_id) DO UPDATE SET "
+                "status = 'done', attempts = attempts + 1, entry = excluded.entry, error = NULL, "
+                "updated_at = excluded.updated_at",
+                (run_id, unit_id, pickle.dumps(entry), time.time()))
+
+    def record_failure(self, run_id, unit_id, error, final=False):
+        """Count a failed attempt; ``final`` marks the unit failed once its retries are exhausted."""
+        status = 'failed' if final else 'retrying'
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO units (run_id, unit_id, status, attempts, error, updated_at) "
+                "VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (run_id, unit_id) DO UPDATE SET "
+                "status = excluded.status, attempts = attempts + 1, error = excluded.error, "
+                "updated_at = excluded.updated_at",
+                (run_id, unit_id, status, str(error), time.time()))
+
+    def finish_run(self, run_id, status='done'):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE runs SET status = ?, updated_at = ? WHERE run_id = ?", (status, time.time(), run_id))
+
+    def get_watermark(self, query_id):
+        """:return: The watermark state of an incremental query as a dict, or None before its first run."""
+        row = self.connection.execute(
+            "SELECT watermark_column, prefix, watermark, pending_run_id, pending_watermark "
+            "FROM watermarks WHERE query_id = ?", (query_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'query_id': query_id,
+            'watermark_column': row[0],
+            'prefix': row[1],
+            'watermark': pickle.loads(row[2]) if row[2] else None,
+            'pending_run_id': row[3],
+            'pending_watermark': pickle.loads(row[4]) if row[4] else None,
+        }
+
+    def begin_increment(self, query_id, watermark_column, prefix, run_id, upper):
+        """Record the window ``run_id`` extracts up to; the watermark only moves once it commits."""
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO watermarks (query_id, watermark_column, prefix, pending_run_id, pending_watermark, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (query_id) DO UPDATE SET "
+                "pending_run_id = excluded.pending_run_id, pending_watermark = excluded.pending_watermark, "
+                "updated_at = excluded.updated_at",
+                (query_id, watermark_column, prefix, run_id, pickle.dumps(upper), time.time()))
+
+    def commit_increment(self, query_id, run_id):
+        """Advance the watermark to the window of a completed run."""
+        with self.connection:
+            self.connection.execute(
+                "UPDATE watermarks SET watermark = pending_watermark, pending_run_id = NULL, "
+                "pending_watermark = NULL, updated_at = ? WHERE query_id = ? AND pending_run_id = ?",
+                (time.time(), query_id, run_id))
+
+    def close(self):
+        self.connection.close()
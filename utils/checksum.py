@@ -0,0 +1,348 @@
+import hashlib
+import zlib
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utils.partitioning import make_partition
+
+# Must match the text the connectors' add_checksum queries build per row
+NULL_TEXT = '<null>'
+SEPARATOR = '|'
+
+
+# Rows are hashed this many at a time, bounding the per-position gather arrays
+HASH_CHUNK_ROWS = 65536
+
+
+
+def crc32_table():
+    table = np.arange(256, dtype=np.uint32)
+    for _ in range(8):
+        table = np.where(table & 1, (table >> np.uint32(1)) ^ np.uint32(0xEDB88320), table >> np.uint32(1))
+    return table.astype(np.uint32)
+
+
+# Reflected CRC-32 lookup table, as used by zlib
+CRC32_TABLE = crc32_table()
+
+# MD5 per-round constants, shift amounts and message word order (RFC 1321)
+MD5_K = np.floor(np.abs(np.sin(np.arange(1, 65))) * 2 ** 32).astype(np.uint32)
+MD5_SHIFTS = [7, 12, 17, 22] * 4 + [5, 9, 14, 20] * 4 + [4, 11, 16, 23] * 4 + [6, 10, 15, 21] * 4
+MD5_WORDS = ([i for i in range(16)] + [(5 * i + 1) % 16 for i in range(16)]
+             + [(3 * i + 5) % 16 for i in range(16)] + [(7 * i) % 16 for i in range(16)])
+
+
+def crc32_hash(text):
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def md5_hash(text):
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def crc32_hashes(data, starts, lengths):
+    """
+    ``crc32_hash`` of many byte strings at once, one numpy step per byte position.
+
+    :param data: uint8 array holding the strings back to back.
+    :param starts: Offset of each string in ``data``.
+    :param lengths: Length of each string, sorted in descending order.
+    """
+    crc = np.full(len(starts), 0xFFFFFFFF, dtype=np.uint32)
+    for position in range(int(lengths[0]) if len(lengths) else 0):
+        # Strings are sorted by length, so the ones still running are a prefix
+        active = int(np.count_nonzero(lengths > position))
+        byte = data[starts[:active] + position]
+        crc[:active] = CRC32_TABLE[(crc[:active] ^ byte) & 0xFF] ^ (crc[:active] >> np.uint32(8))
+    return crc ^ np.uint32(0xFFFFFFFF)
+
+
+def rotate_left(value, shift):
+    return (value << np.uint32(shift)) | (value >> np.uint32(32 - shift))
+
+
+def md5_hashes(data, starts, lengths):
+    """
+    ``md5_hash`` (first 32 bits of MD5) of many byte strings at once, one numpy step per round.
+
+    Arguments as for ``crc32_hashes``.
+    """
+    rows = len(starts)
+    blocks = (lengths + 8) // 64 + 1
+    state = [np.full(rows, value, dtype=np.uint32) for value in (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476)]
+    bit_lengths = (lengths.astype(np.uint64) * np.uint64(8)).view(np.uint8).reshape(rows, 8)
+    for block in range(int(blocks[0]) if rows else 0):
+        active = int(np.count_nonzero(blocks > block))
+        # Assemble this block of each padded message: data, 0x80, zeros, then the bit length
+        positions = block * 64 + np.arange(64)
+        row_lengths = lengths[:active, None]
+        inside = positions < row_lengths
+        message = np.zeros((active, 64), dtype=np.uint8)
+        message[inside] = data[(starts[:active, None] + positions)[inside]]
+        message[positions == row_lengths] = 0x80
+        last = blocks[:active] == block + 1
+        message[last, 56:] = bit_lengths[:active][last]
+        words = message.view('<u4')
+
+        a, b, c, d = (value[:active].copy() for value in state)
+        with np.errstate(over='ignore'):
+            for step in range(64):
+                if step < 16:
+                    f = (b & c) | (~b & d)
+                elif step < 32:
+                    f = (d & b) | (~d & c)
+                elif step < 48:
+                    f = b ^ c ^ d
+                else:
+                    f = c ^ (b | ~d)
+                f = f + a + MD5_K[step] + words[:, MD5_WORDS[step]]
+                a, d, c = d, c, b
+                b = b + rotate_left(f, MD5_SHIFTS[step])
+            for value, added in zip(state, (a, b, c, d)):
+                value[:active] += added
+    # The first 8 hex digits read the digest's first, little-endian word as big-endian
+    return state[0].byteswap()
+
+
+ROW_HASHES = {'crc32': crc32_hashes, 'md5': md5_hashes}
+
+
+def column_text(series):
+    """
+    Render a column the way the database casts it to text, as an Arrow string array.
+
+    Integer columns that came back as floats (because of NULLs in a JSON export)
+    are rendered without the trailing ``.0``. Booleans, floats and decimals of
+    unknown scale rarely render identically on both sides; leave them out of the
+    checksum columns.
+    """
+    if pd.api.types.is_float_dtype(series) and (series.dropna() % 1 == 0).all():
+        series = series.astype('Int64')
+    if pd.api.types.is_integer_dtype(series) or pd.api.types.is_string_dtype(series):
+        try:
+            # Numbers and strings cast in Arrow without a Python call per value
+            text = pc.cast(pa.array(series, from_pandas=True), pa.large_string())
+            return pc.fill_null(text, pa.scalar(NULL_TEXT, pa.large_string()))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Object columns mixing strings with other values render through str() below
+            pass
+    return pa.array(series.astype(str).where(series.notna(), NULL_TEXT), type=pa.large_string())
+
+
+def row_hashes(frame, columns, row_hash='crc32'):
+    """
+    32-bit hash per row of ``columns``, as computed by the connector's ``add_checksum``.
+
+    The rows are joined into one Arrow string array and hashed from its UTF-8
+    buffer in chunks, without a Python call per row.
+    """
+    texts = [column_text(frame[column]) for column in columns]
+    joined = (pc.binary_join_element_wise(*texts, pa.scalar(SEPARATOR, pa.large_string()))
+              if len(texts) > 1 else texts[0])
+    joined = joined.combine_chunks() if isinstance(joined, pa.ChunkedArray) else joined
+    _, offsets_buffer, data_buffer = joined.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[joined.offset:joined.offset + len(joined) + 1]
+    data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.zeros(0, dtype=np.uint8)
+
+    hash_func = ROW_HASHES[row_hash]
+    hashes = np.empty(len(joined), dtype=np.int64)
+    for chunk in range(0, len(joined), HASH_CHUNK_ROWS):
+        starts = offsets[chunk:chunk + HASH_CHUNK_ROWS + 1]
+        lengths = np.diff(starts)
+        order = np.argsort(-lengths, kind='stable')
+        hashes[chunk + order] = hash_func(data, starts[:-1][order], lengths[order])
+    return pd.Series(hashes, index=frame.index, dtype='int64')
+
+
+def bucket_checksums(frame, key_column, columns, lower, width, row_hash='crc32'):
+    """
+    Export-side equivalent of ``fetch_bucket_checksums`` for one frame.
+
+    :return: ``{bucket: (rows, checksum)}``; rows with a NULL key are skipped.
+    """
+    frame = frame[frame[key_column].notna()]
+    if not len(frame):
+        return {}
+    buckets = ((frame[key_column].astype('int64') - lower) // width).values
+    grouped = pd.DataFrame({'bucket': buckets, 'hash': row_hashes(frame, columns, row_hash).values}) \
+        .groupby('bucket')['hash'].agg(['count', 'sum'])
+    return {int(bucket): (int(rows), int(checksum)) for bucket, rows, checksum in grouped.itertuples()}
+
+
+def merge_checksums(total, checksums):
+    """Add ``checksums`` into ``total`` in place; bucket sums are order independent."""
+    for bucket, (rows, checksum) in checksums.items():
+        total_rows, total_checksum = total.get(bucket, (0, 0))
+        total[bucket] = (total_rows + rows, total_checksum + checksum)
+    return total
+
+
+def export_checksums(frames, key_column, columns, lower, width, row_hash='crc32'):
+    """
+    Fine-level bucket checksums of an export, streamed e.g. from ``JsonToGDFLoader.iter_frames``.
+
+    This reads the whole export; exports written with a ``checksum`` writer option
+    carry the same aggregates in their manifest, see ``manifest_checksums``.
+    """
+    total = {}
+    for frame in frames:
+        frame = frame.to_pandas() if hasattr(frame, 'to_pandas') else frame
+        merge_checksums(total, bucket_checksums(frame, key_column, columns, lower, width, row_hash))
+    return total
+
+
+def checksum_spec(checksum, row_hash='crc32'):
+    """
+    Normalize a ``checksum`` writer option: ``{'key_column', 'columns', 'width'}`` plus
+    optional ``lower`` (default 0) and ``row_hash``, which must be the source
+    connector's ``checksum_hash``.
+    """
+    return {
+        'key_column': checksum['key_column'],
+        'columns': list(checksum['columns']),
+        'lower': checksum.get('lower', 0),
+        'width': checksum['width'],
+        'row_hash': checksum.get('row_hash', row_hash),
+    }
+
+
+def checksums_to_json(checksums):
+    """``{bucket: (rows, checksum)}`` as JSON, whose object keys are strings."""
+    return {str(bucket): [rows, checksum] for bucket, (rows, checksum) in sorted(checksums.items())}
+
+
+def checksums_from_json(buckets):
+    return {int(bucket): (int(rows), int(checksum)) for bucket, (rows, checksum) in buckets.items()}
+
+
+def part_checksums(frame, spec):
+    """Bucket checksums of one part, computed from the frame it was serialized from."""
+    return checksums_to_json(bucket_checksums(frame, spec['key_column'], spec['columns'], spec['lower'],
+                                              spec['width'], spec['row_hash']))
+
+
+def merge_part_checksums(spec, parts, checksums=None):
+    """
+    The manifest's ``checksums`` entry: ``spec`` plus the buckets of ``parts`` summed into ``checksums``.
+
+    Returns None when a part has no checksums, e.g. a COPY export or one uploaded by an
+    attempt that ran without the option, since the buckets would silently miss its rows.
+    """
+    total = checksums_from_json(checksums['buckets']) if checksums else {}
+    for part in filter(None, parts):
+        if part.get('checksums') is None:
+            return None
+        merge_checksums(total, checksums_from_json(part['checksums']))
+    return dict(spec, buckets=checksums_to_json(total))
+
+
+def manifest_checksums(manifest):
+    """
+    The export-side fine-level checksums recorded in a manifest: ``(spec, checksums)``.
+
+    :raises ValueError: When the export was written without the ``checksum`` writer option.
+    """
+    checksums = manifest.get('checksums')
+    if not checksums:
+        raise ValueError(f"The manifest of {manifest['prefix']} has no bucket checksums; "
+                         f"extract with the 'checksum' writer option or use export_checksums")
+    spec = {name: value for name, value in checksums.items() if name != 'buckets'}
+    return spec, checksums_from_json(checksums['buckets'])
+
+
+def verify_manifest(connector, manifest, query=None, fanout=16):
+    """
+    ``find_differing_ranges`` of the source against the checksums recorded in an export's manifest.
+
+    Nothing is read from the export itself, so an unchanged table costs one query.
+
+    :param query: The source query, defaults to the one the manifest was extracted with.
+    """
+    spec, checksums = manifest_checksums(manifest)
+    if spec['row_hash'] != connector.checksum_hash:
+        raise ValueError(f"The export was hashed with {spec['row_hash']}, "
+                         f"the connector hashes with {connector.checksum_hash}")
+    return find_differing_ranges(connector, query or manifest['query'], spec['key_column'], spec['columns'],
+                                 checksums, spec['lower'], spec['width'], fanout)
+
+
+def coarsen(checksums, factor):
+    """Derive the level above: bucket ``b`` of width ``w`` falls in bucket ``b // factor`` of width ``w * factor``."""
+    coarse = {}
+    for bucket, value in checksums.items():
+        merge_checksums(coarse, {bucket // factor: value})
+    return coarse
+
+
+def find_differing_ranges(connector, query, key_column, columns, checksums, lower, width, fanout=16):
+    """
+    Locate the key ranges where the source no longer matches an export, Merkle-style.
+
+    Starting from a coarse level that needs a handful of buckets, the database
+    aggregates its row hashes per bucket and only buckets whose ``(rows, checksum)``
+    differ from the export's are subdivided by ``fanout`` and queried again, down
+    to the fine ``width`` the export checksums were computed at. An unchanged table
+    costs one query.
+
+    :param connector: An open MysqlConnector or RedshiftConnector.
+    :param checksums: Fine-level export checksums, e.g. from ``export_checksums``
+        with the same ``lower``, ``width`` and the connector's ``checksum_hash``.
+    :param lower: First key of bucket 0; must not exceed the smallest key on either side.
+    :return: Sorted, merged ``(start, end)`` half-open key ranges that differ.
+    """
+    _, source_max = connector.fetch_min_max(query, key_column)
+    top_bucket = max(list(checksums) + ([(source_max - lower) // width] if source_max is not None else [0]))
+    level = 0
+    while top_bucket // fanout ** level >= fanout:
+        level += 1
+
+    levels = {0: checksums}
+    for idx in range(1, level + 1):
+        levels[idx] = coarsen(levels[idx - 1], fanout)
+
+    ranges = []
+    pending = [(level, None)]
+    while pending:
+        level, key_range = pending.pop()
+        level_width = width * fanout ** level
+        source = connector.fetch_bucket_checksums(query, key_column, columns, lower, level_width, key_range)
+        expected = levels[level]
+        if key_range is not None:
+            first, last = (key_range[0] - lower) // level_width, (key_range[1] - lower) // level_width
+            expected = {bucket: value for bucket, value in expected.items() if first <= bucket < last}
+        for bucket in set(source) | set(expected):
+            if source.get(bucket) == expected.get(bucket):
+                continue
+            start = lower + bucket * level_width
+            if level == 0:
+                ranges.append((start, start + level_width))
+            else:
+                pending.append((level - 1, (start, start + level_width)))
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def ranges_to_partitions(ranges):
+    """Turn differing key ranges into partitions for ``fetch_range`` or the partitioned pipeline."""
+    return [make_partition(f'diff_{idx}', start, end) for idx, (start, end) in enumerate(ranges)]
+
+
+def extract_differing_rows(connector, query, key_column, ranges):
+    """Fetch only the source rows in the differing ranges: ``(records, headers)``."""
+    records, headers = [], None
+    for partition in ranges_to_partitions(ranges):
+        partition_records, headers = connector.fetch_range(query, key_column, partition)
+        records.extend(partition_records)
+    return records, headers
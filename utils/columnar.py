@@ -0,0 +1,40 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+def records_to_record_batch(records, fields):
+    """
+    Build a ``pyarrow.RecordBatch`` straight from driver rows.
+
+    :param records: Rows as returned by the driver (tuples or asyncpg Records).
+    :param fields: ``(name, arrow_type)`` pairs; a None type lets Arrow infer it
+        from the values, which is what we want for decimals of unknown scale.
+    :return: A RecordBatch with one array per column.
+    """
+    names = [name for name, _ in fields]
+    if not records:
+        return pa.RecordBatch.from_arrays(
+            [pa.array([], type=arrow_type or pa.null()) for _, arrow_type in fields], names=names)
+    # zip(*) transposes in C, so no per-row Python tuple is built
+    columns = zip(*records)
+    arrays = [pa.array(column, type=arrow_type) for column, (_, arrow_type) in zip(columns, fields)]
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def to_arrow_table(batch, headers):
+    """Wrap a RecordBatch, or rows plus headers, as a ``pyarrow.Table``."""
+    if isinstance(batch, pa.RecordBatch):
+        return pa.Table.from_batches([batch])
+    return pa.Table.from_batches([records_to_record_batch(batch, [(name, None) for name in headers])])
+
+
+def write_parquet(batch, headers, where, row_group_size=None, compression='snappy'):
+    """
+    Write a batch as Parquet, keeping the Arrow schema derived from the source column types.
+
+    :param where: A path or writable binary file-like object.
+    :param row_group_size: Maximum rows per row group, None for pyarrow's default.
+    :param compression: Parquet codec, e.g. ``snappy`` or ``zstd``.
+    """
+    pq.write_table(to_arrow_table(batch, headers), where,
+                   row_group_size=row_group_size, compression=compression)
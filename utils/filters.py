@@ -0,0 +1,112 @@
+import operator
+
+# Filters use pyarrow's format: a list of ``(column, op, value)`` tuples that
+# must all hold, or a list of such lists of which any one must hold.
+COMPARISONS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def normalize_filters(filters):
+    """Return ``filters`` as a list of conjunctions (disjunctive normal form)."""
+    if not filters:
+        return []
+    if isinstance(filters[0], (list, tuple)) and filters[0] and isinstance(filters[0][0], (list, tuple)):
+        return [list(conjunction) for conjunction in filters]
+    return [list(filters)]
+
+
+def filter_columns(filters):
+    """Columns referenced by ``filters``, in first-use order."""
+    columns = []
+    for conjunction in normalize_filters(filters):
+        for column, _, _ in conjunction:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def read_columns(columns, filters):
+    """Columns a reader must load to project ``columns`` and still evaluate ``filters``."""
+    if not columns:
+        return None
+    return list(columns) + [column for column in filter_columns(filters) if column not in columns]
+
+
+def filter_mask(frame, column, op, value):
+    if op == 'in':
+        return frame[column].isin(list(value))
+    if op == 'not in':
+        return ~frame[column].isin(list(value))
+    if op not in COMPARISONS:
+        raise ValueError(f"Unsupported filter operator: {op}")
+    return COMPARISONS[op](frame[column], value)
+
+
+def apply_filters(frame, filters, columns=None):
+    """
+    Keep the rows of a pandas or cuDF DataFrame matching ``filters``, then
+    drop any column that was only loaded to evaluate them.
+    """
+    conjunctions = normalize_filters(filters)
+    if conjunctions:
+        mask = None
+        for conjunction in conjunctions:
+            conjunction_mask = None
+            for column, op, value in conjunction:
+                condition = filter_mask(frame, column, op, value)
+                conjunction_mask = condition if conjunction_mask is None else conjunction_mask & condition
+            mask = conjunction_mask if mask is None else mask | conjunction_mask
+        frame = frame[mask]
+    if columns:
+        frame = frame[list(columns)]
+    return frame
+
+
+def range_may_match(lower, upper, op, value):
+    if op in ('=', '=='):
+        return lower <= value <= upper
+    if op == '<':
+        return lower < value
+    if op == '<=':
+        return lower <= value
+    if op == '>':
+        return upper > value
+    if op == '>=':
+        return upper >= value
+    if op == 'in':
+        return any(lower <= item <= upper for item in value)
+    # '!=' and 'not in' only rule out a part whose values are all excluded; not worth the check
+    return True
+
+
+def stats_may_match(stats, filters):
+    """
+    Whether a part whose column ``stats`` (``{column: {'min': ..., 'max': ...}}``)
+    could hold rows matching ``filters``. Missing or incomparable stats never prune.
+    """
+    conjunctions = normalize_filters(filters)
+    if not stats or not conjunctions:
+        return True
+    for conjunction in conjunctions:
+        possible = True
+        for column, op, value in conjunction:
+            column_stats = stats.get(column) or {}
+            lower, upper = column_stats.get('min'), column_stats.get('max')
+            if lower is None or upper is None:
+                continue
+            try:
+                if not range_may_match(lower, upper, op, value):
+                    possible = False
+                    break
+            except TypeError:
+                continue
+        if possible:
+            return True
+    return False
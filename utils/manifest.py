@@ -0,0 +1,132 @@
+import json
+import posixpath
+
+from botocore.exceptions import ClientError
+from datetime import datetime, timezone
+
+from utils.checksum import merge_part_checksums
+from utils.prefetch import part_sort_key
+from utils.profiling import merge_profiles, profile_from_json, profile_to_json
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def manifest_key(s3_key_prefix):
+    """The manifest sits next to the parts: ``data_testing/<run>/<run>`` -> ``data_testing/<run>/manifest.json``."""
+    return posixpath.join(posixpath.dirname(s3_key_prefix.rstrip('/')), MANIFEST_NAME)
+
+
+def is_manifest_key(key):
+    return posixpath.basename(key) == MANIFEST_NAME
+
+
+def list_data_parts(s3utils, folder_url):
+    """List the objects of an export folder, leaving out its manifest."""
+    return [obj for obj in s3utils.list_objects(folder_url) if not is_manifest_key(obj['key'])]
+
+
+def part_key_range(part, key_column):
+    """``{'min', 'max'}`` of the key column in a part, taken from its profile."""
+    stats = (part.get('stats') or {}).get(key_column) if key_column else None
+    if not stats:
+        return None
+    return {'min': stats['min'], 'max': stats['max']}
+
+
+def build_manifest(parts, s3_key_prefix, query=None, key_column=None, checksum=None):
+    """
+    Merge per-part entries from the extraction into one manifest.
+
+    :param parts: Dicts with ``key``, ``rows``, ``bytes``, ``md5`` and ``stats`` (a
+        profile from ``utils.profiling.profile_frame``), as returned by ``upload_batch``.
+    :param key_column: The key or split column; each part records its bounds on it
+        as ``key_range`` so readers can prune parts by key.
+    :param checksum: The normalized ``checksum`` writer option the parts were written
+        with; their bucket checksums are summed into ``checksums`` for
+        ``utils.checksum.verify_manifest``.
+    :return: A JSON-serializable dict with export totals, column profiles including
+        distinct estimates, and the parts with their checksums and min/max stats.
+    """
+    parts = sorted((part for part in parts if part), key=lambda part: part_sort_key(part['key']))
+    columns = {}
+    for part in parts:
+        if part.get('stats'):
+            merge_profiles(columns, part['stats'])
+    return {
+        'version': MANIFEST_VERSION,
+        'prefix': s3_key_prefix,
+        'query': query,
+        'key_column': key_column,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'rows': sum(part.get('rows') or 0 for part in parts),
+        'bytes': sum(part.get('bytes') or 0 for part in parts),
+        'columns': profile_to_json(columns),
+        'checksums': merge_part_checksums(checksum, parts) if checksum else None,
+        # Part sketches and bucket checksums would dominate the manifest; the merged ones above are kept instead
+        'parts': [
+            dict({name: value for name, value in part.items() if name != 'checksums'},
+                 key_range=part_key_range(part, key_column),
+                 stats=profile_to_json(part['stats'], keep_sketch=False) if part.get('stats') else None)
+            for part in parts
+        ],
+    }
+
+
+def append_manifest(manifest, parts):
+    """
+    Fold the part entries of an incremental run into an existing manifest.
+
+    Column profiles merge through their sketches, so totals and distinct estimates
+    cover the whole export. Rows re-read in an overlap window count once per part;
+    the caller records them per window, see ``DataFetchingPipeline.write_manifest``.
+    Bucket checksums are summed the same way, so buckets holding re-exported rows
+    will not match the source.
+    """
+    increment = build_manifest(parts, manifest['prefix'], manifest.get('query'), manifest.get('key_column'))
+    columns = merge_profiles(profile_from_json(manifest['columns']), profile_from_json(increment['columns']))
+    checksums = manifest.get('checksums')
+    if checksums:
+        spec = {name: value for name, value in checksums.items() if name != 'buckets'}
+        checksums = merge_part_checksums(spec, parts, checksums)
+    return dict(manifest,
+                updated_at=increment['created_at'],
+                rows=manifest['rows'] + increment['rows'],
+                bytes=manifest['bytes'] + increment['bytes'],
+                columns=profile_to_json(columns),
+                checksums=checksums,
+                parts=sorted(manifest['parts'] + increment['parts'], key=lambda part: part_sort_key(part['key'])))
+
+
+def write_manifest(s3utils, manifest):
+    key = manifest_key(manifest['prefix'])
+    _, _, uploaded = s3utils.upload_file(key, json.dumps(manifest, default=str).encode('utf-8'))
+    if not uploaded:
+        # A run whose manifest is missing or stale must not be reported, journaled or watermarked as done
+        raise RuntimeError(f"Upload of manifest {key} failed")
+    return key
+
+
+def read_manifest(s3utils, folder_url):
+    """Read the manifest of an export, given its folder (e.g. ``data_testing/<run>``) or the manifest key."""
+    key = folder_url if folder_url.endswith(MANIFEST_NAME) else posixpath.join(folder_url.rstrip('/'), MANIFEST_NAME)
+    return json.loads(s3utils.download_object(key))
+
+
+def find_manifest(s3utils, folder_url):
+    """
+    Read the manifest of an export, or None for exports written without one.
+
+    Only a missing manifest returns None; a corrupt or unreadable one raises.
+    """
+    try:
+        return read_manifest(s3utils, folder_url)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def manifest_parts(manifest):
+    """A manifest's parts as object dicts for the downloaders; ``size`` drives range GETs and prefetch budgets."""
+    return [dict(part, size=part.get('bytes')) for part in manifest['parts']]
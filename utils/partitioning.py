@@ -0,0 +1,95 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+
+def interpolate(lower, upper, fraction):
+    """Return the value ``fraction`` of the way from ``lower`` to ``upper``.
+
+    Works for the split column types we extract on: integers, floats,
+    decimals, dates and timestamps.
+    """
+    if isinstance(lower, bool):
+        raise TypeError("Cannot range-partition on a boolean column")
+    if isinstance(lower, int):
+        return lower + int((upper - lower) * fraction)
+    if isinstance(lower, Decimal):
+        return lower + (upper - lower) * Decimal(str(fraction))
+    if isinstance(lower, (datetime, date, float)):
+        return lower + (upper - lower) * fraction
+    raise TypeError(f"Unsupported split column type: {type(lower).__name__}")
+
+
+def make_partition(partition_id, lower, upper, upper_inclusive=False):
+    """A partition covers ``lower <= col < upper`` (``<= upper`` when inclusive)."""
+    return {
+        'partition_id': str(partition_id),
+        'lower': lower,
+        'upper': upper,
+        'upper_inclusive': upper_inclusive,
+        'is_null': False,
+    }
+
+
+def null_partition():
+    """Rows whose split column is NULL never fall in a range, so they get their own partition."""
+    return {'partition_id': 'null', 'lower': None, 'upper': None, 'upper_inclusive': False, 'is_null': True}
+
+
+def partitions_from_boundaries(boundaries):
+    """Turn sorted boundaries ``[b0, b1, ..., bn]`` into disjoint half-open partitions."""
+    boundaries = sorted(set(boundaries))
+    if len(boundaries) == 1:
+        return [make_partition(0, boundaries[0], boundaries[0], upper_inclusive=True)]
+    last = len(boundaries) - 2
+    return [
+        make_partition(idx, boundaries[idx], boundaries[idx + 1], upper_inclusive=idx == last)
+        for idx in range(len(boundaries) - 1)
+    ]
+
+
+def plan_partitions(connector, query, split_column, partitions, use_quantiles=False):
+    """
+    Plan independent range partitions of ``query`` on ``split_column``.
+
+    :param connector: An open MysqlConnector or RedshiftConnector.
+    :param query: The base query to extract.
+    :param split_column: A numeric or timestamp column, ideally indexed.
+    :param partitions: Number of partitions to aim for.
+    :param use_quantiles: Read NTILE boundaries instead of splitting MIN..MAX evenly,
+        which keeps partitions balanced on skewed keys at the cost of one sort.
+    :return: A list of partition dicts, including a trailing NULL partition.
+    """
+    lower, upper = connector.fetch_min_max(query, split_column)
+    if lower is None:
+        return [null_partition()]
+
+    if use_quantiles:
+        boundaries = [lower] + connector.fetch_quantile_boundaries(query, split_column, partitions)
+    else:
+        boundaries = [interpolate(lower, upper, idx / partitions) for idx in range(partitions)] + [upper]
+
+    return partitions_from_boundaries(boundaries) + [null_partition()]
+
+
+def split_partition(partition, parts=2):
+    """
+    Split a partition that turned out too large into ``parts`` sub-ranges.
+
+    :return: The child partitions, or None if the range cannot be narrowed further.
+    """
+    if partition['is_null']:
+        return None
+    lower, upper = partition['lower'], partition['upper']
+    boundaries = sorted({lower, upper} | {interpolate(lower, upper, idx / parts) for idx in range(1, parts)})
+    if len(boundaries) <= 2:
+        return None
+    children = []
+    for idx in range(len(boundaries) - 1):
+        is_last = idx == len(boundaries) - 2
+        children.append(make_partition(
+            f"{partition['partition_id']}_{idx}",
+            boundaries[idx],
+            boundaries[idx + 1],
+            upper_inclusive=partition['upper_inclusive'] and is_last,
+        ))
+    return children
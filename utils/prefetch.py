@@ -0,0 +1,60 @@
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Parts appended by the n-th incremental run of an export: ``<prefix>_inc_<n>_part_<i>``
+INCREMENT_PART = re.compile(r'_inc_(\d+)_part_\d+')
+
+
+def natural_sort_key(key):
+    """Sort key that orders ``x_part_2`` before ``x_part_10``."""
+    return [int(token) if token.isdigit() else token for token in re.split(r'(\d+)', key)]
+
+
+def part_sort_key(key):
+    """
+    Natural order, with the parts of each incremental run after those of the runs
+    before it, so rows re-exported by a later window come after the ones they replace.
+    """
+    match = INCREMENT_PART.search(key)
+    return int(match.group(1)) if match else 0, natural_sort_key(key)
+
+
+def prefetch_parts(parts, download, prefetch_depth=4, memory_budget=None, max_workers=4):
+    """
+    Download parts ahead of the consumer and yield them in part order.
+
+    Up to ``prefetch_depth`` downloads are in flight or waiting to be
+    consumed, and their combined listed sizes stay within ``memory_budget``
+    bytes (one part is always allowed, however large). A part's bytes are
+    released as soon as the consumer moves on to the next one.
+
+    :param parts: Object dicts from ``S3Utils.list_objects`` (``key`` and ``size``).
+    :param download: Called with a part dict, returns its content.
+    :return: A generator of ``(part, content)`` tuples in ``part_sort_key`` order.
+    """
+    parts = sorted(parts, key=lambda part: part_sort_key(part['key']))
+    pending = deque()
+    pending_bytes = 0
+    next_idx = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while next_idx < len(parts) or pending:
+                while next_idx < len(parts) and len(pending) < prefetch_depth:
+                    size = parts[next_idx].get('size') or 0
+                    if pending and memory_budget and pending_bytes + size > memory_budget:
+                        break
+                    pending.append((parts[next_idx], size, executor.submit(download, parts[next_idx])))
+                    pending_bytes += size
+                    next_idx += 1
+
+                part, size, future = pending.popleft()
+                content = future.result()
+                pending_bytes -= size
+                yield part, content
+                del content
+        finally:
+            # Stop queued downloads if the consumer fails or stops early
+            for _, _, future in pending:
+                future.cancel()
@@ -0,0 +1,128 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+ROW_HASH = '__row_hash__'
+# Below this many rows the cost of shipping partitions to worker processes outweighs the gain
+PARALLEL_MIN_ROWS = 200000
+
+
+def to_pandas(frame):
+    """Reconciliation runs on pandas; cuDF frames are copied to host first."""
+    return frame.to_pandas() if hasattr(frame, 'to_pandas') else frame
+
+
+def align_dtypes(source, target, columns):
+    """
+    Cast ``target`` columns to the ``source`` dtypes so equal values hash equally,
+    e.g. an int column that came back as float from a JSON export. Columns that
+    cannot be cast are compared as strings on both sides.
+    """
+    source, target = source.copy(deep=False), target.copy(deep=False)
+    for column in columns:
+        if source[column].dtype == target[column].dtype:
+            continue
+        try:
+            target[column] = target[column].astype(source[column].dtype)
+        except (TypeError, ValueError):
+            source[column] = source[column].astype(str)
+            target[column] = target[column].astype(str)
+    return source, target
+
+
+def hash_rows(frame, key_columns, columns):
+    """Keys plus one vectorized 64-bit hash over ``columns`` per row."""
+    hashed = frame[key_columns].copy()
+    hashed[ROW_HASH] = pd.util.hash_pandas_object(frame[columns], index=False).values
+    return hashed
+
+
+def differing_columns(merged, columns):
+    """For rows present on both sides, the names of the columns whose values differ."""
+    left = merged[[f'{column}_source' for column in columns]].to_numpy()
+    right = merged[[f'{column}_target' for column in columns]].to_numpy()
+    differs = ~((left == right) | (pd.isna(left) & pd.isna(right)))
+    names = np.array(columns, dtype=object)
+    return [list(names[row]) for row in differs]
+
+
+def reconcile_partition(source, target, key_columns, columns):
+    """Compare one hash partition of both sides; see ``reconcile``."""
+    source_hashes = hash_rows(source, key_columns, columns)
+    target_hashes = hash_rows(target, key_columns, columns)
+    merged = source_hashes.merge(target_hashes, on=key_columns, how='outer',
+                                 suffixes=('_source', '_target'), indicator=True)
+
+    missing = merged.loc[merged['_merge'] == 'left_only', key_columns]
+    extra = merged.loc[merged['_merge'] == 'right_only', key_columns]
+    both = merged[merged['_merge'] == 'both']
+    changed_keys = both.loc[both[f'{ROW_HASH}_source'] != both[f'{ROW_HASH}_target'], key_columns]
+
+    # Only rows whose hashes differ are compared value by value
+    changed = changed_keys.merge(source[key_columns + columns], on=key_columns) \
+        .merge(target[key_columns + columns], on=key_columns, suffixes=('_source', '_target'))
+    changed_columns = differing_columns(changed, columns) if len(changed) else []
+    changed = changed[key_columns].copy()
+    changed['columns'] = changed_columns
+    return missing, extra, changed
+
+
+def partition_by_key(frame, key_columns, partitions):
+    """Split ``frame`` into ``partitions`` frames by a hash of its keys; equal keys land together."""
+    bucket = pd.util.hash_pandas_object(frame[key_columns], index=False).values % partitions
+    return [frame[bucket == idx] for idx in range(partitions)]
+
+
+def reconcile(source, target, key_columns, columns=None, workers=None, align=True):
+    """
+    Compare a source frame with what landed in the export.
+
+    Rows are matched on ``key_columns`` and compared through one vectorized hash
+    over ``columns``, so only rows whose hashes differ are compared column by
+    column. Large inputs are hash-partitioned on the key and reconciled across
+    ``workers`` processes.
+
+    :param source: pandas (or cuDF) DataFrame read from the database.
+    :param target: pandas (or cuDF) DataFrame loaded from the export.
+    :param key_columns: Columns that identify a row; must be unique on each side.
+    :param columns: Columns to compare, by default every non-key column the sides share.
+    :param workers: Processes to use, by default one per core.
+    :param align: Cast target columns to the source dtypes before hashing.
+    :return: A dict with ``missing`` (keys only in source), ``extra`` (keys only in
+        target), ``changed`` (keys plus a ``columns`` list of differing columns)
+        and their ``counts``.
+    """
+    source, target = to_pandas(source), to_pandas(target)
+    key_columns = list(key_columns)
+    if columns is None:
+        columns = [column for column in source.columns if column in target.columns and column not in key_columns]
+    columns = list(columns)
+    if align:
+        source, target = align_dtypes(source, target, key_columns + columns)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or max(len(source), len(target)) < PARALLEL_MIN_ROWS:
+        results = [reconcile_partition(source, target, key_columns, columns)]
+    else:
+        source_parts = partition_by_key(source, key_columns, workers)
+        target_parts = partition_by_key(target, key_columns, workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(reconcile_partition, source_parts, target_parts,
+                                        repeat(key_columns), repeat(columns)))
+
+    missing, extra, changed = (pd.concat(frames, ignore_index=True) for frames in zip(*results))
+    return {
+        'missing': missing,
+        'extra': extra,
+        'changed': changed,
+        'counts': {
+            'source_rows': len(source),
+            'target_rows': len(target),
+            'missing': len(missing),
+            'extra': len(extra),
+            'changed': len(changed),
+        },
+    }
@@ -1,11 +1,17 @@
 import os
 from dotenv import load_dotenv
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ConnectTimeoutError, ClientError
 import traceback
 import requests
 from urllib.parse import urlparse, unquote
 import tempfile
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.buffer_pool import MemoryViewReader, buffer_body
 
 load_dotenv()
 
@@ -19,10 +25,150 @@ class BUCKET_CONFIGS:
                                   "APIRecordCollector_Bucket_Role_Session")
 ENV = os.environ.get("ENV", "LOCAL")
 
+# S3 rejects multipart parts smaller than 5 MiB, except for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+# Objects larger than this are downloaded as concurrent byte-range GETs
+RANGE_SIZE = 8 * 1024 * 1024
+
+
+class MultipartUploadWriter:
+    """Write-only file object that streams into an S3 multipart upload.
+
+    Parts are uploaded by a bounded thread pool as soon as they fill, so
+    serialization and upload overlap and the object size is not capped by
+    memory or the 5 GB single PUT limit. At most ``max_workers * 2`` parts
+    are held in memory; ``write`` blocks when that many are in flight.
+    Leaving the ``with`` block on an exception aborts the upload.
+    """
+
+    def __init__(self, bucket_resource, key_name: str, part_size=8 * 1024 * 1024, max_workers=4):
+        self.bucket_resource = bucket_resource
+        self.key_name = key_name
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.slots = threading.BoundedSemaphore(max_workers * 2)
+        self.buffer = bytearray()
+        self.futures = []
+        self.position = 0
+        self.part_stats = []
+        # MD5 of the whole object, for the export manifest; S3's multipart ETag is not one
+        self.digest = hashlib.md5()
+        self.closed = False
+        self.st_time = time.time()
+        self.upload_id = bucket_resource.create_multipart_upload(
+            Bucket=BUCKET_CONFIGS.BUCKET_NAME, Key=key_name)['UploadId']
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.digest.update(data)
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self.__submit_part__(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def __submit_part__(self, body):
+        # Fail fast instead of producing more parts for an upload that is already broken
+        for future in self.futures:
+            if future.done() and future.exception():
+                raise future.exception()
+        self.slots.acquire()
+        part_number = len(self.futures) + 1
+        future = self.executor.submit(self.__upload_part__, part_number, body)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def __upload_part__(self, part_number, body):
+        st_time = time.time()
+        response = self.bucket_resource.upload_part(
+            Body=body,
+            Bucket=BUCKET_CONFIGS.BUCKET_NAME,
+            Key=self.key_name,
+            PartNumber=part_number,
+            UploadId=self.upload_id)
+        duration = time.time() - st_time
+        self.part_stats.append({
+            'part_number': part_number,
+            'bytes': len(body),
+            'seconds': duration,
+            'mb_per_second': len(body) / (1024 * 1024) / duration if duration else None,
+        })
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self):
+        """Upload the remaining bytes and complete the upload; returns a summary with per-part throughput."""
+        if self.closed:
+            return self.summary()
+        try:
+            # An empty object still needs one (empty) part
+            if self.buffer or not self.futures:
+                self.__submit_part__(bytes(self.buffer))
+                self.buffer = bytearray()
+            parts = [future.result() for future in self.futures]
+            self.bucket_resource.complete_multipart_upload(
+                Bucket=BUCKET_CONFIGS.BUCKET_NAME,
+                Key=self.key_name,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts})
+        except BaseException as e:
+            # A failed part must not leave an incomplete upload behind, billed until it expires
+            print(f'ABORTING MULTIPART UPLOAD OF {self.key_name}: {e}')
+            self.abort()
+            raise
+        self.executor.shutdown()
+        self.closed = True
+        return self.summary()
+
+    def abort(self):
+        self.executor.shutdown(cancel_futures=True)
+        self.closed = True
+        try:
+            self.bucket_resource.abort_multipart_upload(
+                Bucket=BUCKET_CONFIGS.BUCKET_NAME, Key=self.key_name, UploadId=self.upload_id)
+        except Exception as e:
+            print(f'EXCEPTION WHILE ABORTING MULTIPART UPLOAD OF {self.key_name}: {e}')
+
+    def summary(self):
+        duration = time.time() - self.st_time
+        return {
+            'key': self.key_name,
+            'bytes': self.position,
+            'md5': self.digest.hexdigest(),
+            'seconds': duration,
+            'parts': sorted(self.part_stats, key=lambda stat: stat['part_number']),
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            print(f'ABORTING MULTIPART UPLOAD OF {self.key_name}: {exc}')
+            self.abort()
+            return False
+        self.close()
+        return False
+
 
 class S3Utils:
-    def __init__(self):
-        """Interface to Store and Download reports from bucket"""
+    def __init__(self, max_pool_connections=50):
+        """Interface to Store and Download reports from bucket
+
+        The client keeps up to ``max_pool_connections`` HTTP connections alive,
+        so concurrent range downloads and uploads reuse them instead of
+        opening a new connection per request.
+        """
+        self.client_config = Config(max_pool_connections=max_pool_connections,
+                                    retries={'max_attempts': 5, 'mode': 'standard'})
         self.__get_bucket_resource__(BUCKET_CONFIGS.BUCKET_REGION,
                                      BUCKET_CONFIGS.ROLE_SESSION)
 
@@ -50,17 +196,16 @@ class S3Utils:
                 aws_access_key_id=self.creds.get("AccessKeyId"),
                 aws_secret_access_key=self.creds.get("SecretAccessKey"),
                 aws_session_token=self.creds.get("SessionToken"),
-                region_name=bucket_location)
+                region_name=bucket_location,
+                config=self.client_config)
             # self.bucket = self.bucket_resource.Bucket(bucket_name)
 
         else:
-            self.bucket_resource = boto3.client("s3")
+            self.bucket_resource = boto3.client("s3", config=self.client_config)
             
     def list_files(self, prefix):
         try:
-            response = self.bucket_resource.list_objects_v2(Bucket=BUCKET_CONFIGS.BUCKET_NAME, Prefix=prefix)
-            files = response.get('Contents', [])
-            return [self.__generate_presigned_url__(file['Key']) for file in files]
+            return [self.__generate_presigned_url__(obj['key']) for obj in self.list_objects(prefix)]
         except ClientError as cerr:
             print(f'CLIENT ERROR WHEN UPLOADING FILE: {cerr}')
             try:
@@ -78,6 +223,103 @@ class S3Utils:
             print(f'TRACEBACK: {traceback.format_exc()}')
             return False, False, None
 
+    def __list_prefix__(self, prefix: str, delimiter=None):
+        """Follows continuation tokens; returns the objects and, with a delimiter, the sub-prefixes"""
+        objects, sub_prefixes = [], []
+        paginator = self.bucket_resource.get_paginator('list_objects_v2')
+        params = {'Bucket': BUCKET_CONFIGS.BUCKET_NAME, 'Prefix': prefix}
+        if delimiter:
+            params['Delimiter'] = delimiter
+        for page in paginator.paginate(**params):
+            for obj in page.get('Contents', []):
+                objects.append({'key': obj['Key'], 'size': obj['Size'], 'etag': obj['ETag'].strip('"')})
+            sub_prefixes.extend(common['Prefix'] for common in page.get('CommonPrefixes', []))
+        return objects, sub_prefixes
+
+    def list_objects(self, prefix: str, shards=None, max_workers=8):
+        """Lists every object under a prefix, without presigning
+
+        Args:
+            prefix (str): Key prefix to list
+            shards (list): Optional key suffixes (e.g. '0'..'9') listed in parallel as
+                ``prefix + shard``; by default the ``/`` sub-prefixes of ``prefix`` are
+                discovered and listed in parallel
+            max_workers (int): Listings running concurrently
+
+        Returns:
+            list: ``{'key', 'size', 'etag'}`` dicts sorted by key
+        """
+        if shards:
+            objects, sub_prefixes = [], [prefix + shard for shard in shards]
+        else:
+            objects, sub_prefixes = self.__list_prefix__(prefix, delimiter='/')
+        if sub_prefixes:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for shard_objects, _ in executor.map(self.__list_prefix__, sub_prefixes):
+                    objects.extend(shard_objects)
+        return sorted(objects, key=lambda obj: obj['key'])
+
+    def download_object(self, key_name: str, size=None, range_size=RANGE_SIZE, max_workers=8, retries=3):
+        """Downloads an object's content directly with the client, without a presigned URL
+
+        Objects larger than ``range_size`` are fetched as concurrent byte-range
+        GETs written into one preallocated buffer; each range is retried on its
+        own, so a dropped connection does not restart the whole object.
+
+        Args:
+            key_name (str): Key of the object
+            size (int): Object size, e.g. from ``list_objects``; looked up with a HEAD when omitted
+            range_size (int): Bytes per range request
+            max_workers (int): Range requests in flight for this object
+            retries (int): Attempts per range
+
+        Returns:
+            bytes or bytearray: The object's content
+        """
+        if size is None:
+            size = self.bucket_resource.head_object(Bucket=BUCKET_CONFIGS.BUCKET_NAME,
+                                                    Key=key_name)['ContentLength']
+        if size <= range_size:
+            return self.__with_retries__(self.__get_range__, key_name, None, retries=retries)
+
+        content = bytearray(size)
+        view = memoryview(content)
+        ranges = [(start, min(start + range_size, size) - 1) for start in range(0, size, range_size)]
+        try:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+                futures = [
+                    executor.submit(self.__with_retries__, self.__read_range_into__,
+                                    key_name, view[start:end + 1], start, end, retries=retries)
+                    for start, end in ranges
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            view.release()
+        return content
+
+    def __get_range__(self, key_name: str, byte_range):
+        params = {'Bucket': BUCKET_CONFIGS.BUCKET_NAME, 'Key': key_name}
+        if byte_range:
+            params['Range'] = byte_range
+        return self.bucket_resource.get_object(**params)['Body'].read()
+
+    def __read_range_into__(self, key_name: str, target, start: int, end: int):
+        data = self.__get_range__(key_name, f'bytes={start}-{end}')
+        if len(data) != len(target):
+            raise IOError(f'Short read for {key_name} bytes {start}-{end}: got {len(data)} bytes')
+        target[:] = data
+
+    def __with_retries__(self, func, *args, retries=3):
+        for attempt in range(retries):
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt == retries - 1:
+                    raise
+                print(f'RETRYING {func.__name__} FOR {args[0]} AFTER ERROR: {e}')
+                time.sleep(2 ** attempt)
+
     def download_file_get_content(self,url:str):
         file_name = unquote(urlparse(url).path.split('/')[-1]) 
         response = requests.get(url)
@@ -97,16 +339,17 @@ class S3Utils:
         """Uploads the file to s3
 
         Args:
-            file_name (str): Name of the file
-            file_path (str): Path to the file
+            key_name (str): Key of the object
+            data: bytes, a memoryview (uploaded without copying) or a file-like object
 
         Returns:
             bool: Based on the upload status will return a boolean value
         """
         try:
             key = f'{key_name}'
+            body = MemoryViewReader(data) if isinstance(data, memoryview) else data
             self.bucket_resource.put_object(
-                Body=data,
+                Body=body,
                 Bucket=BUCKET_CONFIGS.BUCKET_NAME,
                 Key=key_name,
                 # ACL='public-read'
@@ -122,6 +365,8 @@ class S3Utils:
             try:
                 self.__get_bucket_resource__(BUCKET_CONFIGS.BUCKET_REGION,
                                              BUCKET_CONFIGS.ROLE_SESSION)
+                if hasattr(data, 'seek'):
+                    data.seek(0)
                 return self.upload_file(key_name, data)
             except Exception as e:
                 print(
@@ -134,6 +379,93 @@ class S3Utils:
             print(f'TRACEBACK: {traceback.format_exc()}')
             return False, False, None
 
+    def upload_buffer(self, key_name: str, buf):
+        """Uploads a buffer filled by utils.buffer_pool.BufferPool
+
+        Args:
+            key_name (str): Key of the object
+            buf: The in-memory BytesIO or spilled temporary file holding the object
+
+        Returns:
+            tuple: Same as upload_file
+        """
+        body = buffer_body(buf)
+        try:
+            return self.upload_file(key_name, body)
+        finally:
+            if isinstance(body, memoryview):
+                body.release()
+
+    def upload_fileobj(self, key_name: str, fileobj):
+        """Streams a file-like object to s3, using multipart uploads for large bodies
+
+        Args:
+            key_name (str): Key of the object
+            fileobj: Readable binary file-like object, positioned at the start
+
+        Returns:
+            tuple: Key and a boolean upload status
+        """
+        try:
+            self.bucket_resource.upload_fileobj(fileobj, BUCKET_CONFIGS.BUCKET_NAME, key_name)
+            return key_name, True
+        except ClientError as cerr:
+            print(f'CLIENT ERROR WHEN UPLOADING FILE: {cerr}')
+            try:
+                self.__get_bucket_resource__(BUCKET_CONFIGS.BUCKET_REGION,
+                                             BUCKET_CONFIGS.ROLE_SESSION)
+                fileobj.seek(0)
+                return self.upload_fileobj(key_name, fileobj)
+            except Exception as e:
+                print(
+                    f'EXCEPTION IN INITIALIZING THE BUCKET RESOURCE IN CLIENT ERROR BLOCK (UPLOAD FILE): {str(e)}'
+                )
+                print(f'TRACEBACK: {traceback.format_exc()}')
+                return False, False
+        except Exception as e:
+            print(f'EXCEPTION WHILE UPLOADING THE FILE: {str(e)}')
+            print(f'TRACEBACK: {traceback.format_exc()}')
+            return False, False
+
+    def open_multipart_writer(self, key_name: str, part_size=8 * 1024 * 1024, max_workers=4):
+        """Opens a file-like writer that streams into a concurrent multipart upload
+
+        Args:
+            key_name (str): Key of the object
+            part_size (int): Bytes per part, at least 5 MiB
+            max_workers (int): Parts uploaded concurrently
+
+        Returns:
+            MultipartUploadWriter: Use it as a context manager so failures abort the upload
+        """
+        return MultipartUploadWriter(self.bucket_resource, key_name, part_size, max_workers)
+
+    def upload_stream(self, key_name: str, source, part_size=8 * 1024 * 1024, max_workers=4):
+        """Uploads an iterator of bytes or a readable file-like object with a concurrent multipart upload
+
+        Args:
+            key_name (str): Key of the object
+            source: Iterable of bytes chunks, or an object with a read method
+            part_size (int): Bytes per part, at least 5 MiB
+            max_workers (int): Parts uploaded concurrently
+
+        Returns:
+            dict: Upload summary with per-part throughput, or False if the upload failed and was aborted
+        """
+        try:
+            with self.open_multipart_writer(key_name, part_size, max_workers) as writer:
+                if hasattr(source, 'read'):
+                    for chunk in iter(lambda: source.read(part_size), b''):
+                        writer.write(chunk)
+                else:
+                    for chunk in source:
+                        writer.write(chunk)
+            return writer.summary()
+        except Exception as e:
+            print(f'EXCEPTION WHILE STREAMING THE FILE: {str(e)}')
+            print(f'TRACEBACK: {traceback.format_exc()}')
+            return False
+
     def __generate_presigned_url__(self, object_name, expiration=3600):
         # s3_client = boto3.client('s3')
         try:
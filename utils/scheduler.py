@@ -0,0 +1,76 @@
+import heapq
+import itertools
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
+
+class UnitsFailedError(RuntimeError):
+    """Raised once every unit has run when some still failed after all their retries."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        summary = ', '.join(f'{unit_id}: {error}' for unit_id, error in list(failures.items())[:5])
+        super().__init__(f"{len(failures)} unit(s) failed after retries: {summary}")
+
+
+def run_units(executor, submit, units, on_result, on_failure=None, retries=3, backoff=1.0, max_backoff=60.0):
+    """
+    Run work units on a pool, retrying failures with exponential backoff.
+
+    A failed unit is resubmitted once its backoff has elapsed while the rest
+    keep running, so one bad batch neither stalls nor tears down the pool.
+
+    :param executor: A ProcessPoolExecutor (or any Executor).
+    :param submit: ``submit(executor, payload)`` schedules a unit and returns its future.
+    :param units: ``(unit_id, payload)`` pairs to run.
+    :param on_result: ``on_result(unit_id, payload, result)`` handles a finished unit and
+        returns further ``(unit_id, payload)`` units to schedule (e.g. sub-partitions).
+    :param on_failure: Optional ``on_failure(unit_id, error, final)`` called on every failed attempt.
+    :param retries: Attempts after the first before a unit is given up on.
+    :raises UnitsFailedError: After all other units finished, if any unit exhausted its retries.
+    """
+    pending = {}
+    attempts = {}
+    delayed = []
+    failures = {}
+    # Breaks ties between retries due at the same time, so the heap never compares payloads
+    sequence = itertools.count()
+
+    def schedule(unit_id, payload):
+        pending[submit(executor, payload)] = (unit_id, payload)
+
+    for unit_id, payload in units:
+        schedule(unit_id, payload)
+
+    while pending or delayed:
+        now = time.time()
+        while delayed and delayed[0][0] <= now:
+            _, _, unit_id, payload = heapq.heappop(delayed)
+            schedule(unit_id, payload)
+        timeout = max(0.0, delayed[0][0] - now) if delayed else None
+        if not pending:
+            time.sleep(timeout)
+            continue
+
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            unit_id, payload = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                attempts[unit_id] = attempts.get(unit_id, 0) + 1
+                final = attempts[unit_id] > retries
+                if on_failure:
+                    on_failure(unit_id, e, final)
+                if final:
+                    failures[unit_id] = e
+                else:
+                    delay = min(max_backoff, backoff * 2 ** (attempts[unit_id] - 1))
+                    print(f"Unit {unit_id} failed ({e}); retry {attempts[unit_id]}/{retries} in {delay:.0f}s")
+                    heapq.heappush(delayed, (time.time() + delay, next(sequence), unit_id, payload))
+                continue
+            for child_id, child_payload in on_result(unit_id, payload, result) or []:
+                schedule(child_id, child_payload)
+
+    if failures:
+        raise UnitsFailedError(failures)
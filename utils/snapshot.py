@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+
+from utils.worker_connection import get_worker_connection
+
+# Barrier the MySQL warm-up tasks meet at; pool workers inherit it through the initializer
+_snapshot_barrier = None
+
+
+class SnapshotCoordinator:
+    """
+    Pins every pool worker to one point-in-time view of the source.
+
+    Postgres-compatible sources export the snapshot of a REPEATABLE READ
+    transaction held open on the coordinator connection, and each worker
+    imports it with SET TRANSACTION SNAPSHOT from the pool initializer.
+
+    MySQL cannot share a snapshot between sessions. Once every worker has
+    connected, the coordinator takes a global read lock, every worker starts a
+    consistent-snapshot transaction and meets the others at a barrier, and only
+    then is the lock released. With writes blocked in between, all workers
+    start from the same state.
+
+    Redshift cannot export snapshots, so snapshot mode needs PostgreSQL or MySQL.
+
+    The coordinator joins the snapshot as well, so plans read through
+    ``connector`` see the same data as the workers. It must stay open until
+    the pool has finished.
+    """
+
+    def __init__(self, max_workers, connector_factory, *factory_args, timeout=120):
+        self.max_workers = max_workers
+        self.connector_factory = connector_factory
+        self.factory_args = factory_args
+        # Seconds the MySQL warm-up waits for every worker before giving up
+        self.timeout = timeout
+        self.connector = None
+        self.snapshot_id = None
+        self.barrier = None
+
+    def open(self):
+        self.connector = self.connector_factory(*self.factory_args)
+        self.connector.open_connection()
+        if self.connector.connection is None:
+            raise RuntimeError("Could not open the snapshot coordinator connection")
+        if hasattr(self.connector, 'export_snapshot'):
+            try:
+                self.snapshot_id = self.connector.export_snapshot()
+            except Exception:
+                self.connector.close_connection()
+                self.connector = None
+                raise
+            print(f"Exported snapshot {self.snapshot_id}")
+        else:
+            self.barrier = multiprocessing.Barrier(self.max_workers)
+        return self
+
+    def pool_args(self):
+        """``initializer`` and ``initargs`` for the ProcessPoolExecutor extracting from the snapshot."""
+        return {
+            'initializer': init_snapshot_worker,
+            'initargs': (self.snapshot_id, self.barrier, self.connector_factory) + self.factory_args,
+        }
+
+    def synchronize(self, executor):
+        """Start the workers' MySQL snapshots in lockstep; call before submitting any work."""
+        if self.barrier is None:
+            return
+        # Spawn and connect the whole pool first, so writes are only blocked while the snapshots start
+        futures = [executor.submit(wait_for_pool, self.timeout) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+        self.connector.lock_for_snapshot()
+        try:
+            self.connector.start_snapshot()
+            # A worker blocks at the barrier until all have joined, so each one takes exactly one task
+            futures = [executor.submit(join_snapshot, self.timeout, self.connector_factory, *self.factory_args)
+                       for _ in range(self.max_workers)]
+            pids = {future.result() for future in futures}
+        finally:
+            self.connector.unlock_tables()
+        print(f"{len(pids)} workers started a consistent snapshot")
+
+    def close(self):
+        if self.connector is not None:
+            try:
+                self.connector.end_snapshot()
+            finally:
+                self.connector.close_connection()
+                self.connector = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def init_snapshot_worker(snapshot_id, barrier, connector_factory, *factory_args):
+    """ProcessPoolExecutor initializer for snapshot mode: connect and import an exported snapshot."""
+    global _snapshot_barrier
+    _snapshot_barrier = barrier
+    worker_connection = get_worker_connection(connector_factory, *factory_args)
+    worker_connection.snapshot_required = True
+    if snapshot_id is not None:
+        worker_connection.join_snapshot(snapshot_id)
+    else:
+        # Connected now, before the coordinator takes the global read lock
+        worker_connection.connect()
+
+
+def wait_for_pool(timeout):
+    """Warm-up task: return once every worker of the pool has started and connected."""
+    _snapshot_barrier.wait(timeout)
+    return os.getpid()
+
+
+def join_snapshot(timeout, connector_factory, *factory_args):
+    """Warm-up task: start this worker's consistent snapshot, then wait for the rest of the pool."""
+    get_worker_connection(connector_factory, *factory_args).join_snapshot()
+    _snapshot_barrier.wait(timeout)
+    return os.getpid()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+
+class SpilledFrames:
+    """
+    Frames written to local Arrow IPC files so a reduction can revisit them
+    in any order without holding them all in memory.
+
+    Files are memory-mapped on read, so ``frames[i]`` only costs the
+    conversion back into the backend's DataFrame. Call ``cleanup`` (or use
+    the object as a context manager) to delete the files.
+    """
+
+    def __init__(self, backend, spill_dir=None):
+        self.backend = backend
+        self.spill_dir = tempfile.mkdtemp(prefix='loader_spill_', dir=spill_dir)
+        self.paths = []
+        self.rows = []
+
+    def append(self, frame):
+        table = self.backend.to_arrow(frame)
+        path = os.path.join(self.spill_dir, f'frame_{len(self.paths)}.arrow')
+        with pa.OSFile(path, 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        self.paths.append(path)
+        self.rows.append(table.num_rows)
+
+    def read_table(self, idx):
+        with pa.memory_map(self.paths[idx], 'r') as source:
+            return ipc.open_file(source).read_all()
+
+    def __getitem__(self, idx):
+        return self.backend.from_arrow(self.read_table(idx))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        for idx in range(len(self.paths)):
+            yield self[idx]
+
+    def cleanup(self):
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+        self.paths = []
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
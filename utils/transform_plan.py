@@ -0,0 +1,154 @@
+import pickle
+from itertools import repeat
+
+import pandas as pd
+
+from utils.backends import cudf
+
+
+def _multiply(series, value):
+    return series * value
+
+
+def _add(series, value):
+    return series + value
+
+
+def _divide(series, value):
+    return series / value
+
+
+def _strip(series):
+    return series.str.strip()
+
+
+def _lower(series):
+    return series.str.lower()
+
+
+def _upper(series):
+    return series.str.upper()
+
+
+def _replace(series, pattern, repl, regex=False):
+    return series.str.replace(pattern, repl, regex=regex)
+
+
+def _slice(series, start=None, stop=None):
+    return series.str.slice(start, stop)
+
+
+def _to_datetime(series, format=None):
+    if cudf is not None and isinstance(series, cudf.Series):
+        return cudf.to_datetime(series, format=format)
+    return pd.to_datetime(series, format=format)
+
+
+def _map(series, mapping, default=None):
+    mapped = series.map(mapping)
+    return mapped.fillna(default) if default is not None else mapped
+
+
+def _fillna(series, value):
+    return series.fillna(value)
+
+
+# Vectorized expressions, referenced by name from a spec's ``expression``
+EXPRESSIONS = {
+    'multiply': _multiply,
+    'add': _add,
+    'divide': _divide,
+    'strip': _strip,
+    'lower': _lower,
+    'upper': _upper,
+    'replace': _replace,
+    'slice': _slice,
+    'to_datetime': _to_datetime,
+    'map': _map,
+    'fillna': _fillna,
+}
+
+
+def _apply_chunk(chunk, func):
+    return chunk.map(func)
+
+
+class TransformPlan:
+    """
+    A list of transformation specs compiled into one batched rename, the
+    vectorized expressions, and one cast pass.
+
+    Each spec is a dict as accepted by ``JsonToGDFLoader.transform_gdf``:
+
+    - ``from_column_name`` / ``to_column_name``: rename, applied first and all at once.
+    - ``expression``: ``{'op': <name in EXPRESSIONS>, **params}`` or a list of them,
+      applied in order to the (renamed) column, e.g. ``{'op': 'multiply', 'value': 2}``
+      or ``{'op': 'map', 'mapping': {'Y': True, 'N': False}}``.
+    - ``transformation_function``: a per-value Python callable, used only when there is
+      no ``expression``. It runs in chunks on ``executor`` when given (the callable must
+      then be picklable, i.e. a module-level function), otherwise in-process.
+    - ``type_update``: dtype cast, applied last in a single ``astype`` call.
+
+    A plan holds no frame state, so one instance can be reused for every part of a load.
+    """
+
+    def __init__(self, transformations, executor=None, chunk_rows=100000):
+        self.executor = executor
+        self.chunk_rows = chunk_rows
+        self.renames = {}
+        self.expressions = []
+        self.functions = []
+        self.casts = {}
+        for transform in transformations or []:
+            from_column = transform.get('from_column_name')
+            to_column = transform.get('to_column_name') or from_column
+            if from_column != to_column:
+                self.renames[from_column] = to_column
+            expression = transform.get('expression')
+            if expression:
+                steps = expression if isinstance(expression, list) else [expression]
+                for step in steps:
+                    params = dict(step)
+                    op = params.pop('op')
+                    if op not in EXPRESSIONS:
+                        raise ValueError(f"Unknown transformation expression: {op}")
+                    self.expressions.append((to_column, EXPRESSIONS[op], params))
+            elif transform.get('transformation_function'):
+                self.functions.append((to_column, transform['transformation_function']))
+            if transform.get('type_update'):
+                self.casts[to_column] = transform['type_update']
+
+    def apply(self, gdf):
+        """Apply the plan to a pandas or cuDF DataFrame and return the transformed frame."""
+        renames = {src: dst for src, dst in self.renames.items() if src in gdf.columns}
+        # Column assignment below must not write through to the caller's frame
+        gdf = gdf.rename(columns=renames) if renames else gdf.copy(deep=False)
+        for column, expression, params in self.expressions:
+            if column in gdf.columns:
+                gdf[column] = expression(gdf[column], **params)
+        for column, func in self.functions:
+            if column in gdf.columns:
+                gdf[column] = self.apply_function(gdf[column], func)
+        casts = {column: dtype for column, dtype in self.casts.items() if column in gdf.columns}
+        if casts:
+            gdf = gdf.astype(casts)
+        return gdf
+
+    def apply_function(self, series, func):
+        """Fallback for arbitrary callables: map per value, in process-pool chunks when possible."""
+        on_gpu = cudf is not None and isinstance(series, cudf.Series)
+        values = series.to_pandas() if on_gpu else series
+        if self.executor is not None and len(values) > self.chunk_rows and self.is_picklable(func):
+            chunks = [values.iloc[start:start + self.chunk_rows] for start in range(0, len(values), self.chunk_rows)]
+            result = pd.concat(list(self.executor.map(_apply_chunk, chunks, repeat(func))))
+        else:
+            result = values.map(func)
+        return cudf.Series.from_pandas(result) if on_gpu else result
+
+    @staticmethod
+    def is_picklable(func):
+        try:
+            pickle.dumps(func)
+            return True
+        except Exception:
+            return False
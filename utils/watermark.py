@@ -0,0 +1,61 @@
+import hashlib
+from datetime import date, datetime
+from decimal import Decimal
+
+
+def watermark_query_id(db, query, watermark_column):
+    """Stable id of an incrementally extracted source query, used as its watermark state key."""
+    return hashlib.md5(f"{db.lower()}\n{watermark_column}\n{query.strip()}".encode('utf-8')).hexdigest()
+
+
+def sql_literal(value):
+    """
+    Render a watermark bound as a SQL literal both MySQL and Redshift/Postgres accept.
+
+    The bound is inlined because the batch, keyset and range wrappers add their own
+    parameters around the query. Only the watermark column types we extract on are
+    supported: integers, decimals, floats, dates and timestamps.
+    """
+    if isinstance(value, bool):
+        raise TypeError("Cannot use a boolean column as a watermark")
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, datetime):
+        return f"'{value.isoformat(sep=' ')}'"
+    if isinstance(value, date):
+        return f"'{value.isoformat()}'"
+    raise TypeError(f"Unsupported watermark column type: {type(value).__name__}")
+
+
+def add_watermark(query, watermark_column, lower=None, upper=None):
+    """
+    Restrict a query to ``lower < watermark_column <= upper``; a None bound is left open.
+
+    Rows whose watermark is NULL never fall in a window, so they are not extracted.
+    """
+    conditions = []
+    if lower is not None:
+        conditions.append(f"{watermark_column} > {sql_literal(lower)}")
+    if upper is not None:
+        conditions.append(f"{watermark_column} <= {sql_literal(upper)}")
+    if not conditions:
+        return query
+    return f"SELECT * FROM ({query}) AS watermark_subquery WHERE {' AND '.join(conditions)}"
+
+
+def window_lower(watermark, overlap=None):
+    """
+    Lower bound of the next window: the last watermark, moved back by ``overlap``.
+
+    :param overlap: Re-read window for late writes, a ``timedelta`` for timestamp
+        watermarks or a number for ids. Rows in it that were already exported are
+        exported again, so readers should dedupe on the key column.
+    """
+    if watermark is None or not overlap:
+        return watermark
+    return watermark - overlap
+
+
+def increment_prefix(prefix, sequence):
+    """Key prefix of the ``sequence``-th run appending to an export, see ``utils.prefetch.part_sort_key``."""
+    return f"{prefix}_inc_{sequence:06d}"
@@ -0,0 +1,110 @@
+import os
+import time
+from multiprocessing import util
+
+# One connection per process; pool workers reuse it for every batch they handle
+_worker_connection = None
+
+
+class WorkerConnection:
+    """
+    A connector that stays open for the lifetime of a pool worker.
+
+    The connection is opened lazily, reopened once if a call fails, and the
+    time spent connecting versus fetching is tracked per worker. In snapshot
+    mode (see ``utils.snapshot``) the connection is never reopened: a new one
+    would read a newer state than the rest of the pool.
+    """
+
+    def __init__(self, connector_factory, *factory_args):
+        self.connector_factory = connector_factory
+        self.factory_args = factory_args
+        self.connector = None
+        self.snapshot_required = False
+        self.in_snapshot = False
+        self.stats = {
+            'pid': os.getpid(),
+            'connects': 0,
+            'calls': 0,
+            'connect_time': 0.0,
+            'fetch_time': 0.0,
+        }
+
+    def connect(self):
+        st_time = time.time()
+        self.connector = self.connector_factory(*self.factory_args)
+        self.connector.open_connection()
+        self.stats['connect_time'] += time.time() - st_time
+        self.stats['connects'] += 1
+
+    def join_snapshot(self, snapshot_id=None):
+        """Import the exported ``snapshot_id`` (Postgres), or start a consistent snapshot (MySQL)."""
+        if self.connector is None or self.connector.connection is None:
+            self.connect()
+        if self.connector.connection is None:
+            raise RuntimeError(f"Worker {self.stats['pid']} could not connect to join the snapshot")
+        if snapshot_id is not None:
+            self.connector.use_snapshot(snapshot_id)
+        else:
+            self.connector.start_snapshot()
+        self.in_snapshot = True
+
+    def run(self, method_name, *args, **kwargs):
+        """Call ``method_name`` on the connector, reconnecting once if it fails."""
+        if self.snapshot_required and not self.in_snapshot:
+            raise RuntimeError(f"Worker {self.stats['pid']} has not joined the export snapshot")
+        if self.connector is None or self.connector.connection is None:
+            self.connect()
+        st_time = time.time()
+        try:
+            result = getattr(self.connector, method_name)(*args, **kwargs)
+        except Exception as e:
+            if self.snapshot_required:
+                raise RuntimeError(f"Worker {self.stats['pid']} lost its snapshot transaction; "
+                                   f"reconnecting would break the point-in-time view: {e}") from e
+            # The server may have dropped an idle connection between batches
+            print(f"Worker {self.stats['pid']} reconnecting after error: {e}")
+            self.close()
+            self.connect()
+            st_time = time.time()
+            result = getattr(self.connector, method_name)(*args, **kwargs)
+        self.stats['fetch_time'] += time.time() - st_time
+        self.stats['calls'] += 1
+        return result
+
+    def close(self):
+        if self.connector is not None:
+            try:
+                self.connector.close_connection()
+            except Exception as e:
+                print(f"Error while closing worker connection: {e}")
+            self.connector = None
+            self.in_snapshot = False
+
+    def report(self):
+        stats = self.stats
+        print(f"Worker {stats['pid']}: {stats['calls']} calls, {stats['connects']} connects, "
+              f"connect time {stats['connect_time']:.2f}s, fetch time {stats['fetch_time']:.2f}s")
+
+
+def init_worker(connector_factory, *factory_args):
+    """ProcessPoolExecutor initializer: open this worker's connection up front."""
+    get_worker_connection(connector_factory, *factory_args).connect()
+
+
+def get_worker_connection(connector_factory, *factory_args):
+    """Return this process' WorkerConnection, creating it on first use."""
+    global _worker_connection
+    if _worker_connection is None:
+        _worker_connection = WorkerConnection(connector_factory, *factory_args)
+        # Pool workers exit through multiprocessing, which skips atexit but runs finalizers
+        util.Finalize(None, shutdown_worker, exitpriority=10)
+    return _worker_connection
+
+
+def shutdown_worker():
+    global _worker_connection
+    if _worker_connection is not None:
+        _worker_connection.close()
+        _worker_connection.report()
+        _worker_connection = None